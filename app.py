@@ -1,6 +1,6 @@
 import streamlit as st
-import psycopg2
-from utils import auth, admin
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from utils import analytics, auth, admin, cache, catalog, db, images, metrics, reader, recommendations, search, textstore, writes
 from utils.helpers import require_role
 import os
 from dotenv import load_dotenv
@@ -15,146 +15,310 @@ DB_CONFIG = {
     "password": os.getenv("DB_PASSWORD")
 }
 
+# Эндпоинт /metrics для Prometheus (запускается один раз, если задан METRICS_PORT)
+metrics.start_http_server(extra_gauges=lambda: admin.metrics_gauges(DB_CONFIG))
+
+def current_user_id():
+    """Пользователь текущего запуска скрипта; в фоновых потоках и вне streamlit - None."""
+    if get_script_run_ctx(suppress_warning=True) is None:
+        return None
+    return st.session_state.get("user_id")
+
+# После записи пользователь читает с основного сервера, пока реплики ее не получат
+db.set_session_key(current_user_id)
+
+# Свертки статистики для панели аналитики обновляются в фоне
+analytics.start(DB_CONFIG)
+
+# Размер страницы каталога по умолчанию
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", "20"))
+CATALOG_PAGE_SIZES = [10, 20, 50, 100]
+
+# Порядки сортировки каталога: столбцы ключа keyset-пагинации и направление
+CATALOG_SORTS = {
+    "По названию": (("c.title", "c.book_id"), "ASC"),
+    "Сначала новые": (("c.book_id",), "DESC"),
+    "Сначала старые": (("c.book_id",), "ASC"),
+}
+# Позиции столбцов ключа в строке, которую возвращает load_books_page
+CATALOG_KEY_POSITIONS = {"c.book_id": 0, "c.title": 1}
+
+# Размер страницы ленты комментариев
+COMMENTS_PAGE_SIZE = int(os.getenv("COMMENTS_PAGE_SIZE", "20"))
+
+# Частые запросы готовятся на сервере один раз на соединение (PREPARE/EXECUTE),
+# чтобы Postgres не разбирал и не планировал их заново при каждом вызове
+BOOKS_QUERY = """
+    SELECT c.book_id, c.title, c.date, c.author_id, c.description, b.number_of_likes, b.number_of_comments, c.book_cover,
+           c.age_categories
+    FROM catalog c
+    JOIN books b ON b.book_id = c.book_id
+"""
+LOAD_BOOKS = db.prepared("load_books", BOOKS_QUERY)
+SEARCH_BOOKS = db.prepared("load_books_search", f"""{BOOKS_QUERY}
+    WHERE {search.BOOK_SEARCH_CONDITION}
+    ORDER BY {search.BOOK_SEARCH_RANK} DESC, b.book_id
+""")
+LOAD_COMMENTS = db.prepared(
+    "load_comments", "SELECT user_id, comment_text, date FROM comments WHERE book_id = %s ORDER BY date DESC"
+)
+
+@cache.cached("books")
 def load_books(search_term=None):
-    """Загрузка книг из базы данных с учетом поиска, включая возрастную категорию."""
-    connection = psycopg2.connect(**DB_CONFIG)
-    cursor = connection.cursor()
+    """Загрузка книг из каталога с учетом поиска: одна строка на книгу, возрастные категории через запятую."""
+    with db.cursor(DB_CONFIG) as cursor:
+        if search_term:
+            cursor.execute(SEARCH_BOOKS, search.search_params(search_term))
+        else:
+            cursor.execute(LOAD_BOOKS)
+        return cursor.fetchall()
+
+@cache.cached("books")
+def load_books_page(search_term=None, sort="По названию", page_size=CATALOG_PAGE_SIZE, after=None, before=None, genres=(), ages=()):
+    """Загрузка одной страницы каталога с keyset-пагинацией.
+
+    after — ключ последней книги предыдущей страницы (переход вперед),
+    before — ключ первой книги следующей страницы (переход назад).
+    genres, ages — фильтры по жанрам и возрастным категориям (книга подходит,
+    если у нее есть хотя бы один из выбранных).
+    Возвращает (книги, есть_предыдущая, есть_следующая).
+    """
+    columns, direction = CATALOG_SORTS[sort]
+    key = ", ".join(columns)
+    backwards = before is not None
+    if backwards:
+        direction = "DESC" if direction == "ASC" else "ASC"
+    comparison = ">" if direction == "ASC" else "<"
+
+    conditions = []
+    params = {"limit": page_size + 1}
     if search_term:
-        cursor.execute("""
-            SELECT b.book_id, b.title, b.date, b.author_id, b.description, b.number_of_likes, b.number_of_comments, b.book_cover, 
-                   ac.category_characteristic 
-            FROM books b
-            LEFT JOIN age_categories_of_books acb ON b.book_id = acb.book_id
-            LEFT JOIN age_category ac ON ac.age_id = acb.age_id
-            WHERE b.title ILIKE %s
-        """, (f'%{search_term}%',))
-    else:
-        cursor.execute("""
-            SELECT b.book_id, b.title, b.date, b.author_id, b.description, b.number_of_likes, b.number_of_comments, b.book_cover, 
-                   ac.category_characteristic 
-            FROM books b
-            LEFT JOIN age_categories_of_books acb ON b.book_id = acb.book_id
-            LEFT JOIN age_category ac ON ac.age_id = acb.age_id
-        """)
-    books = cursor.fetchall()
-    cursor.close()
-    connection.close()
-    return books
+        conditions.append(search.BOOK_SEARCH_CONDITION)
+        params.update(search.search_params(search_term))
+    # Фильтры по фасетам обслуживаются GIN-индексами представления catalog
+    if genres:
+        conditions.append("c.genre_ids && %(genres)s::int[]")
+        params["genres"] = list(genres)
+    if ages:
+        conditions.append("c.age_ids && %(ages)s::int[]")
+        params["ages"] = list(ages)
+    cursor_key = before if backwards else after
+    if cursor_key is not None:
+        conditions.append(f"({key}) {comparison} %(cursor)s")
+        params["cursor"] = tuple(cursor_key)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    order = ", ".join(f"{column} {direction}" for column in columns)
+
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute(f"""
+            SELECT {catalog.CATALOG_COLUMNS}
+            FROM catalog c
+            JOIN books b ON b.book_id = c.book_id
+            {where}
+            ORDER BY {order}
+            LIMIT %(limit)s
+        """, params)
+        books = cursor.fetchall()
+
+    has_more = len(books) > page_size
+    books = books[:page_size]
+    if backwards:
+        books.reverse()
+        return books, has_more, True
+    return books, after is not None, has_more
+
+@cache.cached("books")
+def load_book(book_id):
+    """Одна книга в формате строки каталога (для обновления панели книги после лайка или комментария)."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute(f"""
+            SELECT {catalog.CATALOG_COLUMNS}
+            FROM catalog c
+            JOIN books b ON b.book_id = c.book_id
+            WHERE c.book_id = %s
+        """, (book_id,))
+        return cursor.fetchone()
 
+@cache.cached("catalog")
+def load_facets():
+    """Фасеты каталога (жанры и возрастные категории с числом книг) из предрассчитанного представления."""
+    return catalog.load_facets(DB_CONFIG)
+
+def catalog_key(book, sort):
+    """Ключ keyset-пагинации для книги из load_books_page."""
+    columns, _ = CATALOG_SORTS[sort]
+    return tuple(book[CATALOG_KEY_POSITIONS[column]] for column in columns)
+
+@cache.cached("comments:{book_id}")
 def load_comments(book_id):
     """Загрузка комментариев к книге из базы данных."""
-    connection = psycopg2.connect(**DB_CONFIG)
-    cursor = connection.cursor()
-    cursor.execute("SELECT user_id, comment_text, date FROM comments WHERE book_id = %s ORDER BY date DESC", (book_id,))
-    comments = cursor.fetchall()
-    cursor.close()
-    connection.close()
-    return comments
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute(LOAD_COMMENTS, (book_id,))
+        return cursor.fetchall()
 
 def add_comment(book_id, user_id, comment_text):
-    """Добавление нового комментария к книге."""
-    connection = psycopg2.connect(**DB_CONFIG)
-    cursor = connection.cursor()
-    cursor.execute("INSERT INTO comments (book_id, user_id, comment_text, date) VALUES (%s, %s, %s, NOW())", (book_id, user_id, comment_text,))
-    connection.commit()
-    cursor.close()
-    connection.close()
+    """Добавление нового комментария к книге (счетчик books.number_of_comments обновляет триггер).
+
+    Комментарий записывается очередью записи вместе с другими; кэш сбрасывает она же.
+    """
+    added = writes.submit(DB_CONFIG, "comment", user_id, book_id, comment_text)
+    if added:
+        db.remember_write()
+    return added
+
+def load_comments_feed(page_size=COMMENTS_PAGE_SIZE, before=None):
+    """Страница ленты комментариев от новых к старым.
+
+    before — ключ (date, book_id, user_id) самого старого уже показанного
+    комментария. Возвращает (комментарии, есть_еще).
+    """
+    condition = "WHERE (c.date, c.book_id, c.user_id) < %s" if before is not None else ""
+    params = ((tuple(before),) if before is not None else ()) + (page_size + 1,)
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute(f"""
+            SELECT c.date, c.book_id, c.user_id, b.title, c.comment_text
+            FROM comments c
+            JOIN books b ON c.book_id = b.book_id
+            {condition}
+            ORDER BY c.date DESC, c.book_id DESC, c.user_id DESC
+            LIMIT %s
+        """, params)
+        comments = cursor.fetchall()
+    return comments[:page_size], len(comments) > page_size
+
+def load_comments_since(after):
+    """Комментарии новее ключа (date, book_id, user_id), от новых к старым."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("""
+            SELECT c.date, c.book_id, c.user_id, b.title, c.comment_text
+            FROM comments c
+            JOIN books b ON c.book_id = b.book_id
+            WHERE (c.date, c.book_id, c.user_id) > %s
+            ORDER BY c.date DESC, c.book_id DESC, c.user_id DESC
+        """, (tuple(after),))
+        return cursor.fetchall()
 
+@cache.cached("authors")
 def load_authors(search_term=None):
     """Загрузка авторов из базы данных с учетом поиска."""
-    connection = psycopg2.connect(**DB_CONFIG)
-    cursor = connection.cursor()
-    if search_term:
-        cursor.execute("SELECT author_id, fullname, biography FROM authors WHERE fullname ILIKE %s", (f'%{search_term}%',))
-    else:
-        cursor.execute("SELECT author_id, fullname, biography FROM authors")
-    authors = cursor.fetchall()
-    cursor.close()
-    connection.close()
-    return authors
-
-def load_user_favorites_books(user_id):
-    """Загрузка любимых книг пользователя."""
-    connection = psycopg2.connect(**DB_CONFIG)
-    cursor = connection.cursor()
-    cursor.execute("""
-        SELECT b.book_id, b.title, b.book_cover 
-        FROM liked_books lb 
-        JOIN books b ON lb.book_id = b.book_id 
-        WHERE lb.user_id = %s
-    """, (user_id,))
-    favorites = cursor.fetchall()
-    cursor.close()
-    connection.close()
-    return favorites
-
-def load_user_favorites_authors(user_id):
-    """Загрузка любимых авторов пользователя."""
-    connection = psycopg2.connect(**DB_CONFIG)
-    cursor = connection.cursor()
-    cursor.execute("""
-        SELECT DISTINCT a.author_id, a.fullname 
-        FROM liked_books lb 
-        JOIN books b ON lb.book_id = b.book_id 
-        JOIN authors a ON b.author_id = a.author_id 
-        WHERE lb.user_id = %s
-    """, (user_id,))
-    favorites = cursor.fetchall()
-    cursor.close()
-    connection.close()
-    return favorites
+    with db.cursor(DB_CONFIG) as cursor:
+        if search_term:
+            cursor.execute(f"""
+                SELECT a.author_id, a.fullname, a.biography
+                FROM authors a
+                WHERE {search.AUTHOR_SEARCH_CONDITION}
+                ORDER BY {search.AUTHOR_SEARCH_RANK} DESC, a.author_id
+            """, search.search_params(search_term))
+        else:
+            cursor.execute("SELECT author_id, fullname, biography FROM authors")
+        return cursor.fetchall()
+
+def load_user_favorites(user_id):
+    """Любимые книги (с обложкой и автором) и любимые авторы пользователя одним запросом."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("""
+            SELECT 'book', b.book_id, b.title, b.book_cover, a.fullname
+            FROM liked_books lb
+            JOIN books b ON lb.book_id = b.book_id
+            JOIN authors a ON b.author_id = a.author_id
+            WHERE lb.user_id = %(user_id)s
+            UNION ALL
+            SELECT 'author', a.author_id, a.fullname, NULL, NULL
+            FROM favorite_authors fa
+            JOIN authors a ON fa.author_id = a.author_id
+            WHERE fa.user_id = %(user_id)s
+        """, {"user_id": user_id})
+        rows = cursor.fetchall()
+    books = [row[1:] for row in rows if row[0] == 'book']
+    authors = [row[1:3] for row in rows if row[0] == 'author']
+    return books, authors
 
 def load_book_text(book_id):
-    """Загрузка текста книги по ID."""
-    connection = psycopg2.connect(**DB_CONFIG)
-    cursor = connection.cursor()
-    cursor.execute("SELECT book_text FROM book_texts WHERE book_id = %s", (book_id,))
-    text = cursor.fetchone()
-    cursor.close()
-    connection.close()
-    return text[0] if text else None
+    """Загрузка текста книги по ID (из сжатого файла или из book_texts)."""
+    return textstore.load_text(DB_CONFIG, book_id)
 
 def add_like_to_book(user_id, book_id):
-    """Добавить лайк к книге пользователем."""
-    connection = psycopg2.connect(**DB_CONFIG)
-    cursor = connection.cursor()
-
-    # Проверка, поставлен ли уже лайк
+    """Добавить лайк к книге пользователем.
 
-    cursor.execute("SELECT COUNT(*) FROM liked_books WHERE user_id = %s AND book_id = %s", (user_id, book_id,))
-    count = cursor.fetchone()[0]
+    Лайк записывается очередью записи пачкой с другими: повторный лайк
+    отбрасывается ON CONFLICT, а счетчик books.number_of_likes обновляет триггер.
+    """
+    added = writes.submit(DB_CONFIG, "like", user_id, book_id)
 
-    if count == 0:
-        # Если нет, то добавляем
-        cursor.execute("INSERT INTO liked_books (user_id, book_id) VALUES (%s, %s)", (user_id, book_id,))
-        cursor.execute("UPDATE books SET number_of_likes = number_of_likes + 1 WHERE book_id = %s", (book_id,))
-        connection.commit()
+    if added:
+        db.remember_write()
         st.success("Вы поставили лайк на книгу!")
     else:
         st.warning("Вы уже поставили лайк на эту книгу.")
+    return added
 
-    cursor.close()
-    connection.close()
+def remove_like_from_book(user_id, book_id):
+    """Убрать лайк пользователя с книги (через очередь записи; счетчик обновляет триггер)."""
+    removed = writes.submit(DB_CONFIG, "unlike", user_id, book_id)
+
+    if removed:
+        db.remember_write()
+    return removed
+
+@cache.cached("recommendations")
+def load_recommendations(book_ids):
+    """Похожие книги для книг страницы из предрассчитанной таблицы (один запрос)."""
+    return recommendations.for_books(DB_CONFIG, list(book_ids))
+
+@cache.cached("recommendations", "likes:{user_id}")
+def load_user_recommendations(user_id):
+    """Рекомендации по всем лайкам пользователя."""
+    return recommendations.for_user(DB_CONFIG, user_id)
+
+def load_liked_book_ids(user_id, book_ids):
+    """Какие из книг book_ids лайкнул пользователь (один запрос на страницу)."""
+    if not book_ids:
+        return set()
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("SELECT book_id FROM liked_books WHERE user_id = %s AND book_id = ANY(%s)", (user_id, list(book_ids)))
+        return {row[0] for row in cursor.fetchall()}
+
+def add_favorite_authors(user_id, author_ids):
+    """Добавить нескольких авторов в любимые одним запросом; возвращает число добавленных."""
+    if not author_ids:
+        return 0
+    with db.transaction(DB_CONFIG) as cursor:
+        cursor.execute("""
+            INSERT INTO favorite_authors (user_id, author_id)
+            SELECT %s, author_id FROM unnest(%s::int[]) AS author_id
+            ON CONFLICT DO NOTHING
+            RETURNING author_id
+        """, (user_id, list(author_ids)))
+        return len(cursor.fetchall())
+
+def remove_favorite_authors(user_id, author_ids):
+    """Убрать нескольких авторов из любимых одним запросом; возвращает число удаленных."""
+    if not author_ids:
+        return 0
+    with db.transaction(DB_CONFIG) as cursor:
+        cursor.execute(
+            "DELETE FROM favorite_authors WHERE user_id = %s AND author_id = ANY(%s)",
+            (user_id, list(author_ids))
+        )
+        return cursor.rowcount
+
+def load_favorite_author_ids(user_id, author_ids):
+    """Какие из авторов author_ids отмечены пользователем как любимые."""
+    if not author_ids:
+        return set()
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute(
+            "SELECT author_id FROM favorite_authors WHERE user_id = %s AND author_id = ANY(%s)",
+            (user_id, list(author_ids))
+        )
+        return {row[0] for row in cursor.fetchall()}
 
 def add_favorite_author(user_id, author_id):
     """Добавить автора в любимые."""
-    connection = psycopg2.connect(**DB_CONFIG)
-    cursor = connection.cursor()
-
-    # Проверка, отмечен ли уже автор как любимый
-    cursor.execute("SELECT COUNT(*) FROM liked_books WHERE user_id = %s AND book_id IN (SELECT book_id FROM books WHERE author_id = %s)", (user_id, author_id,))
-    count = cursor.fetchone()[0]
-
-    if count == 0:
-        # Если нет, то добавляем
-        cursor.execute("INSERT INTO liked_books (user_id, book_id) SELECT %s, book_id FROM books WHERE author_id = %s", (user_id, author_id,))
-        connection.commit()
-        st.success("Авторы добавлены в ваши любимые!")
+    if add_favorite_authors(user_id, [author_id]):
+        st.success("Автор добавлен в ваши любимые!")
     else:
-        st.warning("Эти авторы уже добавлены в ваши любимые.")
-
-    cursor.close()
-    connection.close()
+        st.warning("Этот автор уже добавлен в ваши любимые.")
 
 def main():
     st.title("Онлайн Библиотека")
@@ -162,99 +326,263 @@ def main():
     # Создание страниц
     page = st.sidebar.selectbox("Выберите страницу", ["Login", "Register", "Books", "Authors", "Favorites", "Comments", "Admin"])
 
-    if page == "Login":
-        auth.login_page(DB_CONFIG)
-    elif page == "Register":
-        auth.register_page(DB_CONFIG)
-    elif page == "Books":
-        book_search = st.text_input("Поиск по книгам", "")
-        books = load_books(book_search)
-        book_page(books)
-    elif page == "Authors":
-        author_search = st.text_input("Поиск по авторам", "")
-        authors = load_authors(author_search)
-        author_page(authors)
-    elif page == "Favorites":
-        user_id = st.session_state.get("user_id")
-        if user_id:
-            favorites_books = load_user_favorites_books(user_id)
-            favorites_authors = load_user_favorites_authors(user_id)
-            favorites_page(favorites_books, favorites_authors)
-        else:
-            st.error("Сначала выполните вход.")
-    elif page == "Comments":
-        comments_page()
-    elif page == "Admin":
-        auth_user = auth.get_authenticated_user()
-        if auth_user and auth_user['role'] == 'admin':
-            admin.admin_page(DB_CONFIG)
-        else:
-            st.error("У вас нет доступа к этой странице.")
+    # Время отрисовки каждой страницы попадает в метрики
+    with metrics.timed(f"page:{page}"):
+        if page == "Login":
+            auth.login_page(DB_CONFIG)
+        elif page == "Register":
+            auth.register_page(DB_CONFIG)
+        elif page == "Books":
+            book_search = st.text_input("Поиск по книгам", "")
+            in_texts = st.checkbox("Искать в текстах книг")
+            sort = st.selectbox("Сортировка", list(CATALOG_SORTS))
+            page_size = st.selectbox("Книг на странице", CATALOG_PAGE_SIZES, index=CATALOG_PAGE_SIZES.index(CATALOG_PAGE_SIZE) if CATALOG_PAGE_SIZE in CATALOG_PAGE_SIZES else 0)
+            if in_texts:
+                text_search_page(book_search)
+            elif book_search.strip():
+                books = search.session_cached(f"books_{page_size}", book_search, lambda term: search.search_books(DB_CONFIG, term, page_size))
+                if books is None:
+                    st.info(f"Введите не меньше {search.SEARCH_MIN_LENGTH} символов для поиска.")
+                elif books:
+                    book_page(books)
+                else:
+                    st.write("Книги не найдены.")
+            else:
+                facets = load_facets()
+                genre_names = {value_id: f"{name} ({books})" for value_id, name, books in facets["genre"]}
+                age_names = {value_id: f"{name} ({books})" for value_id, name, books in facets["age"]}
+                col_genres, col_ages = st.columns(2)
+                genres = col_genres.multiselect("Жанры", list(genre_names), format_func=genre_names.get)
+                ages = col_ages.multiselect("Возрастной рейтинг", list(age_names), format_func=age_names.get)
+                catalog_page(sort, page_size, tuple(genres), tuple(ages))
+        elif page == "Authors":
+            author_search = st.text_input("Поиск по авторам", "")
+            if author_search.strip():
+                authors = search.session_cached("authors", author_search, lambda term: search.search_authors(DB_CONFIG, term))
+                if authors is None:
+                    st.info(f"Введите не меньше {search.SEARCH_MIN_LENGTH} символов для поиска.")
+                else:
+                    author_page(authors)
+            else:
+                author_page(load_authors())
+        elif page == "Favorites":
+            user_id = st.session_state.get("user_id")
+            if user_id:
+                favorites_books, favorites_authors = load_user_favorites(user_id)
+                favorites_page(favorites_books, favorites_authors)
+            else:
+                st.error("Сначала выполните вход.")
+        elif page == "Comments":
+            comments_page()
+        elif page == "Admin":
+            auth_user = auth.get_authenticated_user()
+            if auth_user and auth_user['role'] == 'admin':
+                admin.admin_page(DB_CONFIG)
+            else:
+                st.error("У вас нет доступа к этой странице.")
+
+def catalog_page(sort, page_size, genres=(), ages=()):
+    """Постраничный каталог книг с навигацией вперед/назад."""
+    # При смене сортировки, размера страницы или фильтров возвращаемся к началу
+    query = (sort, page_size, genres, ages)
+    if st.session_state.get("catalog_query") != query:
+        st.session_state["catalog_query"] = query
+        st.session_state["catalog_cursor"] = (None, None)
+
+    after, before = st.session_state["catalog_cursor"]
+    books, has_prev, has_next = load_books_page(sort=sort, page_size=page_size, after=after, before=before, genres=genres, ages=ages)
+    if not books:
+        st.write("Книги не найдены.")
+        return
+
+    book_page(books)
+
+    col_prev, col_next = st.columns(2)
+    if col_prev.button("← Назад", disabled=not has_prev):
+        st.session_state["catalog_cursor"] = (None, catalog_key(books[0], sort))
+        st.rerun()
+    if col_next.button("Вперед →", disabled=not has_next):
+        st.session_state["catalog_cursor"] = (catalog_key(books[-1], sort), None)
+        st.rerun()
 
 def book_page(books):
-    """Отображение книг, возможности оставлять комментарии и показывать текст произведения."""
+    """Отображение книг, возможности оставлять комментарии и показывать текст произведения.
+
+    Данные книг страницы сохраняются в сессии, а каждая книга рисуется отдельным
+    фрагментом: лайк, комментарий или читалка перезапускают только панель своей книги.
+    """
+    user_id = st.session_state.get("user_id")
+    liked = load_liked_book_ids(user_id, [book[0] for book in books]) if user_id else set()
+    similar = load_recommendations(tuple(book[0] for book in books))
+
     for book in books:
-        book_id, title, publication_date, author_id, description, number_of_likes, number_of_comments, book_cover, age_category = book
-        
+        book_id = book[0]
+        st.session_state[f"book_panel_{book_id}"] = {"book": book, "liked": book_id in liked}
+        book_panel(book_id, similar.get(book_id, []))
+
+@st.fragment
+def book_panel(book_id, similar):
+    """Панель одной книги; перезапускается независимо от остальной страницы."""
+    with metrics.timed("fragment:book"):
+        snapshot = st.session_state[f"book_panel_{book_id}"]
+        _, title, description, book_cover, age_category, number_of_likes, number_of_comments, author_name, genres = snapshot["book"]
+        user_id = st.session_state.get("user_id")
+
         st.subheader(title)
+        st.write(f"Автор: {author_name}")
         
         # Убедитесь, что путь к изображению правильный
-        book_cover_path = f"assets/images/{book_cover}"  # Команда, задающая правильный путь к изображению
-        if os.path.exists(book_cover_path):
-            st.image(book_cover_path)
+        cover = images.get_thumbnail(book_cover, "medium")  # Миниатюра обложки из кэша
+        if cover:
+            st.image(cover)
         else:
             st.error(f"Изображение '{book_cover}' не найдено.")
         
         # Отображаем возрастную категорию
         st.write(f"Возрастной рейтинг: **{age_category}**")  # Выводим возрастную категорию
+        if genres:
+            st.write(f"Жанры: {genres}")
 
         # Отображаем описание книги
         st.write("Описание:")
         st.write(description)
 
-        # Кнопка для отображения текста книги
-        if st.button(f"Показать текст произведения для '{title}'"):
-            book_text = load_book_text(book_id)  # Загрузка текста книги
-            if book_text:
-                st.write(book_text)
-            else:
-                st.error("Текст произведения не найден.")
+        # Счетчики поддерживаются триггерами, поэтому COUNT не нужен
+        st.write(f"Лайков: {number_of_likes}, комментариев: {number_of_comments}")
+        if user_id:
+            if snapshot["liked"]:
+                if st.button("Убрать лайк", key=f"unlike_{book_id}"):
+                    try:
+                        remove_like_from_book(user_id, book_id)
+                    except writes.WriteFailed as e:
+                        st.error(str(e))
+                    else:
+                        refresh_book_panel(book_id, liked=False)
+            elif st.button("Нравится", key=f"like_{book_id}"):
+                try:
+                    add_like_to_book(user_id, book_id)
+                except writes.WriteFailed as e:
+                    st.error(str(e))
+                else:
+                    refresh_book_panel(book_id, liked=True)
+
+        if similar:
+            with st.expander("Читателям, которым понравилась эта книга, также понравились"):
+                recommendations_row(similar)
+
+        # Переключатель читалки: текст загружается постранично
+        if st.toggle(f"Показать текст произведения для '{title}'", key=f"show_text_{book_id}"):
+            reader.reader(DB_CONFIG, book_id)
 
         # Форма для добавления нового комментария
-        user_id = st.session_state.get("user_id")
         if user_id:
             # Передаем уникальный key, используя book_id
             new_comment = st.text_area("Добавить комментарий:", "", key=f"comment_{book_id}")
             if st.button("Добавить", key=f"add_comment_{book_id}"):  # Уникальный ключ для кнопки
                 if new_comment:
-                    add_comment(book_id, user_id, new_comment)
-                    st.success("Комментарий добавлен!")
+                    try:
+                        added = add_comment(book_id, user_id, new_comment)
+                    except writes.WriteFailed as e:
+                        st.error(str(e))
+                    else:
+                        if added:
+                            st.success("Комментарий добавлен!")
+                            snapshot["book"] = load_book(book_id) or snapshot["book"]
+                        else:
+                            st.warning("Комментарий уже добавлен.")
                 else:
                     st.error("Введите текст комментария.")
         else:
             st.warning("Пожалуйста, войдите в систему, чтобы оставить комментарий.")
 
+def text_search_page(term):
+    """Результаты поиска по текстам книг: сниппеты с подсветкой и переход в читалку."""
+    term = term.strip()
+    # При новом запросе возвращаемся к первой странице результатов
+    if st.session_state.get("text_search_query") != term:
+        st.session_state["text_search_query"] = term
+        st.session_state["text_search_page"] = 0
+        st.session_state["text_search_open"] = None
+
+    # Открытая из результатов книга показывается вместо списка, читалка - на странице совпадения
+    opened = st.session_state.get("text_search_open")
+    if opened is not None:
+        if st.button("← К результатам поиска"):
+            st.session_state["text_search_open"] = None
+            st.rerun()
+        book = load_book(opened)
+        if book:
+            book_page([book])
+        return
+
+    page = st.session_state["text_search_page"]
+    results = search.session_cached(f"texts_{page}", term, lambda term: search.search_texts(DB_CONFIG, term, page))
+    if results is None:
+        st.info(f"Введите не меньше {search.SEARCH_MIN_LENGTH} символов для поиска.")
+        return
+    hits, has_next = results
+    if not hits:
+        st.write("Совпадений в текстах не найдено.")
+        return
+
+    for number, (book_id, title, author_name, char_offset, snippet) in enumerate(hits):
+        text_page = char_offset // reader.READER_PAGE_SIZE
+        st.write(f"**{title}** ({author_name}), страница {text_page + 1}")
+        st.write(snippet)
+        if st.button("Читать с этого места", key=f"text_hit_{page}_{number}"):
+            st.session_state[f"reader_position_{book_id}"] = text_page
+            st.session_state[f"show_text_{book_id}"] = True
+            st.session_state["text_search_open"] = book_id
+            st.rerun()
+        st.write("---")
+
+    col_prev, col_next = st.columns(2)
+    if col_prev.button("← Назад", disabled=page == 0):
+        st.session_state["text_search_page"] = page - 1
+        st.rerun()
+    if col_next.button("Вперед →", disabled=not has_next):
+        st.session_state["text_search_page"] = page + 1
+        st.rerun()
+
+def refresh_book_panel(book_id, liked):
+    """Обновить снимок книги в сессии (один запрос) и перерисовать только ее панель."""
+    snapshot = st.session_state[f"book_panel_{book_id}"]
+    snapshot["book"] = load_book(book_id) or snapshot["book"]
+    snapshot["liked"] = liked
+    st.rerun(scope="fragment")
+
 
 def comments_page():
     """Страница, показывающая все комментарии."""
     st.header("Все комментарии")
-    
-    connection = psycopg2.connect(**DB_CONFIG)
-    cursor = connection.cursor()
-    cursor.execute("SELECT b.title, c.comment_text, c.user_id, c.date FROM comments c JOIN books b ON c.book_id = b.book_id ORDER BY c.date DESC")
-    comments = cursor.fetchall()
-    
-    if comments:
-        for comment in comments:
-            book_title, comment_text, user_id, comment_date = comment
+    comments_feed()
+
+@st.fragment
+def comments_feed():
+    """Лента комментариев; "Показать еще" перезапускает только ее."""
+    # Лента хранится в сессии: при перезапуске догружаются только новые комментарии
+    feed = st.session_state.get("comments_feed")
+    if feed is None:
+        comments, has_more = load_comments_feed()
+        feed = {"comments": comments, "has_more": has_more}
+        st.session_state["comments_feed"] = feed
+    elif feed["comments"]:
+        newer = load_comments_since(feed["comments"][0][:3])
+        feed["comments"] = newer + feed["comments"]
+    else:
+        feed["comments"], feed["has_more"] = load_comments_feed()
+
+    if feed["comments"]:
+        for comment_date, book_id, user_id, book_title, comment_text in feed["comments"]:
             st.write(f"**Книга:** {book_title}")
             st.write(f"**Комментарий:** {comment_text} (User ID: {user_id}, Дата: {comment_date})")
             st.write("---")
+        if feed["has_more"] and st.button("Показать еще"):
+            older, feed["has_more"] = load_comments_feed(before=feed["comments"][-1][:3])
+            feed["comments"] = feed["comments"] + older
+            st.rerun(scope="fragment")
     else:
         st.write("Комментариев пока нет.")
-    
-    cursor.close()
-    connection.close()
 
 def author_page(authors):
     """Отображение авторов."""
@@ -262,21 +590,61 @@ def author_page(authors):
     if not authors:
         st.write("Авторы не найдены.")
     else:
+        user_id = st.session_state.get("user_id")
+        favorites = load_favorite_author_ids(user_id, [author[0] for author in authors]) if user_id else set()
+
+        # Каждый автор - отдельный фрагмент; признак "в любимых" хранится в сессии
         for author_id, fullname, biography in authors:  # Добавили biography
-            st.write(f"- {fullname}")
-            
-            # Отображение биографии
-            st.write("Биография:")
-            st.write(biography if biography else "Информация о биографии отсутствует.")
-            
-            user_id = st.session_state.get("user_id")
-            if user_id:
-                if st.button(f"Добавить {fullname} в любимые", key=f"fav_{author_id}"):
-                    add_favorite_author(user_id, author_id)
-            else:
-                st.warning("Войдите, чтобы добавлять авторов в любимые.")
-            
-            st.write("---")
+            st.session_state[f"author_favorite_{author_id}"] = author_id in favorites
+            author_panel(author_id, fullname, biography)
+
+        # Массовое добавление в любимые
+        if user_id:
+            candidates = {
+                author_id: fullname for author_id, fullname, _ in authors
+                if not st.session_state[f"author_favorite_{author_id}"]
+            }
+            selected = st.multiselect("Добавить в любимые нескольких авторов", list(candidates), format_func=candidates.get)
+            if selected and st.button("Добавить выбранных"):
+                count = add_favorite_authors(user_id, selected)
+                st.success(f"Добавлено авторов: {count}")
+                st.rerun()
+
+@st.fragment
+def author_panel(author_id, fullname, biography):
+    """Панель одного автора; кнопка "в любимые" перезапускает только ее."""
+    with metrics.timed("fragment:author"):
+        user_id = st.session_state.get("user_id")
+        favorite_key = f"author_favorite_{author_id}"
+        st.write(f"- {fullname}")
+        
+        # Отображение биографии
+        st.write("Биография:")
+        st.write(biography if biography else "Информация о биографии отсутствует.")
+        
+        if user_id:
+            if st.session_state[favorite_key]:
+                if st.button(f"Убрать {fullname} из любимых", key=f"unfav_{author_id}"):
+                    remove_favorite_authors(user_id, [author_id])
+                    st.session_state[favorite_key] = False
+                    st.rerun(scope="fragment")
+            elif st.button(f"Добавить {fullname} в любимые", key=f"fav_{author_id}"):
+                add_favorite_author(user_id, author_id)
+                st.session_state[favorite_key] = True
+                st.rerun(scope="fragment")
+        else:
+            st.warning("Войдите, чтобы добавлять авторов в любимые.")
+        
+        st.write("---")
+
+def recommendations_row(books):
+    """Рекомендованные книги в ряд: миниатюра обложки и название."""
+    for column, (book_id, title, book_cover) in zip(st.columns(len(books)), books):
+        with column:
+            cover = images.get_thumbnail(book_cover, "small")
+            if cover:
+                st.image(cover)
+            st.caption(title)
 
 def favorites_page(favorites_books, favorites_authors):
     """Отображение любимых книг и авторов пользователя."""
@@ -284,10 +652,17 @@ def favorites_page(favorites_books, favorites_authors):
     if not favorites_books:
         st.write("У вас нет любимых книг.")
     else:
-        for book_id, title, book_cover in favorites_books:
-            st.image(f"assets/images/{book_cover}", width=100)
-            st.write(f"**{title}**")
+        for book_id, title, book_cover, author_name in favorites_books:
+            cover = images.get_thumbnail(book_cover, "small")
+            if cover:
+                st.image(cover)
+            st.write(f"**{title}** — {author_name}")
             st.write("---")
+
+        recommended = load_user_recommendations(st.session_state.get("user_id"))
+        if recommended:
+            st.subheader("Вам может понравиться")
+            recommendations_row(recommended)
     
     st.subheader("Ваши любимые авторы")
     if not favorites_authors:
@@ -295,7 +670,15 @@ def favorites_page(favorites_books, favorites_authors):
     else:
         for author_id, fullname in favorites_authors:
             st.write(f"- {fullname}")
+
+        # Массовое удаление из любимых
+        names = dict(favorites_authors)
+        selected = st.multiselect("Убрать из любимых", list(names), format_func=names.get)
+        if selected and st.button("Убрать выбранных"):
+            remove_favorite_authors(st.session_state.get("user_id"), selected)
+            st.rerun()
     st.write("---")
 
 if __name__ == "__main__":
-    main()
+    with metrics.timed("rerun"):
+        main()
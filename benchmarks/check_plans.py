@@ -0,0 +1,157 @@
+# Проверка планов именованных запросов: нет ли последовательного сканирования больших таблиц.
+#
+# Запуск из корня репозитория после python migrate.py и benchmarks.generate_data:
+#   python -m benchmarks.check_plans --min-rows 10000
+#
+# Вызываются настоящие функции app.py и utils/ (в обход кэша) с ID из базы;
+# планы собирает metrics.capture_plans(). Seq Scan по таблице, в которой по
+# статистике не меньше --min-rows строк, считается регрессией, и скрипт
+# завершается с ненулевым кодом. На маленьких таблицах последовательное
+# сканирование дешевле индекса, поэтому проверка имеет смысл только на
+# заполненной базе.
+
+import argparse
+import logging
+import sys
+
+import app
+from utils import auth, db, metrics, reader, recommendations, search
+
+DEFAULT_MIN_ROWS = 10000
+
+# Вне streamlit run вызовы st.* пишут предупреждения об отсутствии контекста
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+
+def uncached(func):
+    """Функция без обертки cache.cached: каждый вызов должен дойти до базы."""
+    return getattr(func, "__wrapped__", func)
+
+
+def find_user_by_email(email):
+    """Запрос поиска пользователя при входе (без проверки пароля)."""
+    with db.cursor(app.DB_CONFIG) as cursor:
+        cursor.execute(auth.FIND_USER, (email,))
+        return cursor.fetchone()
+
+
+def load_samples():
+    """ID, на которых проверяются запросы: популярная книга, активный пользователь и т.д."""
+    with db.cursor(app.DB_CONFIG) as cursor:
+        cursor.execute("SELECT book_id, title FROM books ORDER BY number_of_likes DESC, book_id LIMIT 1")
+        book = cursor.fetchone()
+        cursor.execute("SELECT user_id FROM liked_books GROUP BY user_id ORDER BY COUNT(*) DESC LIMIT 1")
+        user = cursor.fetchone()
+        cursor.execute("SELECT email FROM users ORDER BY user_id LIMIT 1")
+        email = cursor.fetchone()
+        cursor.execute("SELECT genre_id FROM book_genres GROUP BY genre_id ORDER BY COUNT(*), genre_id LIMIT 1")
+        genre = cursor.fetchone()
+        cursor.execute("SELECT MIN(book_id) FROM (SELECT book_id FROM book_texts UNION ALL SELECT book_id FROM book_text_files) t")
+        text = cursor.fetchone()
+        cursor.execute(f"SELECT date, book_id, user_id FROM comments ORDER BY date DESC, book_id DESC, user_id DESC OFFSET {app.COMMENTS_PAGE_SIZE} LIMIT 1")
+        comment = cursor.fetchone()
+        cursor.execute("SELECT author_id FROM authors ORDER BY author_id LIMIT 1")
+        author = cursor.fetchone()
+    if not book or not user or not email:
+        sys.exit("Нет данных для проверки: сначала запустите python -m benchmarks.generate_data")
+    return {
+        "book_id": book[0],
+        "word": book[1].split()[0],
+        "user_id": user[0],
+        "email": email[0],
+        "genre_id": genre[0] if genre else None,
+        "text_id": text[0],
+        "comment_key": comment,
+        "author_id": author[0] if author else None,
+    }
+
+
+def checks(samples):
+    """Проверяемые операции: (название, функция без аргументов)."""
+    book_id, user_id = samples["book_id"], samples["user_id"]
+    load_books_page = uncached(app.load_books_page)
+    operations = []
+    for sort in app.CATALOG_SORTS:
+        operations.append((f"каталог: {sort}", lambda sort=sort: load_books_page(sort=sort)))
+        first_page, _, _ = load_books_page(sort=sort)
+        if first_page:
+            after = app.catalog_key(first_page[-1], sort)
+            operations.append((f"каталог: {sort}, следующая страница", lambda sort=sort, after=after: load_books_page(sort=sort, after=after)))
+    if samples["genre_id"] is not None:
+        operations.append(("каталог: фильтр по жанру", lambda: load_books_page(genres=(samples["genre_id"],))))
+    operations += [
+        ("каталог: поиск", lambda: load_books_page(search_term=samples["word"])),
+        ("книга", lambda: uncached(app.load_book)(book_id)),
+        ("комментарии к книге", lambda: uncached(app.load_comments)(book_id)),
+        ("лента комментариев", lambda: app.load_comments_feed()),
+        ("лайки на странице", lambda: app.load_liked_book_ids(user_id, [book_id])),
+        ("избранное пользователя", lambda: app.load_user_favorites(user_id)),
+        ("поиск книг", lambda: search.search_books(app.DB_CONFIG, samples["word"])),
+        ("поиск авторов", lambda: search.search_authors(app.DB_CONFIG, samples["word"])),
+        ("похожие книги", lambda: recommendations.for_books(app.DB_CONFIG, [book_id])),
+        ("рекомендации пользователя", lambda: recommendations.for_user(app.DB_CONFIG, user_id)),
+        ("вход", lambda: find_user_by_email(samples["email"])),
+        ("позиция чтения", lambda: reader.load_reading_position(app.DB_CONFIG, user_id, book_id)),
+    ]
+    if samples["comment_key"] is not None:
+        operations += [
+            ("лента комментариев: следующая страница", lambda: app.load_comments_feed(before=samples["comment_key"])),
+            ("новые комментарии", lambda: app.load_comments_since(samples["comment_key"])),
+        ]
+    if samples["author_id"] is not None:
+        operations.append(("любимые авторы на странице", lambda: app.load_favorite_author_ids(user_id, [samples["author_id"]])))
+    if samples["text_id"] is not None:
+        operations.append(("чтение", lambda: reader.load_text_pages(app.DB_CONFIG, samples["text_id"], 0)))
+        operations.append(("поиск по текстам", lambda: search.search_texts(app.DB_CONFIG, samples["word"])))
+    return operations
+
+
+def table_sizes():
+    """Оценка числа строк в таблицах и материализованных представлениях из статистики."""
+    with db.cursor(app.DB_CONFIG) as cursor:
+        cursor.execute("""
+            SELECT relname, reltuples::bigint
+            FROM pg_class
+            WHERE relkind IN ('r', 'm') AND relnamespace = 'public'::regnamespace
+        """)
+        return dict(cursor.fetchall())
+
+
+def seq_scans(plan):
+    """Таблицы, которые план читает последовательным сканированием."""
+    tables = []
+    if plan.get("Node Type") == "Seq Scan":
+        tables.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        tables += seq_scans(child)
+    return tables
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка планов запросов на последовательное сканирование")
+    parser.add_argument("--min-rows", type=int, default=DEFAULT_MIN_ROWS, help="таблицы меньшего размера не проверяются")
+    args = parser.parse_args()
+
+    samples = load_samples()
+    sizes = table_sizes()
+    regressions = []
+    for label, operation in checks(samples):
+        with metrics.capture_plans() as plans:
+            operation()
+        for query_name, plan in plans:
+            if "error" in plan:
+                regressions.append(label)
+                print(f"{label} ({query_name}): план не получен: {plan['error']}")
+                continue
+            large = sorted({table for table in seq_scans(plan) if sizes.get(table, 0) >= args.min_rows})
+            status = "OK" if not large else f"Seq Scan: {', '.join(large)}"
+            print(f"{label} ({query_name}): {status}")
+            if large:
+                regressions.append(label)
+
+    if regressions:
+        sys.exit(f"Последовательное сканирование больших таблиц: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
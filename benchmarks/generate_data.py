@@ -0,0 +1,181 @@
+# Генерация синтетических данных для нагрузочного тестирования.
+#
+# Запуск из корня репозитория (только на локальной тестовой базе!):
+#   python -m benchmarks.generate_data --books 100000 --comments 1000000 --likes 10000000
+#
+# Данные создаются на стороне сервера через INSERT ... SELECT generate_series,
+# поэтому объем не ограничен памятью клиента. Популярность книг распределена
+# неравномерно (небольшая часть книг собирает большинство лайков и комментариев).
+# Пользователи bench_user<N>@example.com получают пароль BENCH_PASSWORD.
+
+import argparse
+import os
+import time
+
+from dotenv import load_dotenv
+from utils import catalog, db, passwords, textstore
+
+# Параметры подключения из .env, как в migrate.py: импорт app запустил бы сервер метрик
+# и фоновые потоки приложения
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "database": os.getenv("DB_DATABASE"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD")
+}
+
+BENCH_PASSWORD = "benchmark"
+# Сколько строк лайков/комментариев вставляется за одну транзакцию
+BATCH = 1_000_000
+
+FIRST_NAMES = ["Иван", "Анна", "Петр", "Мария", "Сергей", "Ольга", "Николай", "Елена", "Алексей", "Татьяна"]
+LAST_NAMES = ["Иванов", "Смирнова", "Кузнецов", "Попова", "Соколов", "Лебедева", "Козлов", "Новикова", "Морозов", "Волкова"]
+# Слова для названий и текстов; по ним же ищет сценарий search в run_benchmark
+WORDS = [
+    "сон", "любовь", "ветер", "море", "город", "ночь", "осень", "дорога", "память", "звезда",
+    "песня", "сад", "река", "письмо", "зима", "свет", "тень", "дом", "время", "берег",
+]
+
+# Индекс книги со смещенным распределением: random() в кубе дает "хиты" в начале массива
+SKEWED_BOOK = "ids.arr[1 + floor(ids.n * power(random(), 3))::int]"
+
+
+def run(cursor, label, statement, params=None):
+    started = time.perf_counter()
+    cursor.execute(statement, params)
+    print(f"{label}: {cursor.rowcount} строк за {time.perf_counter() - started:.1f} с")
+
+
+def generate(args):
+    words = "(ARRAY[" + ", ".join(f"'{word}'" for word in WORDS) + "])"
+    password_hash = passwords.hash_password(BENCH_PASSWORD)
+
+    with db.transaction(DB_CONFIG) as cursor:
+        run(cursor, "users", """
+            INSERT INTO users (email, age, role, hash_password)
+            SELECT 'bench_user' || g || '@example.com', 12 + g %% 60, 'viewer', %s
+            FROM generate_series(1, %s) g
+            ON CONFLICT (email) DO NOTHING
+        """, (password_hash, args.users))
+
+        run(cursor, "authors", f"""
+            INSERT INTO authors (fullname, biography)
+            SELECT (ARRAY{FIRST_NAMES})[1 + g %% 10] || ' ' || (ARRAY{LAST_NAMES})[1 + (g / 10) %% 10] || ' ' || g,
+                   'Синтетический автор № ' || g
+            FROM generate_series(1, %s) g
+        """, (args.authors,))
+
+        run(cursor, "genres", """
+            INSERT INTO genres (genre_name)
+            SELECT 'Жанр ' || g FROM generate_series(1, %s) g
+            WHERE NOT EXISTS (SELECT 1 FROM genres WHERE genre_name = 'Жанр ' || g)
+        """, (args.genres,))
+
+    with db.transaction(DB_CONFIG) as cursor:
+        run(cursor, "books", f"""
+            WITH ids AS (SELECT array_agg(author_id) AS arr, COUNT(*) AS n FROM authors)
+            INSERT INTO books (title, date, author_id, description, book_cover)
+            SELECT initcap({words}[1 + (random() * 19)::int]) || ' ' || {words}[1 + (random() * 19)::int] || ' ' || g,
+                   DATE '1800-01-01' + (random() * 80000)::int,
+                   ids.arr[1 + floor(ids.n * random())::int],
+                   'Описание: ' || {words}[1 + (random() * 19)::int] || ', ' || {words}[1 + (random() * 19)::int],
+                   'son.jpg'
+            FROM generate_series(1, %s) g CROSS JOIN ids
+        """, (args.books,))
+
+        run(cursor, "age_categories_of_books", """
+            WITH ages AS (SELECT array_agg(age_id) AS arr, COUNT(*) AS n FROM age_category)
+            INSERT INTO age_categories_of_books (book_id, age_id)
+            SELECT b.book_id, ages.arr[1 + floor(ages.n * random())::int]
+            FROM books b CROSS JOIN ages
+            WHERE NOT EXISTS (SELECT 1 FROM age_categories_of_books acb WHERE acb.book_id = b.book_id)
+        """)
+
+        run(cursor, "book_genres", """
+            WITH genre_ids AS (SELECT array_agg(genre_id) AS arr, COUNT(*) AS n FROM genres)
+            INSERT INTO book_genres (book_id, genre_id)
+            SELECT b.book_id, genre_ids.arr[1 + floor(genre_ids.n * random())::int]
+            FROM books b CROSS JOIN genre_ids, generate_series(1, 2)
+            ON CONFLICT DO NOTHING
+        """)
+
+    # Длинные тексты: фраза из случайных слов, повторенная до нужного размера
+    with db.transaction(DB_CONFIG) as cursor:
+        run(cursor, "book_texts", f"""
+            INSERT INTO book_texts (book_id, book_text)
+            SELECT b.book_id,
+                   repeat(initcap({words}[1 + (random() * 19)::int]) || ' ' || array_to_string(
+                       ARRAY(SELECT {words}[1 + (random() * 19)::int] FROM generate_series(1, 12) WHERE b.book_id > 0), ' '
+                   ) || '. ', (%s * 1024 / 100)::int)
+            FROM books b
+            WHERE NOT EXISTS (SELECT 1 FROM book_texts t WHERE t.book_id = b.book_id)
+              AND NOT EXISTS (SELECT 1 FROM book_text_files f WHERE f.book_id = b.book_id)
+            ORDER BY b.book_id DESC
+            LIMIT %s
+        """, (args.text_kb, args.texts))
+
+    # При файловом хранилище тексты переносятся из book_texts в сжатые файлы
+    if textstore.enabled():
+        started = time.perf_counter()
+        moved = textstore.migrate(DB_CONFIG)
+        print(f"textstore: {moved} текстов за {time.perf_counter() - started:.1f} с")
+
+    # Поисковый индекс отрывков для полнотекстового поиска по текстам
+    started = time.perf_counter()
+    indexed = textstore.index_missing(DB_CONFIG)
+    print(f"book_passages: {indexed} текстов за {time.perf_counter() - started:.1f} с")
+
+    for kind, total in (("comments", args.comments), ("likes", args.likes)):
+        for start in range(0, total, BATCH):
+            size = min(BATCH, total - start)
+            with db.transaction(DB_CONFIG) as cursor:
+                if kind == "comments":
+                    run(cursor, f"comments {start + size}/{total}", f"""
+                        WITH ids AS (SELECT array_agg(book_id ORDER BY book_id) AS arr, COUNT(*) AS n FROM books),
+                             users AS (SELECT array_agg(user_id) AS arr, COUNT(*) AS n FROM users)
+                        INSERT INTO comments (book_id, user_id, comment_text, date)
+                        SELECT {SKEWED_BOOK},
+                               users.arr[1 + floor(users.n * random())::int],
+                               'Комментарий: ' || {words}[1 + (random() * 19)::int],
+                               NOW() - random() * INTERVAL '365 days'
+                        FROM generate_series(1, %s) CROSS JOIN ids CROSS JOIN users
+                        ON CONFLICT DO NOTHING
+                    """, (size,))
+                else:
+                    run(cursor, f"likes {start + size}/{total}", f"""
+                        WITH ids AS (SELECT array_agg(book_id ORDER BY book_id) AS arr, COUNT(*) AS n FROM books),
+                             users AS (SELECT array_agg(user_id) AS arr, COUNT(*) AS n FROM users)
+                        INSERT INTO liked_books (user_id, book_id)
+                        SELECT users.arr[1 + floor(users.n * random())::int], {SKEWED_BOOK}
+                        FROM generate_series(1, %s) CROSS JOIN ids CROSS JOIN users
+                        ON CONFLICT DO NOTHING
+                    """, (size,))
+
+    started = time.perf_counter()
+    catalog.refresh(DB_CONFIG)
+    print(f"catalog: обновлен за {time.perf_counter() - started:.1f} с")
+
+    with db.connection(DB_CONFIG) as connection:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            run(cursor, "analyze", "ANALYZE")
+        connection.autocommit = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Синтетические данные для нагрузочного тестирования")
+    parser.add_argument("--users", type=int, default=10_000)
+    parser.add_argument("--authors", type=int, default=5_000)
+    parser.add_argument("--genres", type=int, default=30)
+    parser.add_argument("--books", type=int, default=100_000)
+    parser.add_argument("--texts", type=int, default=1_000, help="сколько книг получат текст")
+    parser.add_argument("--text-kb", type=int, default=2_048, help="размер текста книги в КБ")
+    parser.add_argument("--comments", type=int, default=1_000_000)
+    parser.add_argument("--likes", type=int, default=10_000_000)
+    generate(parser.parse_args())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# Нагрузочный тест слоя данных: смешанная нагрузка от N одновременных пользователей.
+#
+# Запуск из корня репозитория после benchmarks.generate_data:
+#   python -m benchmarks.run_benchmark --users 20 --duration 60 --save baseline
+#   python -m benchmarks.run_benchmark --users 20 --duration 60 --compare baseline
+#
+# Операции вызывают настоящие функции app.py и utils/. Результаты (p50/p95/p99
+# и пропускная способность по операциям) сохраняются в benchmarks/results/<name>.json.
+# Для замера без кэша запросов запускайте с CACHE_ENABLED=0.
+
+import argparse
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+import app
+from benchmarks.generate_data import BENCH_PASSWORD, WORDS
+from utils import auth, db, reader, search, writes
+
+RESULTS_DIR = os.path.join("benchmarks", "results")
+DEFAULT_MIX = "browse=40,search=20,read=15,like=10,comment=10,login=5,fulltext=5"
+# Рост p95 больше чем на REGRESSION_THRESHOLD при сравнении считается регрессией
+REGRESSION_THRESHOLD = 0.2
+
+# Вне streamlit run вызовы st.* пишут предупреждения об отсутствии контекста
+logging.getLogger("streamlit").setLevel(logging.ERROR)
+
+
+class Workload:
+    """Операции смешанной нагрузки; каждая получает генератор случайных чисел своего пользователя."""
+
+    def __init__(self):
+        with db.cursor(app.DB_CONFIG) as cursor:
+            cursor.execute("SELECT MIN(book_id), MAX(book_id) FROM books")
+            self.min_book, self.max_book = cursor.fetchone()
+            cursor.execute("""
+                SELECT MIN(book_id), MAX(book_id)
+                FROM (SELECT book_id FROM book_texts UNION ALL SELECT book_id FROM book_text_files) t
+            """)
+            self.min_text, self.max_text = cursor.fetchone()
+            cursor.execute("SELECT user_id, email FROM users WHERE email LIKE 'bench_user%%'")
+            self.users = cursor.fetchall()
+        if not self.users or self.min_book is None:
+            sys.exit("Нет синтетических данных: сначала запустите python -m benchmarks.generate_data")
+
+    def random_book(self, rng):
+        # Смещенное распределение, как в generate_data: популярные книги запрашиваются чаще
+        return self.min_book + int((self.max_book - self.min_book) * rng.random() ** 3)
+
+    def browse(self, rng):
+        sort = rng.choice(list(app.CATALOG_SORTS))
+        books, _, has_next = app.load_books_page(sort=sort, page_size=app.CATALOG_PAGE_SIZE)
+        for _ in range(rng.randint(0, 2)):
+            if not has_next:
+                break
+            books, _, has_next = app.load_books_page(sort=sort, page_size=app.CATALOG_PAGE_SIZE, after=app.catalog_key(books[-1], sort))
+
+    def search(self, rng):
+        term = rng.choice(WORDS)
+        search.search_books(app.DB_CONFIG, term[:rng.randint(2, len(term))])
+
+    def fulltext(self, rng):
+        # Поиск по текстам: слово или фраза из словаря синтетических текстов, иногда не первая страница
+        term = " ".join(rng.sample(WORDS, rng.randint(1, 2)))
+        search.search_texts(app.DB_CONFIG, term, rng.choice((0, 0, 0, 1, 2)))
+
+    def read(self, rng):
+        if self.min_text is None:
+            return
+        book_id = rng.randint(self.min_text, self.max_text)
+        reader.load_text_pages(app.DB_CONFIG, book_id, rng.randint(0, 20))
+
+    def like(self, rng):
+        user_id, _ = rng.choice(self.users)
+        book_id = self.random_book(rng)
+        if not app.add_like_to_book(user_id, book_id):
+            app.remove_like_from_book(user_id, book_id)
+
+    def comment(self, rng):
+        user_id, _ = rng.choice(self.users)
+        app.add_comment(self.random_book(rng), user_id, f"Комментарий нагрузочного теста {rng.random()}")
+
+    def login(self, rng):
+        _, email = rng.choice(self.users)
+        auth.authenticate(app.DB_CONFIG, email, BENCH_PASSWORD)
+
+
+def parse_mix(mix):
+    weights = {}
+    for item in mix.split(","):
+        name, weight = item.split("=")
+        weights[name.strip()] = float(weight)
+    return weights
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(q * (len(values) - 1))))
+    return values[index]
+
+
+def run(users, duration, mix, seed):
+    """Запустить нагрузку и вернуть задержки и ошибки по операциям."""
+    workload = Workload()
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    latencies = {name: [] for name in names}
+    errors = {name: 0 for name in names}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def user_loop(index):
+        rng = random.Random(seed + index)
+        while time.perf_counter() < deadline:
+            name = rng.choices(names, weights)[0]
+            started = time.perf_counter()
+            try:
+                getattr(workload, name)(rng)
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies[name].append(elapsed)
+            except Exception as e:
+                with lock:
+                    errors[name] += 1
+                print(f"{name}: {e}", file=sys.stderr)
+
+    threads = [threading.Thread(target=user_loop, args=(i,)) for i in range(users)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    report = {}
+    for name in names:
+        values = latencies[name]
+        report[name] = {
+            "count": len(values),
+            "errors": errors[name],
+            "throughput": len(values) / elapsed,
+            "p50_ms": percentile(values, 0.50) * 1000,
+            "p95_ms": percentile(values, 0.95) * 1000,
+            "p99_ms": percentile(values, 0.99) * 1000,
+        }
+    return report
+
+
+def print_report(report, baseline=None):
+    print(f"{'операция':<10}{'кол-во':>9}{'ошибки':>8}{'оп/с':>9}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'Δp95':>9}")
+    regressions = []
+    for name, stats in report.items():
+        delta = ""
+        previous = (baseline or {}).get(name)
+        if previous and previous["p95_ms"]:
+            change = stats["p95_ms"] / previous["p95_ms"] - 1
+            delta = f"{change:+.0%}"
+            if change > REGRESSION_THRESHOLD:
+                regressions.append(name)
+        print(f"{name:<10}{stats['count']:>9}{stats['errors']:>8}{stats['throughput']:>9.1f}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}{delta:>9}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест слоя данных")
+    parser.add_argument("--users", type=int, default=10, help="число одновременных пользователей")
+    parser.add_argument("--duration", type=float, default=30, help="длительность в секундах")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="веса операций, например browse=40,search=20")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--save", help="сохранить результат как benchmarks/results/<имя>.json")
+    parser.add_argument("--compare", help="сравнить с сохраненным результатом")
+    args = parser.parse_args()
+
+    report = run(args.users, args.duration, parse_mix(args.mix), args.seed)
+
+    baseline = None
+    if args.compare:
+        with open(os.path.join(RESULTS_DIR, f"{args.compare}.json"), encoding="utf-8") as file:
+            baseline = json.load(file)["operations"]
+    regressions = print_report(report, baseline)
+    write_queue = writes.write_stats()
+    print(f"Лайков и комментариев записано: {write_queue['events']}, транзакций: {write_queue['commits']}"
+          f" ({write_queue['events_per_commit']:.1f} событий на транзакцию)")
+
+    if args.save:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        with open(os.path.join(RESULTS_DIR, f"{args.save}.json"), "w", encoding="utf-8") as file:
+            json.dump({
+                "created": datetime.now().isoformat(timespec="seconds"),
+                "users": args.users,
+                "duration": args.duration,
+                "mix": args.mix,
+                "cache_enabled": os.getenv("CACHE_ENABLED", "1") != "0",
+                "write_behind": writes.WRITE_BEHIND,
+                "write_commits": write_queue["commits"],
+                "operations": report,
+            }, file, ensure_ascii=False, indent=2)
+
+    if regressions:
+        sys.exit(f"Регрессия p95 больше {REGRESSION_THRESHOLD:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == "__main__":
+    main()
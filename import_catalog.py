@@ -0,0 +1,300 @@
+# Массовая загрузка каталога из CSV/JSONL через COPY.
+#
+# Пример:
+#   python import_catalog.py --authors authors.csv --books books.jsonl --texts texts.jsonl
+#
+# Форматы строк (CSV с заголовком или JSONL с теми же ключами):
+#   genres:          genre_name
+#   age-categories:  age, category_characteristic
+#   authors:         external_id, fullname, biography
+#   books:           external_id, title, date, author (external_id автора), description,
+#                    book_cover, genres (названия через ";"), age (например, "18+")
+#   texts:           book (external_id книги), book_text
+#
+# Файлы читаются потоково и загружаются пачками: строки пачки копируются во
+# временную таблицу через COPY, затем переносятся в основные таблицы
+# операторами INSERT ... SELECT. Каждая пачка - отдельная транзакция.
+# Соответствие внешних и внутренних ID хранится в таблицах import_*_map,
+# поэтому повторный запуск пропускает уже загруженные записи. Строки без
+# обязательных полей и повторы внешнего ID в пачке пропускаются.
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import time
+from dotenv import load_dotenv
+from utils import catalog, db, textstore
+
+# Загружаем переменные окружения из .env файла
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "database": os.getenv("DB_DATABASE"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD")
+}
+
+BATCH_ROWS = 5000
+# Ограничение объема пачки, чтобы тексты книг не занимали всю память
+BATCH_BYTES = 64 * 1024 * 1024
+
+csv.field_size_limit(sys.maxsize)
+
+STAGING_TABLES = {
+    "genres": "CREATE TEMP TABLE IF NOT EXISTS stage_genres (genre_name TEXT)",
+    "age-categories": "CREATE TEMP TABLE IF NOT EXISTS stage_age_categories (age TEXT, category_characteristic TEXT)",
+    "authors": """CREATE TEMP TABLE IF NOT EXISTS stage_authors (
+        external_id TEXT, fullname TEXT, biography TEXT, author_id INT)""",
+    "books": """CREATE TEMP TABLE IF NOT EXISTS stage_books (
+        external_id TEXT, title TEXT, date DATE, author TEXT, description TEXT,
+        book_cover TEXT, genres TEXT, age TEXT, book_id INT)""",
+    "texts": "CREATE TEMP TABLE IF NOT EXISTS stage_texts (book TEXT, book_text TEXT)",
+}
+
+# Столбцы, которые заполняются из входных файлов
+COLUMNS = {
+    "genres": ["genre_name"],
+    "age-categories": ["age", "category_characteristic"],
+    "authors": ["external_id", "fullname", "biography"],
+    "books": ["external_id", "title", "date", "author", "description", "book_cover", "genres", "age"],
+    "texts": ["book", "book_text"],
+}
+
+# Строки пачки, которые нельзя загрузить: без обязательных полей (пустое поле CSV
+# становится NULL) и повторы внешнего ID внутри пачки (остается первая строка файла,
+# иначе вставка в import_*_map нарушила бы первичный ключ). Удаляются до переноса,
+# их число выводится в отчет как пропущенные
+REJECT = {
+    "genres": [
+        "DELETE FROM stage_genres WHERE genre_name IS NULL RETURNING 1",
+    ],
+    "age-categories": [
+        "DELETE FROM stage_age_categories WHERE age IS NULL OR category_characteristic IS NULL RETURNING 1",
+    ],
+    "authors": [
+        "DELETE FROM stage_authors WHERE external_id IS NULL OR fullname IS NULL RETURNING 1",
+        """DELETE FROM stage_authors a USING stage_authors b
+           WHERE a.external_id = b.external_id AND a.ctid > b.ctid
+           RETURNING 1""",
+    ],
+    "books": [
+        "DELETE FROM stage_books WHERE external_id IS NULL OR title IS NULL OR date IS NULL RETURNING 1",
+        """DELETE FROM stage_books a USING stage_books b
+           WHERE a.external_id = b.external_id AND a.ctid > b.ctid
+           RETURNING 1""",
+    ],
+    "texts": [
+        "DELETE FROM stage_texts WHERE book IS NULL OR book_text IS NULL RETURNING 1",
+        """DELETE FROM stage_texts a USING stage_texts b
+           WHERE a.book = b.book AND a.ctid > b.ctid
+           RETURNING 1""",
+    ],
+}
+
+# Перенос пачки из временной таблицы в основные. Оператор вставки в основную
+# таблицу возвращает новые строки через RETURNING, их число выводится в отчет
+MERGE = {
+    "genres": [
+        """INSERT INTO genres (genre_name)
+           SELECT DISTINCT s.genre_name FROM stage_genres s
+           WHERE NOT EXISTS (SELECT 1 FROM genres g WHERE g.genre_name = s.genre_name)
+           RETURNING genre_id""",
+    ],
+    "age-categories": [
+        """INSERT INTO age_category (age, category_characteristic)
+           SELECT DISTINCT ON (s.age) s.age, s.category_characteristic FROM stage_age_categories s
+           WHERE NOT EXISTS (SELECT 1 FROM age_category ac WHERE ac.age = s.age)
+           RETURNING age_id""",
+    ],
+    "authors": [
+        # Уже загруженные авторы пропускаются, новым ID выдаются заранее
+        """DELETE FROM stage_authors s USING import_author_map m WHERE m.external_id = s.external_id""",
+        """UPDATE stage_authors SET author_id = nextval(pg_get_serial_sequence('authors', 'author_id'))""",
+        """INSERT INTO authors (author_id, fullname, biography)
+           SELECT author_id, fullname, biography FROM stage_authors
+           RETURNING author_id""",
+        """INSERT INTO import_author_map (external_id, author_id)
+           SELECT external_id, author_id FROM stage_authors""",
+    ],
+    "books": [
+        # Пропускаются уже загруженные книги и книги с неизвестным автором
+        """DELETE FROM stage_books s USING import_book_map m WHERE m.external_id = s.external_id""",
+        """DELETE FROM stage_books s
+           WHERE NOT EXISTS (SELECT 1 FROM import_author_map m WHERE m.external_id = s.author)""",
+        """UPDATE stage_books SET book_id = nextval(pg_get_serial_sequence('books', 'book_id'))""",
+        """INSERT INTO books (book_id, title, date, author_id, description, book_cover)
+           SELECT s.book_id, s.title, s.date, m.author_id, s.description, s.book_cover
+           FROM stage_books s
+           JOIN import_author_map m ON m.external_id = s.author
+           RETURNING book_id""",
+        """INSERT INTO import_book_map (external_id, book_id)
+           SELECT external_id, book_id FROM stage_books""",
+        """INSERT INTO book_genres (book_id, genre_id)
+           SELECT DISTINCT s.book_id, g.genre_id
+           FROM stage_books s
+           CROSS JOIN LATERAL unnest(string_to_array(s.genres, ';')) AS name
+           JOIN genres g ON g.genre_name = trim(name)
+           ON CONFLICT DO NOTHING""",
+        """INSERT INTO age_categories_of_books (book_id, age_id)
+           SELECT s.book_id, MIN(ac.age_id)
+           FROM stage_books s
+           JOIN age_category ac ON ac.age = s.age
+           GROUP BY s.book_id
+           ON CONFLICT DO NOTHING""",
+    ],
+    # Без файлового хранилища (TEXT_STORE_DIR). Прежние оглавление и отрывки удаляются,
+    # новые строит textstore.index_missing после загрузки
+    "texts": [
+        """DELETE FROM book_text_files f
+           USING stage_texts s JOIN import_book_map m ON m.external_id = s.book
+           WHERE f.book_id = m.book_id""",
+        """DELETE FROM book_chapters c
+           USING stage_texts s JOIN import_book_map m ON m.external_id = s.book
+           WHERE c.book_id = m.book_id""",
+        """DELETE FROM book_passages p
+           USING stage_texts s JOIN import_book_map m ON m.external_id = s.book
+           WHERE p.book_id = m.book_id""",
+        """INSERT INTO book_texts (book_id, book_text)
+           SELECT m.book_id, s.book_text
+           FROM stage_texts s
+           JOIN import_book_map m ON m.external_id = s.book
+           ON CONFLICT (book_id) DO UPDATE SET book_text = EXCLUDED.book_text
+           RETURNING book_id""",
+    ],
+}
+
+# Порядок загрузки: справочники, затем авторы, книги и тексты
+ORDER = ["genres", "age-categories", "authors", "books", "texts"]
+
+
+def read_rows(path):
+    """Потоковое чтение строк из CSV или JSONL."""
+    with open(path, encoding="utf-8", newline="") as file:
+        if path.endswith((".jsonl", ".ndjson")):
+            for line in file:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            yield from csv.DictReader(file)
+
+
+def csv_value(value):
+    """Значение для COPY: пустая строка означает NULL, списки (жанры) склеиваются через ";"."""
+    if value is None:
+        return ""
+    if isinstance(value, list):
+        return ";".join(str(item) for item in value)
+    return value
+
+
+def batches(rows, columns, batch_rows=BATCH_ROWS, batch_bytes=BATCH_BYTES):
+    """Разбиение потока строк на пачки в формате CSV для COPY."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow([csv_value(row.get(column)) for column in columns])
+        count += 1
+        if count >= batch_rows or buffer.tell() >= batch_bytes:
+            buffer.seek(0)
+            yield buffer, count
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            count = 0
+    if count:
+        buffer.seek(0)
+        yield buffer, count
+
+
+def prepare(cursor):
+    """Таблицы соответствия внешних и внутренних ID."""
+    cursor.execute("CREATE TABLE IF NOT EXISTS import_author_map (external_id TEXT PRIMARY KEY, author_id INT NOT NULL)")
+    cursor.execute("CREATE TABLE IF NOT EXISTS import_book_map (external_id TEXT PRIMARY KEY, book_id INT NOT NULL)")
+
+
+def merge_texts(cursor):
+    """Сохранить тексты пачки в сжатые файлы через textstore (все книги пачки сразу)."""
+    cursor.execute("""
+        SELECT m.book_id, s.book_text
+        FROM stage_texts s
+        JOIN import_book_map m ON m.external_id = s.book
+    """)
+    rows = cursor.fetchall()
+    textstore.save_many(cursor, rows)
+    return len(rows)
+
+
+def import_file(connection, kind, path, batch_rows=BATCH_ROWS):
+    """Загрузка одного файла пачками; возвращает (прочитано, вставлено, пропущено строк)."""
+    stage = "stage_" + kind.replace("-", "_")
+    columns = COLUMNS[kind]
+    read = inserted = skipped = 0
+    with connection.cursor() as cursor:
+        cursor.execute(STAGING_TABLES[kind])
+        connection.commit()
+        for buffer, count in batches(read_rows(path), columns, batch_rows):
+            cursor.execute(f"TRUNCATE {stage}")
+            cursor.copy_expert(f"COPY {stage} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            for statement in REJECT.get(kind, []):
+                cursor.execute(statement)
+                skipped += cursor.rowcount
+            # Сжатые файлы пишет клиент; без файлового хранилища тексты переносятся на сервере
+            if kind == "texts" and textstore.enabled():
+                inserted += merge_texts(cursor)
+            else:
+                for statement in MERGE.get(kind, []):
+                    cursor.execute(statement)
+                    if "RETURNING" in statement:
+                        inserted += cursor.rowcount
+            connection.commit()
+            read += count
+            print(f"{kind}: прочитано {read}, добавлено {inserted}, пропущено {skipped}")
+    return read, inserted, skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Массовая загрузка каталога через COPY")
+    for kind in ORDER:
+        parser.add_argument(f"--{kind}", dest=kind.replace("-", "_"), help=f"CSV/JSONL файл ({kind})")
+    parser.add_argument("--batch-size", type=int, default=BATCH_ROWS, help="строк в одной пачке")
+    args = parser.parse_args()
+
+    with db.connection(DB_CONFIG) as connection:
+        with connection.cursor() as cursor:
+            prepare(cursor)
+        connection.commit()
+        try:
+            for kind in ORDER:
+                path = getattr(args, kind.replace("-", "_"))
+                if path:
+                    started = time.perf_counter()
+                    read, inserted, skipped = import_file(connection, kind, path, args.batch_size)
+                    print(
+                        f"{kind}: готово за {time.perf_counter() - started:.1f} с "
+                        f"({read} строк, добавлено {inserted}, пропущено {skipped})"
+                    )
+                    if skipped:
+                        print(f"{kind}: пропущены строки без обязательных полей или с повторным ID")
+        except Exception as e:
+            connection.rollback()
+            print(f"Ошибка загрузки: {e}")
+            raise
+
+    # Оглавление и поисковый индекс текстов, загруженных напрямую в book_texts
+    if args.texts and not textstore.enabled():
+        started = time.perf_counter()
+        indexed = textstore.index_missing(DB_CONFIG)
+        print(f"Оглавление и поисковый индекс: {indexed} текстов за {time.perf_counter() - started:.1f} с")
+
+    # Новые книги, жанры и возрастные категории попадают в каталог после обновления представлений
+    started = time.perf_counter()
+    catalog.refresh(DB_CONFIG)
+    print(f"Каталог обновлен за {time.perf_counter() - started:.1f} с")
+
+
+if __name__ == "__main__":
+    main()
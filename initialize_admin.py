@@ -1,9 +1,9 @@
 # запустить 1 раз
 
-import bcrypt
 import psycopg2
 import os
 from dotenv import load_dotenv
+from utils import passwords
 
 
 # Загружаем переменные окружения из .env файла
@@ -40,8 +40,8 @@ def initialize_admin():
         if count > 0:
             print("Администратор уже существует в базе данных.")
         else:
-            # Генерация хэша пароля
-            hashed_password = bcrypt.hashpw(ADMIN_PASSWORD.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+            # Генерация хэша пароля (стоимость задается BCRYPT_ROUNDS)
+            hashed_password = passwords.hash_password(ADMIN_PASSWORD)
             # Вставка данных администратора
             cursor.execute(
                 "INSERT INTO Users (email, hash_password, role, age) VALUES (%s, %s, %s, %s)",
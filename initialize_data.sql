@@ -1,3 +1,6 @@
+-- Расширение для нечеткого (триграммного) поиска
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
 -- Таблица пользователей
 CREATE TABLE IF NOT EXISTS Users (
     user_id SERIAL PRIMARY KEY,
@@ -11,7 +14,11 @@ CREATE TABLE IF NOT EXISTS Users (
 CREATE TABLE IF NOT EXISTS Authors (
     author_id SERIAL PRIMARY KEY,
     fullname VARCHAR(255) NOT NULL,
-    biography TEXT
+    biography TEXT,
+    search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', fullname), 'A') ||
+        setweight(to_tsvector('russian', coalesce(biography, '')), 'B')
+    ) STORED
 );
 
 -- Таблица книг
@@ -24,6 +31,10 @@ CREATE TABLE IF NOT EXISTS Books (
     number_of_likes INT DEFAULT 0,
     number_of_comments INT DEFAULT 0,
     book_cover VARCHAR(255),
+    search_vector tsvector GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', title), 'A') ||
+        setweight(to_tsvector('russian', coalesce(description, '')), 'B')
+    ) STORED,
     FOREIGN KEY (author_id) REFERENCES Authors(author_id)
 );
 
@@ -52,6 +63,16 @@ CREATE TABLE IF NOT EXISTS Liked_Books (
     FOREIGN KEY (book_id) REFERENCES Books(book_id)
 );
 
+-- Таблица любимых авторов
+CREATE TABLE IF NOT EXISTS Favorite_Authors (
+    user_id INT NOT NULL,
+    author_id INT NOT NULL,
+    added_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, author_id),
+    FOREIGN KEY (user_id) REFERENCES Users(user_id),
+    FOREIGN KEY (author_id) REFERENCES Authors(author_id)
+);
+
 -- Таблица комментариев
 CREATE TABLE IF NOT EXISTS Comments (
     book_id INT NOT NULL,
@@ -82,10 +103,255 @@ CREATE TABLE IF NOT EXISTS Book_Genres (
 CREATE TABLE IF NOT EXISTS Book_Texts (
     book_id INT NOT NULL,
     book_text TEXT NOT NULL,
+    text_length INT GENERATED ALWAYS AS (char_length(book_text)) STORED,
+    PRIMARY KEY (book_id),
+    FOREIGN KEY (book_id) REFERENCES Books(book_id)
+);
+
+-- Тексты хранятся без сжатия, чтобы substring читал из TOAST только нужные фрагменты
+ALTER TABLE Book_Texts ALTER COLUMN book_text SET STORAGE EXTERNAL;
+
+-- Тексты в сжатых файлах (utils/textstore.py): хэш содержимого - имя файла,
+-- block_offsets - смещения блоков по block_chars символов (последний элемент - размер файла)
+CREATE TABLE IF NOT EXISTS Book_Text_Files (
+    book_id INT NOT NULL,
+    content_hash CHAR(64) NOT NULL,
+    text_length INT NOT NULL,
+    block_chars INT NOT NULL,
+    block_offsets BIGINT[] NOT NULL,
     PRIMARY KEY (book_id),
     FOREIGN KEY (book_id) REFERENCES Books(book_id)
 );
 
+-- Оглавление книги: заголовки глав и их смещения в тексте (в символах)
+CREATE TABLE IF NOT EXISTS Book_Chapters (
+    book_id INT NOT NULL,
+    chapter_no INT NOT NULL,
+    title TEXT NOT NULL,
+    char_offset INT NOT NULL,
+    PRIMARY KEY (book_id, chapter_no),
+    FOREIGN KEY (book_id) REFERENCES Books(book_id)
+);
+
+-- Поисковый индекс текстов: книга делится на отрывки (utils/textstore.py), для каждого
+-- хранится только tsvector и положение в тексте; сниппет строится по самому тексту
+CREATE TABLE IF NOT EXISTS Book_Passages (
+    book_id INT NOT NULL,
+    passage_no INT NOT NULL,
+    char_offset INT NOT NULL,
+    char_length INT NOT NULL,
+    search_vector TSVECTOR NOT NULL,
+    PRIMARY KEY (book_id, passage_no),
+    FOREIGN KEY (book_id) REFERENCES Books(book_id)
+);
+CREATE INDEX IF NOT EXISTS idx_book_passages_search ON Book_Passages USING GIN (search_vector);
+
+-- Позиция чтения пользователя в книге
+CREATE TABLE IF NOT EXISTS Reading_Positions (
+    user_id INT NOT NULL,
+    book_id INT NOT NULL,
+    page INT NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, book_id),
+    FOREIGN KEY (user_id) REFERENCES Users(user_id),
+    FOREIGN KEY (book_id) REFERENCES Books(book_id)
+);
+
+-- Предрассчитанные рекомендации: топ-K похожих книг (utils/recommendations.py)
+CREATE TABLE IF NOT EXISTS Book_Recommendations (
+    book_id INT NOT NULL,
+    recommended_book_id INT NOT NULL,
+    score REAL NOT NULL,
+    PRIMARY KEY (book_id, recommended_book_id),
+    FOREIGN KEY (book_id) REFERENCES Books(book_id),
+    FOREIGN KEY (recommended_book_id) REFERENCES Books(book_id)
+);
+
+-- Индекс для keyset-пагинации каталога по названию
+CREATE INDEX IF NOT EXISTS idx_books_title_id ON Books (title, book_id);
+
+-- Индексы полнотекстового и нечеткого поиска по книгам и авторам
+CREATE INDEX IF NOT EXISTS idx_books_search_vector ON Books USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_books_title_trgm ON Books USING GIN (title gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_authors_search_vector ON Authors USING GIN (search_vector);
+CREATE INDEX IF NOT EXISTS idx_authors_fullname_trgm ON Authors USING GIN (fullname gin_trgm_ops);
+
+-- Индекс для выборки поклонников автора
+CREATE INDEX IF NOT EXISTS idx_favorite_authors_author ON Favorite_Authors (author_id);
+
+-- Индексы для комментариев к книге и для ленты комментариев по дате
+CREATE INDEX IF NOT EXISTS idx_comments_book_date ON Comments (book_id, date);
+CREATE INDEX IF NOT EXISTS idx_comments_date ON Comments (date, book_id, user_id);
+
+-- Индекс для удаления книги из чужих списков рекомендаций
+CREATE INDEX IF NOT EXISTS idx_book_recommendations_recommended ON Book_Recommendations (recommended_book_id);
+
+-- Индексы внешних ключей: книги автора, лайки и жанры книги, книги возрастной категории.
+-- Нужны для выборок по этим столбцам и для проверки ссылок при удалении.
+-- В существующие базы добавляются миграцией migrations/0002_secondary_indexes.sql
+CREATE INDEX IF NOT EXISTS idx_books_author ON Books (author_id);
+CREATE INDEX IF NOT EXISTS idx_liked_books_book ON Liked_Books (book_id);
+CREATE INDEX IF NOT EXISTS idx_book_genres_genre ON Book_Genres (genre_id);
+CREATE INDEX IF NOT EXISTS idx_age_categories_of_books_age ON Age_Categories_of_Books (age_id);
+
+-- Счетчики books.number_of_likes и books.number_of_comments поддерживаются триггерами.
+-- Триггеры уровня оператора с таблицами переходов обновляют каждую книгу
+-- один раз даже при массовой вставке или удалении
+CREATE OR REPLACE FUNCTION likes_inserted() RETURNS trigger AS $$
+BEGIN
+    UPDATE Books b SET number_of_likes = b.number_of_likes + n.cnt
+    FROM (SELECT book_id, COUNT(*) AS cnt FROM new_rows GROUP BY book_id) n
+    WHERE b.book_id = n.book_id;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION likes_deleted() RETURNS trigger AS $$
+BEGIN
+    UPDATE Books b SET number_of_likes = b.number_of_likes - o.cnt
+    FROM (SELECT book_id, COUNT(*) AS cnt FROM old_rows GROUP BY book_id) o
+    WHERE b.book_id = o.book_id;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION comments_inserted() RETURNS trigger AS $$
+BEGIN
+    UPDATE Books b SET number_of_comments = b.number_of_comments + n.cnt
+    FROM (SELECT book_id, COUNT(*) AS cnt FROM new_rows GROUP BY book_id) n
+    WHERE b.book_id = n.book_id;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION comments_deleted() RETURNS trigger AS $$
+BEGIN
+    UPDATE Books b SET number_of_comments = b.number_of_comments - o.cnt
+    FROM (SELECT book_id, COUNT(*) AS cnt FROM old_rows GROUP BY book_id) o
+    WHERE b.book_id = o.book_id;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS liked_books_insert ON Liked_Books;
+CREATE TRIGGER liked_books_insert AFTER INSERT ON Liked_Books
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION likes_inserted();
+DROP TRIGGER IF EXISTS liked_books_delete ON Liked_Books;
+CREATE TRIGGER liked_books_delete AFTER DELETE ON Liked_Books
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION likes_deleted();
+DROP TRIGGER IF EXISTS comments_insert ON Comments;
+CREATE TRIGGER comments_insert AFTER INSERT ON Comments
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION comments_inserted();
+DROP TRIGGER IF EXISTS comments_delete ON Comments;
+CREATE TRIGGER comments_delete AFTER DELETE ON Comments
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION comments_deleted();
+
+-- Полный пересчет счетчиков (для баз, заполненных до появления триггеров)
+CREATE OR REPLACE FUNCTION recount_book_counters() RETURNS void AS $$
+    UPDATE Books b SET
+        number_of_likes = (SELECT COUNT(*) FROM Liked_Books lb WHERE lb.book_id = b.book_id),
+        number_of_comments = (SELECT COUNT(*) FROM Comments c WHERE c.book_id = b.book_id);
+$$ LANGUAGE sql;
+
+-- Журнал активности для статистики (utils/analytics.py): лайки, снятые лайки и комментарии.
+-- txid - номер транзакции, по нему свертка определяет, какие события уже учтены
+CREATE TABLE IF NOT EXISTS Activity_Log (
+    event_id BIGSERIAL PRIMARY KEY,
+    book_id INT NOT NULL,
+    kind TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    txid BIGINT NOT NULL DEFAULT txid_current()
+);
+CREATE INDEX IF NOT EXISTS idx_activity_log_txid ON Activity_Log (txid);
+CREATE INDEX IF NOT EXISTS idx_activity_log_created_at ON Activity_Log (created_at);
+
+-- Свертки: активность по книгам за день и итоги по авторам (лайки за вычетом снятых)
+CREATE TABLE IF NOT EXISTS Book_Activity_Daily (
+    day DATE NOT NULL,
+    book_id INT NOT NULL,
+    likes INT NOT NULL DEFAULT 0,
+    unlikes INT NOT NULL DEFAULT 0,
+    comments INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, book_id)
+);
+CREATE TABLE IF NOT EXISTS Author_Activity (
+    author_id INT PRIMARY KEY,
+    likes INT NOT NULL DEFAULT 0,
+    comments INT NOT NULL DEFAULT 0
+);
+
+-- Водяной знак свертки: события транзакций с меньшим номером уже учтены
+CREATE TABLE IF NOT EXISTS Rollup_Watermarks (
+    name TEXT PRIMARY KEY,
+    watermark BIGINT NOT NULL,
+    refreshed_at TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION log_activity() RETURNS trigger AS $$
+BEGIN
+    IF TG_ARGV[0] = 'comment' THEN
+        INSERT INTO Activity_Log (book_id, kind, created_at)
+        SELECT book_id, 'comment', COALESCE(date, CURRENT_TIMESTAMP) FROM new_rows;
+    ELSIF TG_ARGV[0] = 'like' THEN
+        INSERT INTO Activity_Log (book_id, kind) SELECT book_id, 'like' FROM new_rows;
+    ELSE
+        INSERT INTO Activity_Log (book_id, kind) SELECT book_id, 'unlike' FROM old_rows;
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS liked_books_insert_log ON Liked_Books;
+CREATE TRIGGER liked_books_insert_log AFTER INSERT ON Liked_Books
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_activity('like');
+DROP TRIGGER IF EXISTS liked_books_delete_log ON Liked_Books;
+CREATE TRIGGER liked_books_delete_log AFTER DELETE ON Liked_Books
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION log_activity('unlike');
+DROP TRIGGER IF EXISTS comments_insert_log ON Comments;
+CREATE TRIGGER comments_insert_log AFTER INSERT ON Comments
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_activity('comment');
+
+INSERT INTO Rollup_Watermarks (name, watermark) VALUES ('activity', 0) ON CONFLICT DO NOTHING;
+
+-- Каталог: одна строка на книгу с автором, возрастными категориями, жанрами и счетчиками.
+-- Обновляется REFRESH MATERIALIZED VIEW CONCURRENTLY после записей администратора (utils/catalog.py)
+CREATE MATERIALIZED VIEW IF NOT EXISTS Catalog AS
+SELECT b.book_id, b.title, b.date, b.author_id, a.fullname AS author_name,
+       b.description, b.book_cover, b.number_of_likes, b.number_of_comments,
+       COALESCE(ages.ids, '{}') AS age_ids, ages.names AS age_categories,
+       COALESCE(genres.ids, '{}') AS genre_ids, genres.names AS genres
+FROM Books b
+JOIN Authors a ON a.author_id = b.author_id
+LEFT JOIN LATERAL (
+    SELECT array_agg(ac.age_id ORDER BY ac.age_id) AS ids,
+           string_agg(ac.category_characteristic, ', ' ORDER BY ac.age_id) AS names
+    FROM Age_Categories_of_Books acb
+    JOIN Age_Category ac ON ac.age_id = acb.age_id
+    WHERE acb.book_id = b.book_id
+) ages ON TRUE
+LEFT JOIN LATERAL (
+    SELECT array_agg(g.genre_id ORDER BY g.genre_id) AS ids,
+           string_agg(g.genre_name, ', ' ORDER BY g.genre_name) AS names
+    FROM Book_Genres bg
+    JOIN Genres g ON g.genre_id = bg.genre_id
+    WHERE bg.book_id = b.book_id
+) genres ON TRUE;
+
+-- Уникальный индекс нужен для обновления CONCURRENTLY
+CREATE UNIQUE INDEX IF NOT EXISTS idx_catalog_book_id ON Catalog (book_id);
+CREATE INDEX IF NOT EXISTS idx_catalog_title_id ON Catalog (title, book_id);
+CREATE INDEX IF NOT EXISTS idx_catalog_genre_ids ON Catalog USING GIN (genre_ids);
+CREATE INDEX IF NOT EXISTS idx_catalog_age_ids ON Catalog USING GIN (age_ids);
+
+-- Число книг по каждому жанру и возрастной категории для фильтров каталога
+CREATE MATERIALIZED VIEW IF NOT EXISTS Catalog_Facets AS
+SELECT 'genre' AS facet, g.genre_id AS value_id, g.genre_name AS name, COUNT(bg.book_id) AS books
+FROM Genres g
+LEFT JOIN Book_Genres bg ON bg.genre_id = g.genre_id
+GROUP BY g.genre_id, g.genre_name
+UNION ALL
+SELECT 'age', ac.age_id, ac.age, COUNT(acb.book_id)
+FROM Age_Category ac
+LEFT JOIN Age_Categories_of_Books acb ON acb.age_id = ac.age_id
+GROUP BY ac.age_id, ac.age;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_catalog_facets ON Catalog_Facets (facet, value_id);
+
 -- Тестовые данные для пользователей
 INSERT INTO Users (email, age, role, hash_password)
 VALUES
@@ -99,6 +365,9 @@ INSERT INTO Authors (author_id, fullname, biography) VALUES
 (1, 'Александр Пушкин', 'Русский поэт, драматург и прозаик.'),
 (2, 'Анна Ахматова', 'Русская поэтесса, одна из самых значительных фигур русской литературы XX века.');
 
+-- Авторы вставлены с явными ID, поэтому сдвигаем последовательность
+SELECT setval(pg_get_serial_sequence('authors', 'author_id'), (SELECT MAX(author_id) FROM Authors));
+
 -- Тестовые данные для книг
 INSERT INTO Books (title, date, author_id, description, book_cover) VALUES
 ('Я вас любил', '1833-01-01', 1, 'Стихотворение о любви.', 'ya_vas_lyubil.jpg'),
@@ -137,5 +406,6 @@ INSERT INTO Comments (book_id, user_id, comment_text, date) VALUES
 (1, 1, 'Прекрасное стихотворение!'),
 (2, 2, 'Грустно, но очень красиво!');
 
-
-
+-- Заполняем представления каталога тестовыми данными
+REFRESH MATERIALIZED VIEW Catalog;
+REFRESH MATERIALIZED VIEW Catalog_Facets;
@@ -0,0 +1,172 @@
+# Версионные миграции схемы для уже существующих баз.
+#
+# Пример:
+#   python migrate.py            применить все новые миграции
+#   python migrate.py --status   показать примененные и ожидающие миграции
+#
+# Миграции лежат в каталоге migrations/ в файлах <версия>_<название>.sql и
+# применяются по возрастанию версии. Примененные версии и контрольные суммы
+# файлов хранятся в таблице schema_migrations. Обычная миграция выполняется
+# в одной транзакции. Миграция, первая строка которой
+# "-- migrate: no-transaction", выполняется по одному оператору вне
+# транзакции (нужно для CREATE INDEX CONCURRENTLY); ее операторы должны быть
+# идемпотентными, чтобы прерванную миграцию можно было запустить повторно.
+#
+# База, созданная текущим initialize_data.sql, уже соответствует всем
+# миграциям: их повторное применение ничего не меняет.
+
+import argparse
+import hashlib
+import os
+import re
+import sys
+from dotenv import load_dotenv
+from utils import db
+
+# Загружаем переменные окружения из .env файла
+load_dotenv()
+
+DB_CONFIG = {
+    "host": os.getenv("DB_HOST"),
+    "database": os.getenv("DB_DATABASE"),
+    "user": os.getenv("DB_USER"),
+    "password": os.getenv("DB_PASSWORD")
+}
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+NO_TRANSACTION = "-- migrate: no-transaction"
+# Ключ advisory-блокировки: два одновременных запуска не применяют миграции дважды
+MIGRATION_LOCK_ID = 20240601
+CONCURRENT_INDEX = re.compile(r"CREATE\s+(?:UNIQUE\s+)?INDEX\s+CONCURRENTLY\s+IF\s+NOT\s+EXISTS\s+(\w+)", re.IGNORECASE)
+
+
+def load_migrations():
+    """Список миграций (версия, название, текст, контрольная сумма) по возрастанию версии."""
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = MIGRATION_FILE.match(filename)
+        if not match:
+            continue
+        with open(os.path.join(MIGRATIONS_DIR, filename), encoding="utf-8") as file:
+            sql = file.read()
+        checksum = hashlib.sha256(sql.encode("utf-8")).hexdigest()
+        migrations.append((int(match.group(1)), match.group(2), sql, checksum))
+    versions = [migration[0] for migration in migrations]
+    if len(versions) != len(set(versions)):
+        sys.exit("Несколько файлов миграций с одной версией")
+    return migrations
+
+
+def split_statements(sql):
+    """Разбиение файла на операторы по ";" в конце строки (без комментариев)."""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    statements = re.split(r";\s*$", "\n".join(lines), flags=re.MULTILINE)
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def applied_migrations(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT PRIMARY KEY,
+            name TEXT NOT NULL,
+            checksum TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version, checksum, applied_at FROM schema_migrations")
+    return {version: (checksum, applied_at) for version, checksum, applied_at in cursor.fetchall()}
+
+
+def record(cursor, version, name, checksum):
+    cursor.execute(
+        "INSERT INTO schema_migrations (version, name, checksum) VALUES (%s, %s, %s)",
+        (version, name, checksum)
+    )
+
+
+def apply_in_transaction(connection, version, name, sql, checksum):
+    """Вся миграция и запись о ней - одна транзакция."""
+    connection.autocommit = False
+    try:
+        with connection.cursor() as cursor:
+            cursor.execute(sql)
+            record(cursor, version, name, checksum)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+
+def apply_without_transaction(connection, version, name, sql, checksum):
+    """Операторы по одному в autocommit (CREATE INDEX CONCURRENTLY не работает в транзакции)."""
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        # Прерванный CREATE INDEX CONCURRENTLY оставляет невалидный индекс,
+        # который IF NOT EXISTS пропустил бы; такие индексы создаются заново
+        cursor.execute("""
+            SELECT c.relname
+            FROM pg_index i
+            JOIN pg_class c ON c.oid = i.indexrelid
+            WHERE NOT i.indisvalid AND c.relname = ANY(%s)
+        """, ([index.lower() for index in CONCURRENT_INDEX.findall(sql)],))
+        for (index,) in cursor.fetchall():
+            print(f"  удаляется невалидный индекс {index}")
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS "{index}"')
+        for statement in split_statements(sql):
+            cursor.execute(statement)
+        record(cursor, version, name, checksum)
+
+
+def migrate(connection, status_only=False):
+    """Применить новые миграции; возвращает число примененных."""
+    connection.autocommit = True
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT pg_advisory_lock(%s)", (MIGRATION_LOCK_ID,))
+    try:
+        with connection.cursor() as cursor:
+            applied = applied_migrations(cursor)
+
+        count = 0
+        for version, name, sql, checksum in load_migrations():
+            if version in applied:
+                applied_checksum, applied_at = applied[version]
+                note = "" if applied_checksum == checksum else " (файл изменен после применения!)"
+                print(f"{version:04d} {name}: применена {applied_at:%Y-%m-%d %H:%M}{note}")
+                continue
+            if status_only:
+                print(f"{version:04d} {name}: ожидает")
+                continue
+
+            print(f"{version:04d} {name}: применяется...")
+            if sql.lstrip().startswith(NO_TRANSACTION):
+                apply_without_transaction(connection, version, name, sql, checksum)
+            else:
+                apply_in_transaction(connection, version, name, sql, checksum)
+            count += 1
+        return count
+    finally:
+        connection.autocommit = True
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (MIGRATION_LOCK_ID,))
+        connection.autocommit = False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Версионные миграции схемы")
+    parser.add_argument("--status", action="store_true", help="только показать состояние миграций")
+    args = parser.parse_args()
+
+    with db.connection(DB_CONFIG) as connection:
+        try:
+            count = migrate(connection, args.status)
+        except Exception as e:
+            print(f"Ошибка миграции: {e}")
+            raise
+
+    if not args.status:
+        print(f"Применено миграций: {count}")
+
+
+if __name__ == "__main__":
+    main()
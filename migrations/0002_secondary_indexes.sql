@@ -0,0 +1,16 @@
+-- migrate: no-transaction
+-- Вторичные индексы для внешних ключей и частых фильтров.
+-- CONCURRENTLY не блокирует запись, но не работает внутри транзакции,
+-- поэтому миграция выполняется по одному оператору.
+
+-- Книги автора и проверка внешнего ключа при удалении автора
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_books_author ON Books (author_id);
+
+-- Лайки книги: удаление книги, пересчет рекомендаций, проверка внешнего ключа
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_liked_books_book ON Liked_Books (book_id);
+
+-- Книги жанра: фасеты каталога и проверка внешнего ключа
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_book_genres_genre ON Book_Genres (genre_id);
+
+-- Книги возрастной категории: фасеты каталога
+CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_age_categories_of_books_age ON Age_Categories_of_Books (age_id);
@@ -0,0 +1,21 @@
+-- Индекс сжатых файлов текстов и оглавления книг (utils/textstore.py).
+-- Сами тексты переносятся из book_texts командой python -m utils.textstore --migrate
+
+CREATE TABLE IF NOT EXISTS Book_Text_Files (
+    book_id INT NOT NULL,
+    content_hash CHAR(64) NOT NULL,
+    text_length INT NOT NULL,
+    block_chars INT NOT NULL,
+    block_offsets BIGINT[] NOT NULL,
+    PRIMARY KEY (book_id),
+    FOREIGN KEY (book_id) REFERENCES Books(book_id)
+);
+
+CREATE TABLE IF NOT EXISTS Book_Chapters (
+    book_id INT NOT NULL,
+    chapter_no INT NOT NULL,
+    title TEXT NOT NULL,
+    char_offset INT NOT NULL,
+    PRIMARY KEY (book_id, chapter_no),
+    FOREIGN KEY (book_id) REFERENCES Books(book_id)
+);
@@ -0,0 +1,13 @@
+-- Поисковый индекс текстов книг по отрывкам (utils/textstore.py, utils/search.py).
+-- Отрывки уже сохраненных текстов строятся командой python -m utils.textstore --index
+
+CREATE TABLE IF NOT EXISTS Book_Passages (
+    book_id INT NOT NULL,
+    passage_no INT NOT NULL,
+    char_offset INT NOT NULL,
+    char_length INT NOT NULL,
+    search_vector TSVECTOR NOT NULL,
+    PRIMARY KEY (book_id, passage_no),
+    FOREIGN KEY (book_id) REFERENCES Books(book_id)
+);
+CREATE INDEX IF NOT EXISTS idx_book_passages_search ON Book_Passages USING GIN (search_vector);
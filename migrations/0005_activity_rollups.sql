@@ -0,0 +1,78 @@
+-- Журнал активности и свертки для панели аналитики (utils/analytics.py).
+-- Существующая история учитывается один раз: комментарии - по дням, лайки (у них нет даты) -
+-- только в итогах по авторам. Триггеры создаются до переноса и блокируют запись в таблицы
+-- до конца миграции, поэтому каждое событие попадает либо в перенос, либо в журнал.
+
+-- Журнал активности для статистики (utils/analytics.py): лайки, снятые лайки и комментарии.
+-- txid - номер транзакции, по нему свертка определяет, какие события уже учтены
+CREATE TABLE IF NOT EXISTS Activity_Log (
+    event_id BIGSERIAL PRIMARY KEY,
+    book_id INT NOT NULL,
+    kind TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    txid BIGINT NOT NULL DEFAULT txid_current()
+);
+CREATE INDEX IF NOT EXISTS idx_activity_log_txid ON Activity_Log (txid);
+CREATE INDEX IF NOT EXISTS idx_activity_log_created_at ON Activity_Log (created_at);
+
+-- Свертки: активность по книгам за день и итоги по авторам (лайки за вычетом снятых)
+CREATE TABLE IF NOT EXISTS Book_Activity_Daily (
+    day DATE NOT NULL,
+    book_id INT NOT NULL,
+    likes INT NOT NULL DEFAULT 0,
+    unlikes INT NOT NULL DEFAULT 0,
+    comments INT NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, book_id)
+);
+CREATE TABLE IF NOT EXISTS Author_Activity (
+    author_id INT PRIMARY KEY,
+    likes INT NOT NULL DEFAULT 0,
+    comments INT NOT NULL DEFAULT 0
+);
+
+-- Водяной знак свертки: события транзакций с меньшим номером уже учтены
+CREATE TABLE IF NOT EXISTS Rollup_Watermarks (
+    name TEXT PRIMARY KEY,
+    watermark BIGINT NOT NULL,
+    refreshed_at TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION log_activity() RETURNS trigger AS $$
+BEGIN
+    IF TG_ARGV[0] = 'comment' THEN
+        INSERT INTO Activity_Log (book_id, kind, created_at)
+        SELECT book_id, 'comment', COALESCE(date, CURRENT_TIMESTAMP) FROM new_rows;
+    ELSIF TG_ARGV[0] = 'like' THEN
+        INSERT INTO Activity_Log (book_id, kind) SELECT book_id, 'like' FROM new_rows;
+    ELSE
+        INSERT INTO Activity_Log (book_id, kind) SELECT book_id, 'unlike' FROM old_rows;
+    END IF;
+    RETURN NULL;
+END $$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS liked_books_insert_log ON Liked_Books;
+CREATE TRIGGER liked_books_insert_log AFTER INSERT ON Liked_Books
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_activity('like');
+DROP TRIGGER IF EXISTS liked_books_delete_log ON Liked_Books;
+CREATE TRIGGER liked_books_delete_log AFTER DELETE ON Liked_Books
+    REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION log_activity('unlike');
+DROP TRIGGER IF EXISTS comments_insert_log ON Comments;
+CREATE TRIGGER comments_insert_log AFTER INSERT ON Comments
+    REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION log_activity('comment');
+
+INSERT INTO Book_Activity_Daily (day, book_id, comments)
+SELECT date::date, book_id, COUNT(*)
+FROM Comments
+WHERE NOT EXISTS (SELECT 1 FROM Rollup_Watermarks WHERE name = 'activity')
+GROUP BY date::date, book_id
+ON CONFLICT DO NOTHING;
+
+INSERT INTO Author_Activity (author_id, likes, comments)
+SELECT author_id, SUM(number_of_likes), SUM(number_of_comments)
+FROM Books
+WHERE NOT EXISTS (SELECT 1 FROM Rollup_Watermarks WHERE name = 'activity')
+GROUP BY author_id
+ON CONFLICT DO NOTHING;
+
+INSERT INTO Rollup_Watermarks (name, watermark, refreshed_at) VALUES ('activity', txid_current(), NOW())
+ON CONFLICT DO NOTHING;
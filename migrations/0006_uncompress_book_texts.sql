@@ -0,0 +1,8 @@
+-- STORAGE EXTERNAL (0001_schema_catch_up) действует только на новые значения: тексты,
+-- записанные раньше, остались сжатыми, и substring() распаковывает их целиком.
+-- Сжатые значения перезаписываются: новое значение сохраняется по текущей стратегии, без сжатия.
+-- Сжатое значение занимает меньше байт, чем сам текст; на базе из текущего
+-- initialize_data.sql таких строк нет, и оператор ничего не меняет.
+
+UPDATE Book_Texts SET book_text = book_text || ''
+WHERE pg_column_size(book_text) < octet_length(book_text);
@@ -0,0 +1,95 @@
+from utils.cache import QueryCache
+
+
+class FakeClock:
+    """Подменяет модуль time в utils.cache: время двигается вручную."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+def make_cache(monkeypatch, **kwargs):
+    clock = FakeClock()
+    monkeypatch.setattr("utils.cache.time", clock)
+    return QueryCache(**kwargs), clock
+
+
+def test_hit_and_miss(monkeypatch):
+    cache, _ = make_cache(monkeypatch, ttl=10)
+    assert cache.get("a") == (None, False)
+    cache.put("a", [1, 2], {"books"}, cache.generation)
+    assert cache.get("a") == ([1, 2], True)
+    stats = cache.get_stats()
+    assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+
+def test_entry_expires_after_ttl(monkeypatch):
+    cache, clock = make_cache(monkeypatch, ttl=10)
+    cache.put("a", 1, {"books"}, cache.generation)
+    clock.now += 10
+    assert cache.get("a") == (1, True)
+    clock.now += 0.5
+    assert cache.get("a") == (None, False)
+    # Просроченная запись удаляется вместе с тегами
+    assert cache.get_stats()["entries"] == 0
+    assert cache._tags == {}
+
+
+def test_lru_evicts_least_recently_used(monkeypatch):
+    cache, _ = make_cache(monkeypatch, max_entries=2)
+    cache.put("a", 1, set(), cache.generation)
+    cache.put("b", 2, set(), cache.generation)
+    cache.get("a")
+    cache.put("c", 3, set(), cache.generation)
+    assert cache.get("b") == (None, False)
+    assert cache.get("a") == (1, True)
+    assert cache.get("c") == (3, True)
+    assert cache.get_stats()["evictions"] == 1
+
+
+def test_byte_limit(monkeypatch):
+    cache, _ = make_cache(monkeypatch, max_bytes=200)
+    # Значение больше лимита не кэшируется
+    cache.put("big", "x" * 500, set(), cache.generation)
+    assert cache.get("big") == (None, False)
+    cache.put("a", "x" * 100, set(), cache.generation)
+    cache.put("b", "y" * 100, set(), cache.generation)
+    assert cache.get("a") == (None, False)
+    assert cache.get("b") == ("y" * 100, True)
+    assert cache.get_stats()["bytes"] <= 200
+
+
+def test_invalidate_by_tag(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    cache.put("books", 1, {"books"}, cache.generation)
+    cache.put("comments", 2, {"comments:1"}, cache.generation)
+    cache.put("both", 3, {"books", "comments:1"}, cache.generation)
+    cache.invalidate("comments:1")
+    assert cache.get("comments") == (None, False)
+    assert cache.get("both") == (None, False)
+    assert cache.get("books") == (1, True)
+    assert "comments:1" not in cache._tags
+    assert cache._tags["books"] == {"books"}
+
+
+def test_put_from_older_generation_is_dropped(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    generation = cache.generation
+    # Запись в БД произошла, пока читался результат
+    cache.invalidate("books")
+    cache.put("a", 1, {"books"}, generation)
+    assert cache.get("a") == (None, False)
+
+
+def test_replacing_key_updates_tags_and_size(monkeypatch):
+    cache, _ = make_cache(monkeypatch)
+    cache.put("a", "x" * 100, {"old"}, cache.generation)
+    cache.put("a", "y", {"new"}, cache.generation)
+    assert cache.get("a") == ("y", True)
+    assert "old" not in cache._tags
+    assert cache.get_stats()["entries"] == 1
+    cache.invalidate("new")
+    assert cache.get_stats()["bytes"] == 0
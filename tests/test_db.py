@@ -0,0 +1,28 @@
+from utils.db import PreparedStatement
+
+
+def test_named_placeholders():
+    statement = PreparedStatement("q_named", "SELECT * FROM books WHERE book_id = %(book_id)s AND title ILIKE %(title)s OR author_id = %(book_id)s")
+    assert statement.prepare_sql == "PREPARE q_named AS SELECT * FROM books WHERE book_id = $1 AND title ILIKE $2 OR author_id = $1"
+    assert statement.execute_sql == "EXECUTE q_named (%s, %s)"
+    assert statement.bind({"title": "a%", "book_id": 7, "unused": 1}) == [7, "a%"]
+
+
+def test_positional_placeholders():
+    statement = PreparedStatement("q_positional", "SELECT %s::int + %s::int")
+    assert statement.prepare_sql == "PREPARE q_positional AS SELECT $1::int + $2::int"
+    assert statement.execute_sql == "EXECUTE q_positional (%s, %s)"
+    assert statement.bind((3, 4)) == [3, 4]
+
+
+def test_escaped_percent():
+    statement = PreparedStatement("q_percent", "SELECT title FROM books WHERE title LIKE '100%%' AND book_id = %s")
+    assert statement.prepare_sql == "PREPARE q_percent AS SELECT title FROM books WHERE title LIKE '100%' AND book_id = $1"
+    assert statement.bind([5]) == [5]
+
+
+def test_without_parameters():
+    statement = PreparedStatement("q_plain", "SELECT COUNT(*) FROM books")
+    assert statement.prepare_sql == "PREPARE q_plain AS SELECT COUNT(*) FROM books"
+    assert statement.execute_sql == "EXECUTE q_plain"
+    assert statement.bind(None) == []
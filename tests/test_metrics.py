@@ -0,0 +1,34 @@
+from utils.metrics import BUCKETS, Histogram
+
+
+def test_empty_histogram():
+    assert Histogram().quantile(0.5) == 0.0
+
+
+def test_quantile_is_bucket_upper_bound():
+    histogram = Histogram()
+    for _ in range(9):
+        histogram.observe(0.003)
+    histogram.observe(0.3)
+    assert histogram.count == 10
+    assert histogram.quantile(0.5) == 0.005
+    assert histogram.quantile(0.9) == 0.005
+    assert histogram.quantile(0.95) == 0.5
+    assert histogram.quantile(1.0) == 0.5
+
+
+def test_bound_is_inclusive():
+    histogram = Histogram()
+    histogram.observe(0.01)
+    assert histogram.buckets[BUCKETS.index(0.01)] == 1
+    assert histogram.quantile(0.5) == 0.01
+
+
+def test_values_above_last_bucket_use_max():
+    histogram = Histogram()
+    histogram.observe(0.002)
+    histogram.observe(42.0)
+    assert histogram.quantile(0.5) == 0.005
+    assert histogram.quantile(0.99) == 42.0
+    assert histogram.max == 42.0
+    assert abs(histogram.sum - 42.002) < 1e-9
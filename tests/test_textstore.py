@@ -0,0 +1,69 @@
+import os
+
+import pytest
+
+from utils import textstore
+
+TEXT = "Глава 1\nЁлка в лесу родилась.\n\nГлава 2\nВ лесу она росла, зимой и летом стройная, зеленая была."
+
+
+@pytest.fixture(autouse=True)
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(textstore, "TEXT_STORE_DIR", str(tmp_path))
+    # Открытые файлы прежних тестов остаются в кэше mmap под тем же хэшем
+    monkeypatch.setattr(textstore, "_maps", textstore.OrderedDict())
+    return tmp_path
+
+
+def test_offsets_cover_file():
+    content_hash, offsets = textstore.write_file(TEXT, block_chars=8)
+    assert len(offsets) == -(-len(TEXT) // 8) + 1
+    assert offsets[0] == 0
+    assert offsets == sorted(offsets)
+    assert os.path.getsize(textstore._path(content_hash)) == offsets[-1]
+
+
+@pytest.mark.parametrize("start, length", [(0, 5), (3, 8), (7, 20), (0, len(TEXT)), (len(TEXT) - 3, 10), (16, 1)])
+def test_read_file_returns_slice(start, length):
+    content_hash, offsets = textstore.write_file(TEXT, block_chars=8)
+    assert textstore.read_file(content_hash, 8, offsets, start, length) == TEXT[start:start + length]
+
+
+def test_read_file_reads_only_needed_blocks():
+    content_hash, offsets = textstore.write_file(TEXT, block_chars=8)
+    before = textstore._stats["blocks_read"]
+    # Символы 9..16 лежат во втором и третьем блоках
+    assert textstore.read_file(content_hash, 8, offsets, 9, 8) == TEXT[9:17]
+    assert textstore._stats["blocks_read"] - before == 2
+
+
+def test_read_past_end_is_empty():
+    content_hash, offsets = textstore.write_file(TEXT, block_chars=8)
+    assert textstore.read_file(content_hash, 8, offsets, len(TEXT) + 10, 5) == ""
+
+
+def test_same_text_with_other_block_size_gets_own_file():
+    hash_8, offsets_8 = textstore.write_file(TEXT, block_chars=8)
+    hash_16, offsets_16 = textstore.write_file(TEXT, block_chars=16)
+    assert hash_8 != hash_16
+    assert textstore.read_file(hash_8, 8, offsets_8, 0, len(TEXT)) == TEXT
+    assert textstore.read_file(hash_16, 16, offsets_16, 0, len(TEXT)) == TEXT
+
+
+def test_rewrite_is_deduplicated():
+    first = textstore.write_file(TEXT, block_chars=8)
+    before = textstore._stats["files_deduplicated"]
+    assert textstore.write_file(TEXT, block_chars=8) == first
+    assert textstore._stats["files_deduplicated"] - before == 1
+
+
+def test_chapters():
+    assert textstore.chapters(TEXT) == [("Глава 1", 0), ("Глава 2", TEXT.index("Глава 2"))]
+
+
+def test_passages_cover_text():
+    result = textstore.passages(TEXT, size=20)
+    assert "".join(passage for _, passage in result) == TEXT
+    for offset, passage in result:
+        assert TEXT[offset:offset + len(passage)] == passage
+        assert len(passage) <= 20
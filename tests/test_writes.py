@@ -0,0 +1,101 @@
+import datetime
+
+from utils import writes
+from utils.writes import Event, _apply, _runs
+
+DB_CONFIG = {"database": "test"}
+
+
+class FakeCursor:
+    """Курсор, который запоминает запросы и возвращает заданные строки."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.executed = []
+
+    def execute(self, query, vars=None):
+        self.executed.append((query, vars))
+
+    def fetchall(self):
+        return self.rows
+
+
+def event(kind, user_id, book_id, text=None):
+    return Event(DB_CONFIG, kind, user_id, book_id, text)
+
+
+def test_runs_keep_order_of_kinds():
+    events = [event("like", 1, 1), event("like", 1, 2), event("unlike", 1, 1), event("like", 1, 1), event("comment", 1, 1, "a")]
+    runs = _runs(events)
+    assert [kind for kind, _ in runs] == ["like", "unlike", "like", "comment"]
+    assert [len(run) for _, run in runs] == [2, 1, 1, 1]
+    assert [e for _, run in runs for e in run] == events
+
+
+def test_runs_empty():
+    assert _runs([]) == []
+
+
+def test_likes_map_returned_rows_to_events():
+    events = [event("like", 1, 10), event("like", 2, 10), event("like", 1, 11)]
+    # Лайк (2, 10) уже был поставлен: ON CONFLICT DO NOTHING его не вернул
+    cursor = FakeCursor([(1, 10), (1, 11)])
+    assert _apply(cursor, "like", events) == [True, False, True]
+    query, vars = cursor.executed[0]
+    assert query is writes.INSERT_LIKES
+    assert vars == ([1, 2, 1], [10, 10, 11])
+
+
+def test_repeated_like_in_batch_counts_once():
+    events = [event("like", 1, 10), event("like", 1, 10)]
+    assert _apply(FakeCursor([(1, 10)]), "like", events) == [True, False]
+
+
+def test_unlikes():
+    events = [event("unlike", 1, 10), event("unlike", 1, 11)]
+    cursor = FakeCursor([(1, 11)])
+    assert _apply(cursor, "unlike", events) == [False, True]
+    assert cursor.executed[0][0] is writes.DELETE_LIKES
+
+
+def test_comments_get_dates_in_insert_order():
+    first = datetime.datetime(2024, 1, 1, 12, 0, 0)
+    second = first + datetime.timedelta(microseconds=5)
+    events = [event("comment", 1, 10, "a"), event("comment", 2, 10, "b"), event("comment", 1, 10, "c")]
+    # Строки (book_id, user_id, date); комментарий пользователя 2 не вставлен
+    cursor = FakeCursor([(10, 1, first), (10, 1, second)])
+    assert _apply(cursor, "comment", events) == [True, False, True]
+    assert [e.date for e in events] == [first, None, second]
+    query, vars = cursor.executed[0]
+    assert query is writes.INSERT_COMMENTS
+    assert vars == ([10, 10, 10], [1, 2, 1], ["a", "b", "c"])
+
+
+def test_comment_date_from_failed_attempt_is_reset():
+    comment = event("comment", 1, 10, "a")
+    comment.date = datetime.datetime(2024, 1, 1)
+    assert _apply(FakeCursor([]), "comment", [comment]) == [False]
+    assert comment.date is None
+
+
+def test_flush_loop_survives_failed_flush(monkeypatch):
+    flushed = []
+
+    def flush(events):
+        flushed.append(events)
+        if len(flushed) == 1:
+            raise RuntimeError("boom")
+        for e in events:
+            e.future.set_result(True)
+
+    monkeypatch.setattr(writes, "_flush", flush)
+    monkeypatch.setattr(writes, "_queue", writes.queue.Queue())
+    monkeypatch.setattr(writes, "WRITE_BATCH_SIZE", 1)
+    failed = event("like", 1, 10)
+    later = event("like", 1, 11)
+    for item in (failed, later, None):
+        writes._queue.put(item)
+    writes._flush_loop()
+    # Ошибка первой пачки досталась ее событиям, следующая пачка записана
+    assert isinstance(failed.future.exception(timeout=0), RuntimeError)
+    assert later.future.result(timeout=0) is True
@@ -1,21 +1,6 @@
 import streamlit as st
-import psycopg2
-import os
-import subprocess
-
-def connect_to_db(db_config):
-    """Подключение к базе данных с использованием переданных данных"""
-    try:
-        connection = psycopg2.connect(
-            host=db_config['host'],
-            database=db_config['database'],
-            user=db_config['user'],
-            password=db_config['password']
-        )
-        return connection
-    except Exception as e:
-        print(f"Ошибка подключения: {e}")
-        return None
+from datetime import datetime
+from utils import analytics, backup, cache, catalog, db, images, metrics, passwords, recommendations, textstore, writes
 
 def admin_page(DB_CONFIG):
     """Панель администратора."""
@@ -25,49 +10,295 @@ def admin_page(DB_CONFIG):
         create_db_backup(DB_CONFIG)
     if st.sidebar.checkbox("Добавить новую книгу"):
         add_book(DB_CONFIG)
-    if st.sidebar.checkbox("Удалить книгу"):
-        delete_book(DB_CONFIG)
+    if st.sidebar.checkbox("Удаление и массовое изменение книг"):
+        manage_books(DB_CONFIG)
     if st.sidebar.checkbox("Добавить нового автора"):
         add_author(DB_CONFIG)
+    if st.sidebar.checkbox("Пул соединений"):
+        show_pool_stats(DB_CONFIG)
+    if st.sidebar.checkbox("Кэш запросов"):
+        show_cache_stats()
+    if st.sidebar.checkbox("Хэширование паролей"):
+        show_password_stats()
+    if st.sidebar.checkbox("Очередь записи"):
+        show_write_stats()
+    if st.sidebar.checkbox("Мониторинг запросов"):
+        show_metrics(DB_CONFIG)
+    if st.sidebar.checkbox("Рекомендации"):
+        show_recommendation_stats(DB_CONFIG)
+    if st.sidebar.checkbox("Хранилище текстов"):
+        show_text_store_stats(DB_CONFIG)
+    if st.sidebar.checkbox("Аналитика"):
+        show_analytics(DB_CONFIG)
+
+def metrics_gauges(DB_CONFIG):
+    """Показатели пула соединений, кэша и хэширования для экспорта в Prometheus."""
+    pool = db.pool_stats(DB_CONFIG)
+    statements = db.prepared_stats()["statements"]
+    query_cache = cache.cache_stats()
+    hashing = passwords.password_stats()
+    catalog_refresh = catalog.refresh_stats()
+    replicas = db.replica_stats(DB_CONFIG)
+    write_queue = writes.write_stats()
+    rollups = analytics.analytics_stats()
+    gauges = {
+        "db_pool_in_use": pool["in_use"],
+        "db_pool_waits_total": pool["waits"],
+        "db_pool_wait_seconds_total": pool["wait_time_total"],
+        "db_pool_timeouts_total": pool["timeouts"],
+        "db_prepared_executions_total": sum(stats["executions"] for stats in statements),
+        "db_prepared_prepares_total": sum(stats["prepares"] for stats in statements),
+        "cache_hits_total": query_cache["hits"],
+        "cache_misses_total": query_cache["misses"],
+        "cache_bytes": query_cache["bytes"],
+        "password_queue_depth": hashing["queue_depth"],
+        "password_rejected_total": hashing["rejected"],
+        "catalog_refreshes_total": catalog_refresh["refreshes"],
+        "catalog_refresh_errors_total": catalog_refresh["errors"],
+        "db_primary_reads_total": replicas["primary_reads"],
+        "write_queue_depth": write_queue["queue_depth"],
+        "write_events_total": write_queue["events"],
+        "write_commits_total": write_queue["commits"],
+        "write_rejected_total": write_queue["rejected"],
+        "analytics_refreshes_total": rollups["refreshes"],
+        "analytics_events_total": rollups["events"],
+        "analytics_refresh_errors_total": rollups["errors"],
+    }
+    for i, replica in enumerate(replicas["replicas"]):
+        gauges[f"db_replica_{i}_reads_total"] = replica["reads"]
+        gauges[f"db_replica_{i}_available"] = int(replica["available"])
+        if replica["lag"] is not None:
+            gauges[f"db_replica_{i}_lag_seconds"] = replica["lag"]
+    return gauges
+
+def show_metrics(DB_CONFIG):
+    """Задержки запросов и страниц, журнал медленных запросов и экспорт в Prometheus."""
+    st.subheader("Мониторинг запросов")
+
+    st.write("**Запросы к базе данных**")
+    queries = metrics.query_summary()
+    if queries:
+        st.dataframe(queries, use_container_width=True)
+    else:
+        st.write("Запросов пока не было.")
+
+    st.write("**Отрисовка страниц**")
+    renders = metrics.render_summary()
+    if renders:
+        st.dataframe([{key: value for key, value in item.items() if key not in ("rows", "bytes")} for item in renders], use_container_width=True)
+
+    st.write(f"**Медленные запросы** (дольше {metrics.SLOW_QUERY_MS:.0f} мс)")
+    slow = metrics.slow_queries()
+    if not slow:
+        st.write("Медленных запросов нет.")
+    for item in slow:
+        with st.expander(f"{item['name']}: {item['seconds'] * 1000:.0f} мс"):
+            st.code(item["query"], language="sql")
+            st.code(item["plan"])
+
+    text = metrics.prometheus_text(metrics_gauges(DB_CONFIG))
+    with st.expander("Экспорт в формате Prometheus"):
+        st.code(text)
+    st.download_button("Скачать метрики", text, file_name="metrics.txt", mime="text/plain")
+    if st.button("Сбросить метрики"):
+        metrics.reset()
+        st.rerun()
+
+def show_pool_stats(DB_CONFIG):
+    """Метрики пула соединений с базой данных."""
+    st.subheader("Пул соединений")
+    stats = db.pool_stats(DB_CONFIG)
+    st.write(f"Размер пула: {stats['min_size']}–{stats['max_size']}, занято сейчас: {stats['in_use']}")
+    st.write(f"Выдано соединений: {stats['checkouts']}, из них с ожиданием: {stats['waits']}")
+    st.write(f"Ожидание: среднее {stats['wait_time_avg'] * 1000:.1f} мс, максимальное {stats['wait_time_max'] * 1000:.1f} мс")
+    st.write(f"Таймаутов ожидания: {stats['timeouts']}, переподключений: {stats['reconnects']}")
+
+    st.write("**Подготовленные запросы**")
+    prepared = db.prepared_stats()
+    if not prepared["enabled"]:
+        st.info("Подготовленные запросы отключены (DB_PREPARED_STATEMENTS=0).")
+    else:
+        st.write(f"Соединений с подготовленными запросами: {prepared['connections']}")
+        st.dataframe(prepared["statements"], use_container_width=True)
+
+    st.write("**Реплики для чтения**")
+    replicas = db.replica_stats(DB_CONFIG)
+    if not replicas["replicas"]:
+        st.info("Реплики не настроены (DB_REPLICAS), все запросы идут на основной сервер.")
+    else:
+        st.write(f"Допустимое отставание: {replicas['max_lag']:.0f} с, чтение своих записей с основного сервера: {replicas['read_your_writes_seconds']:.0f} с")
+        st.write(f"Чтений с основного сервера: {replicas['primary_reads']}, из них после своей записи: {replicas['own_write_reads']}, "
+                 f"без доступной реплики: {replicas['no_replica_reads']}")
+        st.dataframe([
+            {
+                "Реплика": replica["name"],
+                "Доступна": replica["available"],
+                "Отставание, с": replica["lag"],
+                "Чтений": replica["reads"],
+                "Пропущена": replica["skipped"],
+                "Сбоев": replica["failures"],
+                "Ошибка": replica["error"],
+            }
+            for replica in replicas["replicas"]
+        ], use_container_width=True)
+
+def show_cache_stats():
+    """Счетчики попаданий и промахов кэша запросов."""
+    st.subheader("Кэш запросов")
+    stats = cache.cache_stats()
+    st.write(f"Попаданий: {stats['hits']}, промахов: {stats['misses']} (доля попаданий {stats['hit_ratio']:.0%})")
+    st.write(f"Записей: {stats['entries']} из {stats['max_entries']}, объем: {stats['bytes'] / 1024:.1f} из {stats['max_bytes'] / 1024:.0f} КБ")
+    st.write(f"Вытеснено: {stats['evictions']}, сброшено при записи: {stats['invalidations']}")
+    if st.button("Очистить кэш"):
+        cache.clear()
+        st.success("Кэш очищен.")
+
+def show_password_stats():
+    """Метрики пула хэширования паролей."""
+    st.subheader("Хэширование паролей")
+    stats = passwords.password_stats()
+    st.write(f"Потоков: {stats['workers']}, стоимость bcrypt: {stats['rounds']}")
+    st.write(f"Очередь сейчас: {stats['queue_depth']}, максимум: {stats['queue_depth_max']} из {stats['queue_max']}")
+    st.write(f"Операций: {stats['submitted']}, отклонено при переполнении: {stats['rejected']}, не дождались результата: {stats['timeouts']}")
+    st.write(f"Ожидание в очереди: {stats['queue_time_avg'] * 1000:.1f} мс, хэширование: {stats['work_time_avg'] * 1000:.1f} мс")
+
+def show_write_stats():
+    """Метрики очереди записи лайков и комментариев."""
+    st.subheader("Очередь записи")
+    stats = writes.write_stats()
+    if not stats["enabled"]:
+        st.info("Очередь записи отключена (WRITE_BEHIND=0), каждое событие записывается сразу.")
+    st.write(f"Очередь сейчас: {stats['queue_depth']}, максимум: {stats['queue_depth_max']} из {stats['queue_max']}, отклонено: {stats['rejected']}")
+    st.write(f"Событий: {stats['events']}, из них изменили данные: {stats['written']}")
+    st.write(f"Пачек: {stats['batches']}, транзакций: {stats['commits']} ({stats['events_per_commit']:.1f} событий на транзакцию)")
+    st.write(f"Размер пачки: средний {stats['batch_size_avg']:.1f}, максимальный {stats['batch_size_max']}; запись пачки: {stats['flush_time_avg'] * 1000:.1f} мс")
+    st.write(f"Повторов по одному событию после ошибки пачки: {stats['fallbacks']}, ошибок: {stats['errors']}")
+
+def show_text_store_stats(DB_CONFIG):
+    """Объем сжатого хранилища текстов и число прочитанных блоков."""
+    st.subheader("Хранилище текстов")
+    stats = textstore.text_store_stats(DB_CONFIG)
+    if not stats["enabled"]:
+        st.info("Файловое хранилище не настроено (TEXT_STORE_DIR), тексты хранятся в таблице book_texts.")
+    else:
+        st.write(f"Каталог: {stats['directory']}")
+    ratio = stats["files_bytes"] / stats["files_chars"] if stats["files_chars"] else 0.0
+    st.write(f"Книг в файлах: {stats['files_books']} ({stats['files_bytes'] / 1024 / 1024:.1f} МБ, {ratio:.2f} байта на символ), в book_texts: {stats['database_books']}")
+    st.write(f"Чтений отрывков из файлов: {stats['reads']} ({stats['blocks_read']} блоков, {stats['bytes_read'] / 1024:.0f} КБ), из базы: {stats['database_reads']}")
+    st.write(f"Записано файлов: {stats['files_written']}, совпавших с уже сохраненными: {stats['files_deduplicated']}, открыто сейчас: {stats['open_files']}")
+
+def show_recommendation_stats(DB_CONFIG):
+    """Состояние пересчета рекомендаций и запуск полного пересчета."""
+    st.subheader("Рекомендации")
+    stats = recommendations.recommendation_stats()
+    if stats["last_build"]:
+        st.write(f"Полный пересчет: {datetime.fromtimestamp(stats['last_build']):%Y-%m-%d %H:%M:%S}, {stats['build_seconds']:.1f} с")
+    else:
+        st.write("Полный пересчет в этом процессе не выполнялся.")
+    st.write(f"Инкрементальных обновлений: {stats['updates']} ({stats['updated_books']} книг), ошибок: {stats['update_errors']}")
+    st.write(f"Книг в очереди на пересчет: {stats['pending']}")
+    if stats["build_running"]:
+        st.info("Идет полный пересчет...")
+    elif st.button("Пересчитать рекомендации"):
+        recommendations.start_build(DB_CONFIG)
+        st.success("Пересчет запущен в фоне.")
+
+def show_analytics(DB_CONFIG):
+    """Активность пользователей по сверткам: графики, топ книг и авторов, выгрузка в CSV."""
+    st.subheader("Аналитика")
+    refreshed_at, pending = analytics.rollup_state(DB_CONFIG)
+    refreshed = f"{refreshed_at:%Y-%m-%d %H:%M:%S}" if refreshed_at else "не выполнялась"
+    st.write(f"Последняя свертка: {refreshed}, событий ждут учета: {pending}")
+    if st.button("Обновить сейчас"):
+        events = analytics.refresh(DB_CONFIG)
+        if events is None:
+            st.info("Свертку сейчас выполняет другой процесс.")
+        else:
+            st.success(f"Учтено событий: {events}")
+            st.rerun()
+
+    days = st.selectbox("Период, дней", [7, 30, 90, 365])
+
+    daily = analytics.daily_activity(DB_CONFIG, days)
+    st.write("**Активность по дням**")
+    if daily:
+        st.line_chart({
+            "День": [row[0] for row in daily],
+            "Лайки": [row[1] for row in daily],
+            "Снятые лайки": [row[2] for row in daily],
+            "Комментарии": [row[3] for row in daily],
+        }, x="День")
+        st.download_button(
+            "Скачать CSV", analytics.to_csv(["day", "likes", "unlikes", "comments"], daily),
+            file_name=f"activity_{days}d.csv", mime="text/csv", key="analytics_daily_csv"
+        )
+    else:
+        st.write("За этот период активности нет.")
+
+    books = analytics.top_books(DB_CONFIG, days)
+    st.write(f"**Популярные книги за {days} дн.**")
+    if books:
+        st.bar_chart({"Книга": [row[1] for row in books], "Лайки": [row[2] for row in books], "Комментарии": [row[3] for row in books]}, x="Книга")
+        st.dataframe([{"ID": row[0], "Название": row[1], "Лайки": row[2], "Комментарии": row[3]} for row in books], use_container_width=True)
+        st.download_button(
+            "Скачать CSV", analytics.to_csv(["book_id", "title", "likes", "comments"], books),
+            file_name=f"top_books_{days}d.csv", mime="text/csv", key="analytics_books_csv"
+        )
+
+    authors = analytics.top_authors(DB_CONFIG)
+    st.write("**Популярные авторы за все время**")
+    if authors:
+        st.dataframe([{"ID": row[0], "Автор": row[1], "Лайки": row[2], "Комментарии": row[3]} for row in authors], use_container_width=True)
+        st.download_button(
+            "Скачать CSV", analytics.to_csv(["author_id", "fullname", "likes", "comments"], authors),
+            file_name="top_authors.csv", mime="text/csv", key="analytics_authors_csv"
+        )
 
 def create_db_backup(DB_CONFIG):
-    """Создание резервной копии базы данных."""
+    """Создание резервной копии базы данных и восстановление из нее."""
     st.subheader("Создание резервной копии базы данных")
-    backup_file_name = st.text_input("Введите имя файла для бекапа (без расширения)", "backup")
+    backup_file_name = st.text_input("Введите имя бекапа", datetime.now().strftime("backup_%Y%m%d_%H%M%S"))
 
+    # pg_dump выполняется в фоне, страница администратора не блокируется
     if st.button("Создать бекап"):
         if not backup_file_name:
             st.error("Пожалуйста, введите имя файла.")
         else:
-            backup_file_path = os.path.join("backups", f"{backup_file_name}.sql")
-
-            # Создаем директорию для бекапов, если она не существует
-            if not os.path.exists("backups"):
-                os.makedirs("backups")
-
-            # Формируем команду для создания бекапа
             try:
-                command = [
-                    "pg_dump",
-                    "-h", DB_CONFIG['host'],          # Хост базы данных
-                    "-U", DB_CONFIG['user'],          # Пользователь базы данных
-                    "-d", DB_CONFIG['database'],      # Имя базы данных
-                    "-f", backup_file_path             # Путь к файлу бекапа
-                ]
-                
-                # Передаем пароль через PGPASSWORD
-                env = os.environ.copy()
-                env["PGPASSWORD"] = DB_CONFIG['password']
-
-                # Выполняем команду
-                subprocess.run(command, check=True, env=env)
-
-                st.success(f"Бекап успешно создан: {backup_file_path}")
-
-            except subprocess.CalledProcessError as e:
+                backup.start_backup(DB_CONFIG, backup_file_name)
+                st.success(f"Создание бекапа '{backup_file_name}' запущено.")
+            except Exception as e:
                 st.error(f"Ошибка при создании бекапа: {e}")
+
+    st.write("**Задачи**")
+    jobs = backup.list_jobs()
+    if not jobs:
+        st.write("Задач пока не было.")
+    statuses = {"queued": "в очереди", "running": "выполняется", "done": "готово", "failed": "ошибка"}
+    kinds = {"backup": "Бекап", "restore": "Восстановление"}
+    for job in jobs:
+        st.progress(job["progress"], text=f"{kinds[job['kind']]} '{job['name']}': {statuses[job['status']]}")
+        if job["status"] == "failed":
+            st.error(job["message"])
+    if st.button("Обновить статус"):
+        st.rerun()
+
+    st.write(f"**Сохраненные бекапы** (хранятся последние {backup.BACKUP_KEEP})")
+    backups = backup.list_backups()
+    if not backups:
+        st.write("Бекапов пока нет.")
+    for item in backups:
+        st.write(f"- {item['name']}: {item['created']:%Y-%m-%d %H:%M}, {item['size'] / 1024 / 1024:.1f} МБ")
+
+    if backups:
+        restore_name = st.selectbox("Бекап для восстановления", [item["name"] for item in backups])
+        confirm = st.checkbox("Я понимаю, что текущие данные будут заменены")
+        if st.button("Восстановить", disabled=not confirm):
+            try:
+                backup.start_restore(DB_CONFIG, restore_name)
+                st.success(f"Восстановление из '{restore_name}' запущено.")
             except Exception as e:
-                st.error(f"Неизвестная ошибка: {e}")
+                st.error(f"Ошибка при восстановлении: {e}")
 
 def add_book(DB_CONFIG):
     """Добавление новой книги."""
@@ -96,99 +327,199 @@ def add_book(DB_CONFIG):
     # Получаем выбранный age_id
     age_id = age_ids[age_names.index(age_id)]
 
+    genres = dict(get_genres(DB_CONFIG))
+    genre_ids = st.multiselect("Жанры", list(genres), format_func=genres.get)
+
     if st.button("Добавить книгу"):
-        connection = connect_to_db(DB_CONFIG)
-        cursor = connection.cursor()
-        
-        # Вставка новой книги
+        with db.transaction(DB_CONFIG) as cursor:
+            # Вставка новой книги с получением ее ID
+            cursor.execute(
+                "INSERT INTO books (title, date, author_id, description, book_cover) VALUES (%s, %s, %s, %s, %s) RETURNING book_id",
+                (title, date, author_id, description, book_cover)
+            )
+            book_id = cursor.fetchone()[0]
+
+            if text:
+                textstore.save(cursor, book_id, text)
+
+            # Запись связи между книгой и возрастным рейтингом
+            cursor.execute(
+                "INSERT INTO age_categories_of_books (book_id, age_id) VALUES (%s, %s)",
+                (book_id, age_id)
+            )
+            if genre_ids:
+                cursor.execute(
+                    "INSERT INTO book_genres (book_id, genre_id) SELECT %s, genre_id FROM unnest(%s::int[]) AS genre_id",
+                    (book_id, genre_ids)
+                )
+
+        cache.invalidate("books")
+        # Представление каталога обновляется в фоне
+        catalog.request_refresh(DB_CONFIG)
+        st.success(f"Книга '{title}' успешно добавлена! В каталоге она появится через несколько секунд.")
+        # Миниатюры обложки строятся сразу, чтобы каталог не делал этого при первом показе
+        if book_cover and images.build_thumbnails(book_cover) is None:
+            st.warning(f"Файл обложки '{book_cover}' не найден в assets/images/.")        
+
+@cache.cached("age_categories")
+def get_age_categories(DB_CONFIG):
+    """Загрузка возрастных категорий из базы данных."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("SELECT age_id, category_characteristic FROM age_category")
+        return cursor.fetchall()
+
+@cache.cached("genres")
+def get_genres(DB_CONFIG):
+    """Загрузка жанров из базы данных."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("SELECT genre_id, genre_name FROM genres ORDER BY genre_name")
+        return cursor.fetchall()
+
+# Массовые операции над книгами: каждая - один оператор (одна транзакция, один обмен
+# с сервером) независимо от числа книг. Зависимые строки удаляются в CTE того же оператора
+DELETE_BOOKS_QUERY = """
+    WITH target AS (SELECT book_id FROM books WHERE book_id = ANY(%(book_ids)s::int[])),
+    deleted_texts AS (DELETE FROM book_texts WHERE book_id IN (SELECT book_id FROM target) RETURNING 1),
+    deleted_text_files AS (DELETE FROM book_text_files WHERE book_id IN (SELECT book_id FROM target) RETURNING 1),
+    deleted_chapters AS (DELETE FROM book_chapters WHERE book_id IN (SELECT book_id FROM target) RETURNING 1),
+    deleted_passages AS (DELETE FROM book_passages WHERE book_id IN (SELECT book_id FROM target) RETURNING 1),
+    deleted_activity AS (DELETE FROM book_activity_daily WHERE book_id IN (SELECT book_id FROM target) RETURNING 1),
+    deleted_positions AS (DELETE FROM reading_positions WHERE book_id IN (SELECT book_id FROM target) RETURNING 1),
+    deleted_recommendations AS (
+        DELETE FROM book_recommendations
+        WHERE book_id IN (SELECT book_id FROM target) OR recommended_book_id IN (SELECT book_id FROM target)
+        RETURNING 1
+    ),
+    deleted_genres AS (DELETE FROM book_genres WHERE book_id IN (SELECT book_id FROM target) RETURNING 1),
+    deleted_ages AS (DELETE FROM age_categories_of_books WHERE book_id IN (SELECT book_id FROM target) RETURNING 1),
+    deleted_likes AS (DELETE FROM liked_books WHERE book_id IN (SELECT book_id FROM target) RETURNING 1),
+    deleted_comments AS (DELETE FROM comments WHERE book_id IN (SELECT book_id FROM target) RETURNING 1),
+    deleted_books AS (DELETE FROM books WHERE book_id IN (SELECT book_id FROM target) RETURNING 1)
+    SELECT (SELECT COUNT(*) FROM deleted_books),
+           (SELECT COUNT(*) FROM deleted_comments),
+           (SELECT COUNT(*) FROM deleted_likes),
+           (SELECT COUNT(*) FROM deleted_texts) + (SELECT COUNT(*) FROM deleted_text_files),
+           (SELECT COUNT(*) FROM deleted_positions),
+           (SELECT COUNT(*) FROM deleted_genres),
+           (SELECT COUNT(*) FROM deleted_ages),
+           (SELECT COUNT(*) FROM deleted_recommendations)
+"""
+DELETE_BOOKS_COUNTS = [
+    "Книг", "Комментариев", "Лайков", "Текстов", "Позиций чтения",
+    "Связей с жанрами", "Связей с возрастными категориями", "Рекомендаций",
+]
+
+# Строки, которые уже совпадают с новым значением, не удаляются и не вставляются повторно
+RECATEGORIZE_BOOKS_QUERY = """
+    WITH target AS (SELECT book_id FROM books WHERE book_id = ANY(%(book_ids)s::int[])),
+    removed_ages AS (
+        DELETE FROM age_categories_of_books
+        WHERE %(age_id)s::int IS NOT NULL AND book_id IN (SELECT book_id FROM target) AND age_id <> %(age_id)s::int
+        RETURNING 1
+    ),
+    added_ages AS (
+        INSERT INTO age_categories_of_books (book_id, age_id)
+        SELECT book_id, %(age_id)s::int FROM target WHERE %(age_id)s::int IS NOT NULL
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    ),
+    removed_genres AS (
+        DELETE FROM book_genres
+        WHERE book_id IN (SELECT book_id FROM target) AND genre_id = ANY(%(remove_genres)s::int[])
+        RETURNING 1
+    ),
+    added_genres AS (
+        INSERT INTO book_genres (book_id, genre_id)
+        SELECT t.book_id, g.genre_id FROM target t CROSS JOIN unnest(%(add_genres)s::int[]) AS g(genre_id)
+        ON CONFLICT DO NOTHING
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM target),
+           (SELECT COUNT(*) FROM added_ages),
+           (SELECT COUNT(*) FROM removed_ages),
+           (SELECT COUNT(*) FROM added_genres),
+           (SELECT COUNT(*) FROM removed_genres)
+"""
+RECATEGORIZE_BOOKS_COUNTS = [
+    "Книг", "Добавлено возрастных категорий", "Снято возрастных категорий", "Добавлено жанров", "Снято жанров",
+]
+
+def delete_books(DB_CONFIG, book_ids):
+    """Удалить книги вместе с комментариями, лайками, текстами и связями; {описание: число строк}."""
+    with db.transaction(DB_CONFIG) as cursor:
+        cursor.execute(DELETE_BOOKS_QUERY, {"book_ids": list(book_ids)})
+        counts = dict(zip(DELETE_BOOKS_COUNTS, cursor.fetchone()))
+    cache.invalidate("books", "recommendations", *(f"comments:{book_id}" for book_id in book_ids))
+    catalog.request_refresh(DB_CONFIG)
+    return counts
+
+def recategorize_books(DB_CONFIG, book_ids, age_id=None, add_genres=(), remove_genres=()):
+    """Заменить возрастную категорию (если задана) и добавить/снять жанры у книг; {описание: число строк}."""
+    with db.transaction(DB_CONFIG) as cursor:
+        cursor.execute(RECATEGORIZE_BOOKS_QUERY, {
+            "book_ids": list(book_ids),
+            "age_id": age_id,
+            "add_genres": list(add_genres),
+            "remove_genres": [genre_id for genre_id in remove_genres if genre_id not in add_genres],
+        })
+        counts = dict(zip(RECATEGORIZE_BOOKS_COUNTS, cursor.fetchone()))
+    cache.invalidate("books")
+    catalog.request_refresh(DB_CONFIG)
+    return counts
+
+def reassign_books(DB_CONFIG, book_ids, author_id):
+    """Назначить книгам другого автора; {описание: число строк}."""
+    with db.transaction(DB_CONFIG) as cursor:
         cursor.execute(
-            "INSERT INTO books (title, date, author_id, description, book_cover) VALUES (%s, %s, %s, %s, %s)",
-            (title, date, author_id, description, book_cover)
+            "UPDATE books SET author_id = %s WHERE book_id = ANY(%s::int[]) AND author_id <> %s",
+            (author_id, list(book_ids), author_id)
         )
-
-        # Получаем ID добавленной книги
-        cursor.execute("SELECT book_id FROM books WHERE title = %s", (title,))
-        book_id = cursor.fetchone()[0]
-
-        if text:
-            cursor.execute("INSERT INTO book_texts (book_id, book_text) VALUES (%s, %s)", (book_id, text))
-
-        # Запись связи между книгой и возрастным рейтингом
-        cursor.execute(
-            "INSERT INTO age_categories_of_books (book_id, age_id) VALUES (%s, %s)",
-            (book_id, age_id)
+        counts = {"Книг": cursor.rowcount}
+    cache.invalidate("books")
+    catalog.request_refresh(DB_CONFIG)
+    return counts
+
+def show_affected(counts):
+    """Отчет о числе затронутых строк."""
+    st.success("Готово. Затронуто строк: " + ", ".join(f"{name.lower()}: {count}" for name, count in counts.items()))
+
+def manage_books(DB_CONFIG):
+    """Удаление книг и массовые изменения: возрастная категория, жанры, автор."""
+    st.subheader("Удаление и массовое изменение книг")
+
+    books = dict(load_books(DB_CONFIG))
+    book_ids = st.multiselect(
+        "Выберите книги", list(books), format_func=lambda book_id: f"{book_id}: {books[book_id]}"
+    )
+    if not book_ids:
+        st.info("Выберите одну или несколько книг.")
+        return
+
+    tab_delete, tab_categories, tab_author = st.tabs(["Удаление", "Категории и жанры", "Автор"])
+
+    with tab_delete:
+        st.warning("Вместе с книгами удаляются их комментарии, лайки, тексты и позиции чтения.")
+        confirm = st.checkbox(f"Подтверждаю удаление книг: {len(book_ids)}")
+        if st.button("Удалить выбранные книги", disabled=not confirm):
+            show_affected(delete_books(DB_CONFIG, book_ids))
+
+    with tab_categories:
+        age_categories = dict(get_age_categories(DB_CONFIG))
+        genres = dict(get_genres(DB_CONFIG))
+        age_id = st.selectbox(
+            "Новый возрастной рейтинг", [None] + list(age_categories),
+            format_func=lambda age_id: "Не менять" if age_id is None else age_categories[age_id]
         )
+        add_genres = st.multiselect("Добавить жанры", list(genres), format_func=genres.get)
+        remove_genres = st.multiselect("Снять жанры", list(genres), format_func=genres.get)
+        if st.button("Применить к выбранным книгам", disabled=age_id is None and not add_genres and not remove_genres):
+            show_affected(recategorize_books(DB_CONFIG, book_ids, age_id, add_genres, remove_genres))
 
-        connection.commit()
-        cursor.close()
-        connection.close()
-        st.success(f"Книга '{title}' успешно добавлена!")        
-
-def get_age_categories(DB_CONFIG):
-    """Загрузка возрастных категорий из базы данных."""
-    connection = connect_to_db(DB_CONFIG)
-    cursor = connection.cursor()
-    cursor.execute("SELECT age_id, category_characteristic FROM age_category")
-    categories = cursor.fetchall()
-    cursor.close()
-    connection.close()
-    return categories
-
-def delete_book(DB_CONFIG):
-    """Удаление книги."""
-    st.subheader("Удаление книги")
-
-    books = load_books(DB_CONFIG)
-    book_id = st.selectbox("Выберите книгу для удаления", [book[0] for book in books])
-
-    # Проверка, есть ли книга в избранном
-    connection = connect_to_db(DB_CONFIG)
-    cursor = connection.cursor()
-    cursor.execute("SELECT COUNT(*) FROM liked_books WHERE book_id = %s", (book_id,))
-    in_favorites_count = cursor.fetchone()[0]
-    cursor.close()
-    connection.close()
-
-    if in_favorites_count > 0:
-        st.warning("Эта книга есть в избранном у пользователей. Убедитесь, что хотите удалить её.")
-        confirm = st.button("Подтвердить удаление книги и из избранного")
-
-        if confirm:
-            # Подключаемся к базе данных
-            connection = connect_to_db(DB_CONFIG)
-            cursor = connection.cursor()
-
-            # Удаляем все тексты, связанные с книгой
-            cursor.execute("DELETE FROM book_texts WHERE book_id = %s", (book_id,))
-
-            # Удаляем книгу из таблицы liked_books
-            cursor.execute("DELETE FROM liked_books WHERE book_id = %s", (book_id,))
-
-            # Удаляем книгу из основного списка
-            cursor.execute("DELETE FROM books WHERE book_id = %s", (book_id,))
-            connection.commit()
-            cursor.close()
-            connection.close()
-
-            st.success(f"Книга с ID '{book_id}' успешно удалена, включая избранное!")
-    else:
-        if st.button("Удалить книгу"):
-            # Подключаемся к базе данных
-            connection = connect_to_db(DB_CONFIG)
-            cursor = connection.cursor()
-
-            # Удаляем все тексты, связанные с книгой
-            cursor.execute("DELETE FROM book_texts WHERE book_id = %s", (book_id,))
-
-            # Удаляем книгу из основного списка
-            cursor.execute("DELETE FROM books WHERE book_id = %s", (book_id,))
-            connection.commit()
-            cursor.close()
-            connection.close()
-
-            st.success(f"Книга с ID '{book_id}' успешно удалена!")
-
-
+    with tab_author:
+        authors = dict(author.split(": ", 1) for author in get_authors(DB_CONFIG))
+        author_id = st.selectbox("Новый автор", list(authors), format_func=authors.get)
+        if st.button("Назначить автора выбранным книгам"):
+            show_affected(reassign_books(DB_CONFIG, book_ids, int(author_id)))
 
 def add_author(DB_CONFIG):
     """Добавление нового автора."""
@@ -198,33 +529,25 @@ def add_author(DB_CONFIG):
     biography = st.text_area("Биография автора")
 
     if st.button("Добавить автора"):
-        connection = connect_to_db(DB_CONFIG)
-        cursor = connection.cursor()
-        cursor.execute(
-            "INSERT INTO authors (fullname, biography) VALUES (%s, %s)",
-            (fullname, biography)
-        )
-        connection.commit()
-        cursor.close()
-        connection.close()
+        with db.transaction(DB_CONFIG) as cursor:
+            cursor.execute(
+                "INSERT INTO authors (fullname, biography) VALUES (%s, %s)",
+                (fullname, biography)
+            )
+        cache.invalidate("authors")
         st.success(f"Автор '{fullname}' успешно добавлен!")
 
+@cache.cached("authors")
 def get_authors(DB_CONFIG):
     """Получение списка авторов для выбора."""
-    connection = connect_to_db(DB_CONFIG)
-    cursor = connection.cursor()
-    cursor.execute("SELECT author_id, fullname FROM authors")
-    authors = cursor.fetchall()
-    cursor.close()
-    connection.close()
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("SELECT author_id, fullname FROM authors")
+        authors = cursor.fetchall()
     return [f"{author[0]}: {author[1]}" for author in authors]
 
+@cache.cached("books")
 def load_books(DB_CONFIG):
-    """Загрузка книг из базы данных для удаления."""
-    connection = connect_to_db(DB_CONFIG)
-    cursor = connection.cursor()
-    cursor.execute("SELECT book_id, title FROM books")
-    books = cursor.fetchall()
-    cursor.close()
-    connection.close()
-    return books
+    """Загрузка книг из базы данных для массовых операций."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("SELECT book_id, title FROM books ORDER BY title, book_id")
+        return cursor.fetchall()
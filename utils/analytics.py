@@ -0,0 +1,211 @@
+import csv
+import io
+import os
+import threading
+import time
+
+from utils import db
+
+# Статистика активности: триггеры пишут лайки и комментарии в activity_log, а свертка
+# раз в ANALYTICS_REFRESH_INTERVAL секунд добавляет новые события к дневным итогам по книгам
+# и итогам по авторам. Панель аналитики читает только свертки
+ANALYTICS_REFRESH_INTERVAL = float(os.getenv("ANALYTICS_REFRESH_INTERVAL", "60"))
+# Сколько дней хранить уже учтенные события журнала
+ANALYTICS_LOG_RETENTION_DAYS = int(os.getenv("ANALYTICS_LOG_RETENTION_DAYS", "7"))
+ANALYTICS_TOP = int(os.getenv("ANALYTICS_TOP", "20"))
+WATERMARK = "activity"
+
+# Водяной знак - номер транзакции: все транзакции с меньшим номером завершились к прошлой
+# свертке, поэтому следующая берет события транзакций из [знак, xmin текущего снимка).
+# В отличие от знака по event_id или дате, так не теряются события транзакций,
+# которые получили номер события раньше, а зафиксировались позже свертки
+ROLLUP_QUERY = """
+    WITH events AS (
+        SELECT l.book_id, b.author_id, l.created_at::date AS day, l.kind
+        FROM activity_log l
+        JOIN books b ON b.book_id = l.book_id
+        WHERE l.txid >= %(since)s AND l.txid < %(until)s
+    ),
+    daily AS (
+        INSERT INTO book_activity_daily (day, book_id, likes, unlikes, comments)
+        SELECT day, book_id,
+               COUNT(*) FILTER (WHERE kind = 'like'),
+               COUNT(*) FILTER (WHERE kind = 'unlike'),
+               COUNT(*) FILTER (WHERE kind = 'comment')
+        FROM events
+        GROUP BY day, book_id
+        ON CONFLICT (day, book_id) DO UPDATE SET
+            likes = book_activity_daily.likes + EXCLUDED.likes,
+            unlikes = book_activity_daily.unlikes + EXCLUDED.unlikes,
+            comments = book_activity_daily.comments + EXCLUDED.comments
+        RETURNING 1
+    ),
+    authors AS (
+        INSERT INTO author_activity (author_id, likes, comments)
+        SELECT author_id,
+               COUNT(*) FILTER (WHERE kind = 'like') - COUNT(*) FILTER (WHERE kind = 'unlike'),
+               COUNT(*) FILTER (WHERE kind = 'comment')
+        FROM events
+        GROUP BY author_id
+        ON CONFLICT (author_id) DO UPDATE SET
+            likes = author_activity.likes + EXCLUDED.likes,
+            comments = author_activity.comments + EXCLUDED.comments
+        RETURNING 1
+    )
+    SELECT (SELECT COUNT(*) FROM events), (SELECT COUNT(*) FROM daily), (SELECT COUNT(*) FROM authors)
+"""
+
+_lock = threading.Lock()
+_worker = None
+_stats = {
+    "refreshes": 0,
+    "events": 0,
+    "errors": 0,
+    "last_refresh": None,
+    "refresh_seconds": 0.0,
+}
+
+
+def refresh(DB_CONFIG):
+    """Добавить к сверткам события, появившиеся после водяного знака; возвращает их число.
+
+    Если свертку уже выполняет другой процесс, возвращает None.
+    """
+    started = time.perf_counter()
+    with db.transaction(DB_CONFIG) as cursor:
+        cursor.execute("SELECT watermark FROM rollup_watermarks WHERE name = %s FOR UPDATE SKIP LOCKED", (WATERMARK,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        since = row[0]
+        cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot())")
+        until = cursor.fetchone()[0]
+        cursor.execute(ROLLUP_QUERY, {"since": since, "until": until})
+        events, _, _ = cursor.fetchone()
+        cursor.execute(
+            "UPDATE rollup_watermarks SET watermark = %s, refreshed_at = NOW() WHERE name = %s",
+            (until, WATERMARK)
+        )
+        cursor.execute(
+            "DELETE FROM activity_log WHERE created_at < NOW() - make_interval(days => %s) AND txid < %s",
+            (ANALYTICS_LOG_RETENTION_DAYS, until)
+        )
+    with _lock:
+        _stats["refreshes"] += 1
+        _stats["events"] += events
+        _stats["last_refresh"] = time.time()
+        _stats["refresh_seconds"] = time.perf_counter() - started
+    return events
+
+
+def _refresh_loop(DB_CONFIG):
+    while True:
+        try:
+            refresh(DB_CONFIG)
+        except Exception:
+            with _lock:
+                _stats["errors"] += 1
+        time.sleep(ANALYTICS_REFRESH_INTERVAL)
+
+
+def start(DB_CONFIG):
+    """Запустить фоновую свертку (один поток на процесс)."""
+    global _worker
+    with _lock:
+        if _worker is None:
+            _worker = threading.Thread(target=_refresh_loop, args=(DB_CONFIG,), daemon=True, name="analytics")
+            _worker.start()
+
+
+def daily_activity(DB_CONFIG, days):
+    """Лайки, снятые лайки и комментарии по дням за последние days дней."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("""
+            SELECT day, SUM(likes), SUM(unlikes), SUM(comments)
+            FROM book_activity_daily
+            WHERE day > CURRENT_DATE - %s
+            GROUP BY day
+            ORDER BY day
+        """, (days,))
+        return cursor.fetchall()
+
+
+def top_books(DB_CONFIG, days, limit=ANALYTICS_TOP):
+    """Книги с наибольшей активностью за последние days дней: (book_id, название, лайки, комментарии)."""
+    with db.cursor(DB_CONFIG) as cursor:
+        # Сначала агрегируются свертки, названия подставляются только для первых limit книг
+        cursor.execute("""
+            SELECT t.book_id, b.title, t.likes, t.comments
+            FROM (
+                SELECT book_id, SUM(likes) - SUM(unlikes) AS likes, SUM(comments) AS comments
+                FROM book_activity_daily
+                WHERE day > CURRENT_DATE - %s
+                GROUP BY book_id
+                ORDER BY SUM(likes) - SUM(unlikes) + SUM(comments) DESC, book_id
+                LIMIT %s
+            ) t
+            JOIN books b ON b.book_id = t.book_id
+            ORDER BY t.likes + t.comments DESC, t.book_id
+        """, (days, limit))
+        return cursor.fetchall()
+
+
+def top_authors(DB_CONFIG, limit=ANALYTICS_TOP):
+    """Авторы с наибольшим числом лайков и комментариев за все время."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("""
+            SELECT t.author_id, a.fullname, t.likes, t.comments
+            FROM (
+                SELECT author_id, likes, comments
+                FROM author_activity
+                ORDER BY likes + comments DESC, author_id
+                LIMIT %s
+            ) t
+            JOIN authors a ON a.author_id = t.author_id
+            ORDER BY t.likes + t.comments DESC, t.author_id
+        """, (limit,))
+        return cursor.fetchall()
+
+
+def rollup_state(DB_CONFIG):
+    """Время последней свертки и число событий, которые в нее еще не попали."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("""
+            SELECT w.refreshed_at, (SELECT COUNT(*) FROM activity_log l WHERE l.txid >= w.watermark)
+            FROM rollup_watermarks w
+            WHERE w.name = %s
+        """, (WATERMARK,))
+        return cursor.fetchone() or (None, 0)
+
+
+def to_csv(header, rows):
+    """Таблица в формате CSV для кнопки выгрузки."""
+    output = io.StringIO()
+    writer = csv.writer(output)
+    writer.writerow(header)
+    writer.writerows(rows)
+    return output.getvalue()
+
+
+def analytics_stats():
+    """Счетчики фоновой свертки в этом процессе."""
+    with _lock:
+        return dict(_stats)
+
+
+if __name__ == "__main__":
+    # Свертка по расписанию (например, из cron): python -m utils.analytics
+    # Параметры подключения из .env (загружает utils.db), как в migrate.py: импорт app
+    # запустил бы сервер метрик и фоновые потоки приложения
+    DB_CONFIG = {
+        "host": os.getenv("DB_HOST"),
+        "database": os.getenv("DB_DATABASE"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD")
+    }
+
+    events = refresh(DB_CONFIG)
+    if events is None:
+        print("Свертку уже выполняет другой процесс")
+    else:
+        print(f"Учтено событий: {events}")
@@ -1,10 +1,49 @@
+import os
+
 import streamlit as st
-import bcrypt
-import psycopg2
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from utils import db, passwords
+
+# Поиск пользователя при входе выполняется на каждую попытку, поэтому запрос подготовлен на сервере
+FIND_USER = db.prepared("find_user_by_email", "SELECT user_id, hash_password, role FROM users WHERE email = %s")
+
+# Заголовок X-Forwarded-For учитывается, только если приложение работает за своим прокси
+# (TRUSTED_PROXY=1): без прокси клиент может подставить в заголовок любой адрес
+TRUSTED_PROXY = os.getenv("TRUSTED_PROXY", "0") == "1"
+
+def get_client_key():
+    """Ключ клиента для лимита попыток: IP от доверенного прокси, иначе ID сессии."""
+    if TRUSTED_PROXY:
+        # Прокси дописывает адрес клиента в конец списка, левее - то, что прислал сам клиент
+        forwarded = st.context.headers.get("X-Forwarded-For", "")
+        ip = forwarded.split(",")[-1].strip()
+        if ip:
+            return f"ip:{ip}"
+    ctx = get_script_run_ctx(suppress_warning=True)
+    return f"session:{ctx.session_id}" if ctx else None
+
+def authenticate(DB_CONFIG, email, password):
+    """Проверка email и пароля; возвращает (user_id, role) или None.
+
+    Проверка пароля выполняется в пуле потоков, а не в потоке скрипта.
+    """
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute(FIND_USER, (email,))
+        result = cursor.fetchone()
+
+    if not result or not passwords.check_password(password, result[1]):
+        return None
 
-def connect_to_db(DB_CONFIG):
-    """Подключение к базе данных."""
-    return psycopg2.connect(**DB_CONFIG)
+    # Хэш со старой стоимостью пересчитывается, пока пароль известен
+    if passwords.needs_rehash(result[1]):
+        try:
+            new_hash = passwords.hash_password(password)
+        except passwords.PasswordQueueFull:
+            new_hash = None
+        if new_hash:
+            with db.transaction(DB_CONFIG) as cursor:
+                cursor.execute("UPDATE users SET hash_password = %s WHERE user_id = %s", (new_hash, result[0]))
+    return result[0], result[2]
 
 def login_page(DB_CONFIG):
     """Страница входа в систему."""
@@ -14,16 +53,21 @@ def login_page(DB_CONFIG):
     password = st.text_input("Введите ваш пароль", "", type='password')
 
     if st.button("Войти"):
-        connection = connect_to_db(DB_CONFIG)
-        cursor = connection.cursor()
-        cursor.execute("SELECT user_id, hash_password, role FROM users WHERE email = %s", (email,))
-        result = cursor.fetchone()
-        cursor.close()
-        connection.close()
+        try:
+            passwords.check_rate_limit(email, get_client_key())
+        except passwords.RateLimitExceeded as e:
+            st.error(str(e))
+            return
 
-        if result and bcrypt.checkpw(password.encode('utf-8'), result[1].encode('utf-8')):
+        try:
+            result = authenticate(DB_CONFIG, email, password)
+        except passwords.PasswordQueueFull as e:
+            st.error(str(e))
+            return
+
+        if result:
             st.session_state["user_id"] = result[0]
-            st.session_state["role"] = result[2]
+            st.session_state["role"] = result[1]
             st.success("Вход выполнен успешно!")
         else:
             st.error("Неверный email или пароль.")
@@ -38,22 +82,33 @@ def register_page(DB_CONFIG):
     age = st.number_input("Ваш возраст", min_value=0)
 
     if st.button("Зарегистрироваться"):
-        connection = connect_to_db(DB_CONFIG)
-        cursor = connection.cursor()
-        cursor.execute("SELECT COUNT(*) FROM users WHERE email = %s", (email,))
-        count = cursor.fetchone()[0]
+        try:
+            passwords.check_rate_limit(email, get_client_key())
+        except passwords.RateLimitExceeded as e:
+            st.error(str(e))
+            return
+
+        # Проверка перед записью читает с основного сервера: на реплике может не быть нового пользователя
+        with db.cursor(DB_CONFIG, primary=True) as cursor:
+            cursor.execute("SELECT COUNT(*) FROM users WHERE email = %s", (email,))
+            count = cursor.fetchone()[0]
+
+        if count == 0:
+            try:
+                hashed_password = passwords.hash_password(password)
+            except passwords.PasswordQueueFull as e:
+                st.error(str(e))
+                return
+            with db.transaction(DB_CONFIG) as cursor:
+                cursor.execute(
+                    "INSERT INTO users (email, hash_password, age) VALUES (%s, %s, %s) ON CONFLICT (email) DO NOTHING RETURNING user_id",
+                    (email, hashed_password, age)
+                )
+                count = 0 if cursor.fetchone() else 1
 
         if count > 0:
             st.error("Этот email уже зарегистрирован.")
         else:
-            hashed_password = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
-            cursor.execute(
-                "INSERT INTO users (email, hash_password, age) VALUES (%s, %s, %s)",
-                (email, hashed_password, age)
-            )
-            connection.commit()
-            cursor.close()
-            connection.close()
             st.success("Регистрация прошла успешно!")
 
 def get_authenticated_user():
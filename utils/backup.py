@@ -0,0 +1,156 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from utils import cache, db
+
+BACKUP_DIR = "backups"
+# Число параллельных процессов pg_dump/pg_restore, уровень сжатия и сколько копий хранить
+BACKUP_JOBS = int(os.getenv("BACKUP_JOBS", "4"))
+BACKUP_COMPRESSION = int(os.getenv("BACKUP_COMPRESSION", "6"))
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+
+# Сообщения --verbose, по которым считается прогресс
+DUMP_PROGRESS_MARK = "dumping contents of table"
+RESTORE_PROGRESS_MARK = "processing data for table"
+
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def _connection_args(DB_CONFIG):
+    env = os.environ.copy()
+    # Передаем пароль через PGPASSWORD
+    env["PGPASSWORD"] = DB_CONFIG['password']
+    return ["-h", DB_CONFIG['host'], "-U", DB_CONFIG['user'], "-d", DB_CONFIG['database']], env
+
+
+def _count_tables(DB_CONFIG):
+    with db.cursor(DB_CONFIG, primary=True) as cursor:
+        cursor.execute("SELECT COUNT(*) FROM pg_tables WHERE schemaname NOT IN ('pg_catalog', 'information_schema')")
+        return cursor.fetchone()[0]
+
+
+def _count_archive_tables(path):
+    """Число таблиц с данными в оглавлении архива."""
+    listing = subprocess.run(["pg_restore", "-l", path], capture_output=True, text=True, check=True).stdout
+    return sum(1 for line in listing.splitlines() if " TABLE DATA " in line)
+
+
+def _update(job_id, **fields):
+    with _jobs_lock:
+        _jobs[job_id].update(fields)
+
+
+def _run(job_id, command, env, progress_mark, total, on_success=None):
+    """Выполнение команды в фоне с разбором прогресса из stderr."""
+    _update(job_id, status="running")
+    done = 0
+    log = []
+    try:
+        process = subprocess.Popen(command, env=env, stderr=subprocess.PIPE, stdout=subprocess.DEVNULL, text=True)
+        for line in process.stderr:
+            log.append(line.rstrip())
+            del log[:-20]
+            if progress_mark in line:
+                done += 1
+                _update(job_id, progress=min(done / total, 1.0) if total else 0.0)
+        process.wait()
+        if process.returncode != 0:
+            _update(job_id, status="failed", message="\n".join(log[-5:]), finished=time.time())
+            return
+        if on_success:
+            on_success()
+        _update(job_id, status="done", progress=1.0, finished=time.time())
+    except Exception as e:
+        _update(job_id, status="failed", message=str(e), finished=time.time())
+
+
+def _start(kind, name, command, env, progress_mark, total, on_success=None):
+    job_id = uuid.uuid4().hex[:8]
+    with _jobs_lock:
+        _jobs[job_id] = {
+            "id": job_id, "kind": kind, "name": name, "status": "queued", "progress": 0.0,
+            "message": "", "started": time.time(), "finished": None,
+        }
+    threading.Thread(
+        target=_run, args=(job_id, command, env, progress_mark, total, on_success), daemon=True
+    ).start()
+    return job_id
+
+
+def _backup_path(name):
+    """Путь к бекапу; имя не должно выводить за пределы каталога backups."""
+    if not name or os.path.basename(name) != name or name.startswith("."):
+        raise ValueError(f"Недопустимое имя бекапа: '{name}'.")
+    return os.path.join(BACKUP_DIR, name)
+
+
+def start_backup(DB_CONFIG, name):
+    """Запустить pg_dump в фоне: формат directory, параллельно и со сжатием."""
+    path = _backup_path(name)
+    if os.path.exists(path):
+        raise FileExistsError(f"Бекап '{name}' уже существует.")
+    os.makedirs(BACKUP_DIR, exist_ok=True)
+
+    connection_args, env = _connection_args(DB_CONFIG)
+    command = [
+        "pg_dump", *connection_args,
+        "-F", "d",                          # Формат directory позволяет -j
+        "-j", str(BACKUP_JOBS),
+        "-Z", str(BACKUP_COMPRESSION),
+        "--verbose",
+        "-f", path,
+    ]
+    return _start("backup", name, command, env, DUMP_PROGRESS_MARK, _count_tables(DB_CONFIG), apply_retention)
+
+
+def start_restore(DB_CONFIG, name):
+    """Запустить параллельное восстановление бекапа в фоне."""
+    path = _backup_path(name)
+    if not os.path.isdir(path):
+        raise FileNotFoundError(f"Бекап '{name}' не найден.")
+
+    connection_args, env = _connection_args(DB_CONFIG)
+    command = [
+        "pg_restore", *connection_args,
+        "-j", str(BACKUP_JOBS),
+        "--clean", "--if-exists",
+        "--verbose",
+        path,
+    ]
+    return _start("restore", name, command, env, RESTORE_PROGRESS_MARK, _count_archive_tables(path), cache.clear)
+
+
+def list_backups():
+    """Бекапы в каталоге backups, от новых к старым."""
+    if not os.path.isdir(BACKUP_DIR):
+        return []
+    backups = []
+    for name in os.listdir(BACKUP_DIR):
+        path = os.path.join(BACKUP_DIR, name)
+        if not os.path.isdir(path):
+            continue
+        size = sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+        backups.append({"name": name, "created": datetime.fromtimestamp(os.path.getmtime(path)), "size": size})
+    return sorted(backups, key=lambda backup: backup["created"], reverse=True)
+
+
+def apply_retention(keep=BACKUP_KEEP):
+    """Удалить самые старые бекапы сверх keep."""
+    active = {job["name"] for job in list_jobs() if job["status"] in ("queued", "running") and job["kind"] == "restore"}
+    for backup in list_backups()[keep:]:
+        if backup["name"] in active:
+            continue
+        shutil.rmtree(os.path.join(BACKUP_DIR, backup["name"]), ignore_errors=True)
+
+
+def list_jobs():
+    """Фоновые задачи резервного копирования и восстановления, от новых к старым."""
+    with _jobs_lock:
+        jobs = [dict(job) for job in _jobs.values()]
+    return sorted(jobs, key=lambda job: job["started"], reverse=True)
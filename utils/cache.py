@@ -0,0 +1,156 @@
+import inspect
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from utils import db
+
+# Время жизни записи, число записей и общий объем кэша настраиваются через .env
+CACHE_TTL = float(os.getenv("CACHE_TTL", "300"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# CACHE_ENABLED=0 отключает кэш (например, для замеров нагрузки на БД)
+CACHE_ENABLED = os.getenv("CACHE_ENABLED", "1") != "0"
+
+
+class QueryCache:
+    """Общий для процесса кэш результатов запросов: TTL, вытеснение LRU и лимит памяти.
+
+    Каждая запись помечена тегами (например, "books" или "comments:1"),
+    по которым ее сбрасывают функции записи.
+    """
+
+    def __init__(self, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._bytes = 0
+        # Номер поколения растет при каждом сбросе: результат запроса, начатого
+        # до записи в БД, не должен попасть в кэш после нее
+        self.generation = 0
+        self.invalidated_at = float("-inf")
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, key):
+        """Значение из кэша и признак попадания."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry["expires"] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.stats["misses"] += 1
+                return None, False
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry["value"], True
+
+    def put(self, key, value, tags, generation):
+        """Сохранить значение, прочитанное в поколении generation; слишком большие значения не кэшируются."""
+        size = len(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {"value": value, "size": size, "tags": tags, "expires": time.monotonic() + self.ttl}
+            self._bytes += size
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.stats["evictions"] += 1
+
+    def invalidate(self, *tags):
+        """Удалить все записи с любым из указанных тегов."""
+        with self._lock:
+            self.generation += 1
+            self.invalidated_at = time.monotonic()
+            for tag in tags:
+                for key in list(self._tags.get(tag, ())):
+                    self._remove(key)
+                    self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self.generation += 1
+            self.invalidated_at = time.monotonic()
+            self._entries.clear()
+            self._tags.clear()
+            self._bytes = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self._bytes -= entry["size"]
+        for tag in entry["tags"]:
+            keys = self._tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+    def get_stats(self):
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        stats["max_entries"] = self.max_entries
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+_cache = QueryCache()
+
+
+def cached(*tags):
+    """Декоратор read-through кэша.
+
+    Теги могут ссылаться на аргументы функции: @cached("comments:{book_id}").
+    При чтении с реплик пользователь, который только что писал, читает мимо кэша
+    с основного сервера, а результат с реплики вскоре после записи не кэшируется:
+    реплика могла еще не получить эту запись.
+    """
+    def decorator(func):
+        if not CACHE_ENABLED:
+            return func
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            key = (func.__module__, func.__qualname__, repr(bound.arguments))
+            own_writes = db.reading_own_writes()
+            if not own_writes:
+                value, hit = _cache.get(key)
+                if hit:
+                    return value
+            generation = _cache.generation
+            value = func(*args, **kwargs)
+            if own_writes or time.monotonic() - _cache.invalidated_at >= db.replica_staleness():
+                _cache.put(key, value, {tag.format(**bound.arguments) for tag in tags}, generation)
+            return value
+        return wrapper
+    return decorator
+
+
+def invalidate(*tags):
+    """Сбросить записи с указанными тегами (вызывается после записи в БД)."""
+    _cache.invalidate(*tags)
+
+
+def clear():
+    _cache.clear()
+
+
+def cache_stats():
+    return _cache.get_stats()
@@ -0,0 +1,83 @@
+import threading
+import time
+
+from utils import cache, db
+
+# Столбцы строки каталога для страниц книг (порядок ожидает app.book_page).
+# Счетчики берутся из books: они меняются чаще, чем обновляется представление
+CATALOG_COLUMNS = """
+    c.book_id, c.title, c.description, c.book_cover, c.age_categories,
+    b.number_of_likes, b.number_of_comments, c.author_name, c.genres
+"""
+
+_lock = threading.Lock()
+_state = {
+    "running": False,
+    "pending": False,
+    "refreshes": 0,
+    "errors": 0,
+    "last_refresh": None,
+    "last_seconds": 0.0,
+    "last_error": None,
+}
+
+
+def refresh(DB_CONFIG):
+    """Обновить представления каталога и фасетов, не блокируя чтение.
+
+    Каждое представление обновляется в своей транзакции: ошибка одного не мешает другому.
+    """
+    for view in ("catalog", "catalog_facets"):
+        with db.transaction(DB_CONFIG) as cursor:
+            cursor.execute(f"REFRESH MATERIALIZED VIEW CONCURRENTLY {view}")
+    cache.invalidate("books", "catalog")
+
+
+def _refresh_loop(DB_CONFIG):
+    while True:
+        started = time.perf_counter()
+        try:
+            refresh(DB_CONFIG)
+            with _lock:
+                _state["refreshes"] += 1
+                _state["last_refresh"] = time.time()
+                _state["last_seconds"] = time.perf_counter() - started
+        except Exception as e:
+            with _lock:
+                _state["errors"] += 1
+                _state["last_error"] = str(e)
+        with _lock:
+            if not _state["pending"]:
+                _state["running"] = False
+                return
+            _state["pending"] = False
+
+
+def request_refresh(DB_CONFIG):
+    """Запросить обновление каталога после записи.
+
+    Обновление идет в фоновом потоке; запросы, пришедшие во время обновления,
+    объединяются в одно следующее.
+    """
+    with _lock:
+        if _state["running"]:
+            _state["pending"] = True
+            return
+        _state["running"] = True
+    threading.Thread(target=_refresh_loop, args=(DB_CONFIG,), daemon=True, name="catalog-refresh").start()
+
+
+def load_facets(DB_CONFIG):
+    """Предрассчитанные фасеты: {"genre": [(id, название, книг)], "age": [...]}."""
+    facets = {"genre": [], "age": []}
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("SELECT facet, value_id, name, books FROM catalog_facets ORDER BY facet, name")
+        for facet, value_id, name, books in cursor.fetchall():
+            facets[facet].append((value_id, name, books))
+    return facets
+
+
+def refresh_stats():
+    """Состояние обновления представлений каталога."""
+    with _lock:
+        return dict(_state)
@@ -0,0 +1,487 @@
+import os
+import re
+import threading
+import time
+import weakref
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+from psycopg2 import OperationalError, errors, extensions, pool
+from utils import metrics
+
+load_dotenv()
+
+# Размеры пула и таймауты настраиваются через .env
+POOL_MIN_SIZE = int(os.getenv("DB_POOL_MIN", "1"))
+POOL_MAX_SIZE = int(os.getenv("DB_POOL_MAX", "10"))
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Соединение, простоявшее дольше этого времени, проверяется запросом SELECT 1
+POOL_PING_INTERVAL = float(os.getenv("DB_POOL_PING_INTERVAL", "30"))
+# Серверные подготовленные запросы (PREPARE/EXECUTE); 0 отключает их,
+# например при работе через pgbouncer в режиме transaction
+PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "1") != "0"
+# Реплики для чтения: строки подключения через запятую ("host=replica1 port=5433" или
+# postgresql://...). Не указанные в строке параметры берутся из основного DB_CONFIG
+REPLICA_DSNS = [dsn.strip() for dsn in os.getenv("DB_REPLICAS", "").split(",") if dsn.strip()]
+# Реплика с отставанием больше порога (в секундах) пропускается
+REPLICA_MAX_LAG = float(os.getenv("DB_REPLICA_MAX_LAG", "5"))
+REPLICA_CHECK_INTERVAL = float(os.getenv("DB_REPLICA_CHECK_INTERVAL", "2"))
+# После записи чтения того же пользователя идут на основной сервер столько секунд
+READ_YOUR_WRITES_SECONDS = float(os.getenv("DB_READ_YOUR_WRITES_SECONDS", "10"))
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+_statements = {}
+_statements_lock = threading.Lock()
+# Имена запросов, уже подготовленных в каждом соединении; закрытые соединения удаляются сами
+_prepared = weakref.WeakKeyDictionary()
+_PLACEHOLDER = re.compile(r"%\((\w+)\)s|%s|%%")
+
+_replicas = {}
+_replicas_lock = threading.Lock()
+# Время последней записи по ключу пользователя (для read-your-writes)
+_last_writes = {}
+_routing_stats = {"primary_reads": 0, "own_write_reads": 0, "no_replica_reads": 0}
+_session_key = None
+# Отставание реплики в секундах; на основном сервере (не в режиме восстановления) - 0
+REPLICA_LAG_QUERY = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class ConnectionPool:
+    """Пул соединений с ожиданием свободного слота, проверкой соединений и метриками."""
+
+    def __init__(self, db_config, min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE, timeout=POOL_TIMEOUT):
+        self._pool = pool.ThreadedConnectionPool(min_size, max_size, **db_config)
+        # ThreadedConnectionPool сразу падает при исчерпании, поэтому ожидание делаем семафором
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._last_used = {}
+        self._lock = threading.Lock()
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0,
+            "timeouts": 0,
+            "reconnects": 0,
+            "in_use": 0,
+        }
+
+    def getconn(self):
+        """Выдать соединение из пула, дождавшись свободного слота."""
+        started = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.stats["waits"] += 1
+            if not self._slots.acquire(timeout=self.timeout):
+                with self._lock:
+                    self.stats["timeouts"] += 1
+                raise pool.PoolError(f"Нет свободных соединений в течение {self.timeout} с")
+        waited = time.perf_counter() - started
+
+        try:
+            connection = self._pool.getconn()
+            if not self._is_healthy(connection):
+                self._pool.putconn(connection, close=True)
+                connection = self._pool.getconn()
+                with self._lock:
+                    self.stats["reconnects"] += 1
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self.stats["checkouts"] += 1
+            self.stats["in_use"] += 1
+            self.stats["wait_time_total"] += waited
+            self.stats["wait_time_max"] = max(self.stats["wait_time_max"], waited)
+        return connection
+
+    def putconn(self, connection, close=False):
+        """Вернуть соединение в пул (незавершенная транзакция откатывается пулом)."""
+        close = close or bool(connection.closed)
+        try:
+            self._pool.putconn(connection, close=close)
+        finally:
+            with self._lock:
+                if close:
+                    self._last_used.pop(id(connection), None)
+                else:
+                    self._last_used[id(connection)] = time.monotonic()
+                self.stats["in_use"] -= 1
+            self._slots.release()
+
+    def _is_healthy(self, connection):
+        """Проверка соединения перед выдачей."""
+        if connection.closed:
+            return False
+        last_used = self._last_used.get(id(connection))
+        if last_used is not None and time.monotonic() - last_used < POOL_PING_INTERVAL:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT 1")
+            connection.rollback()
+            return True
+        except Exception:
+            return False
+
+    def closeall(self):
+        self._pool.closeall()
+
+
+class PreparedStatement:
+    """Запрос из реестра, который готовится на сервере один раз на соединение.
+
+    Текст запроса пишется с обычными плейсхолдерами psycopg2 (%s или %(name)s),
+    они заменяются на $1, $2, ... для PREPARE.
+    """
+
+    def __init__(self, name, query):
+        self.name = name
+        self.query = query
+        self.keys = []
+        self.stats = {"prepares": 0, "executions": 0, "reprepares": 0}
+
+        def placeholder(match):
+            if match.group(0) == "%%":
+                return "%"
+            key = match.group(1) if match.group(1) is not None else len(self.keys)
+            if key not in self.keys:
+                self.keys.append(key)
+            return f"${self.keys.index(key) + 1}"
+
+        self.prepare_sql = f"PREPARE {name} AS {_PLACEHOLDER.sub(placeholder, query)}"
+        arguments = ", ".join(["%s"] * len(self.keys))
+        self.execute_sql = f"EXECUTE {name} ({arguments})" if self.keys else f"EXECUTE {name}"
+
+    def bind(self, vars):
+        """Параметры для EXECUTE в порядке $1, $2, ..."""
+        return [vars[key] for key in self.keys]
+
+    def count(self, event):
+        with _statements_lock:
+            self.stats[event] += 1
+
+
+def prepared(name, query):
+    """Зарегистрировать частый запрос; результат передается в cursor.execute вместо текста.
+
+    Повторная регистрация с тем же текстом (например, при перезапуске скрипта
+    Streamlit) возвращает уже созданный запрос.
+    """
+    with _statements_lock:
+        statement = _statements.get(name)
+        if statement is None:
+            statement = _statements[name] = PreparedStatement(name, query)
+        elif statement.query != query:
+            raise ValueError(f"Запрос '{name}' уже зарегистрирован с другим текстом")
+        return statement
+
+
+class Cursor(metrics.InstrumentedCursor):
+    """Курсор пула: замеряет запросы и выполняет подготовленные запросы из реестра."""
+
+    def execute(self, query, vars=None, stacklevel=1):
+        if not isinstance(query, PreparedStatement):
+            return super().execute(query, vars, stacklevel + 1)
+        if not PREPARED_STATEMENTS:
+            return super().execute(query.query, vars, stacklevel + 1)
+
+        idle = self.connection.get_transaction_status() == extensions.TRANSACTION_STATUS_IDLE
+        try:
+            self._prepare(query)
+            result = super().execute(query.execute_sql, query.bind(vars), stacklevel + 1)
+        except errors.InvalidSqlStatementName:
+            # Сервер потерял подготовленные запросы (DISCARD ALL, смена соединения за прокси).
+            # Вне транзакции запрос готовится заново, иначе ошибка уходит вызывающему,
+            # а следующий вызов подготовит запрос с нуля
+            with _statements_lock:
+                _prepared.pop(self.connection, None)
+            if not idle:
+                raise
+            self.connection.rollback()
+            query.count("reprepares")
+            self._prepare(query)
+            result = super().execute(query.execute_sql, query.bind(vars), stacklevel + 1)
+        query.count("executions")
+        return result
+
+    def _prepare(self, statement):
+        with _statements_lock:
+            names = _prepared.setdefault(self.connection, set())
+            if statement.name in names:
+                return
+        # PREPARE не транзакционный: откат транзакции не удаляет подготовленный запрос
+        extensions.cursor.execute(self, statement.prepare_sql)
+        with _statements_lock:
+            names.add(statement.name)
+        statement.count("prepares")
+
+
+def prepared_stats():
+    """Статистика подготовленных запросов: подготовки, выполнения и повторное использование планов."""
+    with _statements_lock:
+        connections = len(_prepared)
+        statements = [dict(statement.stats, name=statement.name) for statement in _statements.values()]
+    for stats in statements:
+        reused = stats["executions"] - stats["prepares"]
+        stats["plan_reuse"] = reused / stats["executions"] if stats["executions"] and reused > 0 else 0.0
+    return {"enabled": PREPARED_STATEMENTS, "connections": connections, "statements": sorted(statements, key=lambda stats: stats["name"])}
+
+
+def get_pool(db_config):
+    """Общий для процесса пул соединений для заданной конфигурации БД."""
+    key = tuple(sorted(db_config.items()))
+    with _pools_lock:
+        connection_pool = _pools.get(key)
+        if connection_pool is None:
+            connection_pool = ConnectionPool(db_config)
+            _pools[key] = connection_pool
+        return connection_pool
+
+
+class Replica:
+    """Реплика для чтения: параметры подключения и последнее измеренное отставание."""
+
+    def __init__(self, db_config):
+        self.db_config = db_config
+        self.name = f"{db_config.get('host') or 'localhost'}:{db_config.get('port') or 5432}"
+        self.lag = None
+        self.available = False
+        self.error = None
+        self.checked_at = None
+        self.stats = {"reads": 0, "skipped": 0, "failures": 0}
+
+    def usable(self):
+        return self.available and self.lag is not None and self.lag <= REPLICA_MAX_LAG
+
+    def check(self):
+        """Измерить отставание; недоступная реплика исключается до следующей проверки."""
+        try:
+            with connection(self.db_config) as conn:
+                with conn.cursor() as cur:
+                    cur.execute(REPLICA_LAG_QUERY)
+                    lag = float(cur.fetchone()[0])
+                conn.rollback()
+            with _replicas_lock:
+                self.lag, self.available, self.error = lag, True, None
+        except Exception as e:
+            with _replicas_lock:
+                self.available, self.error = False, str(e)
+        with _replicas_lock:
+            self.checked_at = time.time()
+
+    def failed(self, error):
+        with _replicas_lock:
+            self.available, self.error = False, str(error)
+            self.stats["failures"] += 1
+
+
+def _replica_config(db_config, dsn):
+    params = extensions.parse_dsn(dsn)
+    if "dbname" in params:
+        params["database"] = params.pop("dbname")
+    return dict(db_config, **params)
+
+
+def _monitor_replicas(replicas):
+    while True:
+        for replica in replicas:
+            replica.check()
+        time.sleep(REPLICA_CHECK_INTERVAL)
+
+
+def get_replicas(db_config):
+    """Реплики из DB_REPLICAS для основного сервера db_config; отставание проверяется в фоне."""
+    if not REPLICA_DSNS:
+        return []
+    key = tuple(sorted(db_config.items()))
+    with _replicas_lock:
+        replicas = _replicas.get(key)
+        if replicas is not None:
+            return replicas
+        replicas = _replicas[key] = [Replica(_replica_config(db_config, dsn)) for dsn in REPLICA_DSNS]
+    threading.Thread(target=_monitor_replicas, args=(replicas,), daemon=True, name="replica-lag").start()
+    return replicas
+
+
+def set_session_key(func):
+    """Задать функцию без аргументов, возвращающую ключ текущего пользователя (или None).
+
+    По этому ключу запоминается время записи, чтобы следующие чтения того же
+    пользователя шли на основной сервер (read-your-writes).
+    """
+    global _session_key
+    _session_key = func
+
+
+def _current_session():
+    return _session_key() if _session_key is not None else None
+
+
+def remember_write():
+    """Отметить запись текущего пользователя (read-your-writes)."""
+    key = _current_session()
+    if key is None or not REPLICA_DSNS:
+        return
+    now = time.monotonic()
+    with _replicas_lock:
+        _last_writes[key] = now
+        # Старые отметки не нужны: окно read-your-writes уже прошло
+        if len(_last_writes) > 1000:
+            for old_key, written in list(_last_writes.items()):
+                if now - written > READ_YOUR_WRITES_SECONDS:
+                    del _last_writes[old_key]
+
+
+def reading_own_writes():
+    """Текущий пользователь недавно писал в базу и читает с основного сервера."""
+    if not REPLICA_DSNS:
+        return False
+    key = _current_session()
+    if key is None:
+        return False
+    with _replicas_lock:
+        written = _last_writes.get(key)
+    return written is not None and time.monotonic() - written < READ_YOUR_WRITES_SECONDS
+
+
+def replica_staleness():
+    """Насколько (в секундах) данные с реплики могут отставать от основного сервера."""
+    return REPLICA_MAX_LAG + REPLICA_CHECK_INTERVAL if REPLICA_DSNS else 0.0
+
+
+def _choose_replica(db_config):
+    """Реплика для чтения или None, если читать нужно с основного сервера."""
+    replicas = get_replicas(db_config)
+    if not replicas:
+        return None
+    if reading_own_writes():
+        with _replicas_lock:
+            _routing_stats["own_write_reads"] += 1
+        return None
+    with _replicas_lock:
+        usable = []
+        for replica in replicas:
+            if replica.usable():
+                usable.append(replica)
+            else:
+                replica.stats["skipped"] += 1
+        if not usable:
+            _routing_stats["no_replica_reads"] += 1
+            return None
+        # Реплика с наименьшим числом чтений: нагрузка делится поровну
+        replica = min(usable, key=lambda replica: replica.stats["reads"])
+        replica.stats["reads"] += 1
+        return replica
+
+
+@contextmanager
+def connection(db_config):
+    """Соединение из пула на время блока with."""
+    connection_pool = get_pool(db_config)
+    conn = connection_pool.getconn()
+    broken = False
+    try:
+        yield conn
+    except Exception:
+        broken = bool(conn.closed)
+        raise
+    finally:
+        connection_pool.putconn(conn, close=broken)
+
+
+@contextmanager
+def cursor(db_config, primary=False):
+    """Курсор для чтения; транзакция откатывается при возврате соединения в пул.
+
+    Если заданы реплики (DB_REPLICAS), чтение идет с реплики, которая отстает
+    не больше REPLICA_MAX_LAG. primary=True читает с основного сервера, например
+    перед записью, которая зависит от прочитанного.
+    """
+    replica = None if primary else _choose_replica(db_config)
+    connection_pool = None
+    if replica is not None:
+        try:
+            connection_pool = get_pool(replica.db_config)
+            conn = connection_pool.getconn()
+        except (OperationalError, pool.PoolError) as e:
+            # До следующей проверки реплика не используется, чтение уходит на основной сервер
+            replica.failed(e)
+            connection_pool = None
+    if connection_pool is None:
+        if REPLICA_DSNS:
+            with _replicas_lock:
+                _routing_stats["primary_reads"] += 1
+        connection_pool = get_pool(db_config)
+        conn = connection_pool.getconn()
+
+    broken = False
+    try:
+        with conn.cursor(cursor_factory=Cursor) as cur:
+            yield cur
+    except Exception:
+        broken = bool(conn.closed)
+        raise
+    finally:
+        connection_pool.putconn(conn, close=broken)
+
+
+@contextmanager
+def transaction(db_config):
+    """Курсор в транзакции: commit при успешном выходе, rollback при исключении."""
+    with connection(db_config) as conn:
+        try:
+            with conn.cursor(cursor_factory=Cursor) as cur:
+                yield cur
+            conn.commit()
+        except Exception:
+            if not conn.closed:
+                conn.rollback()
+            raise
+    remember_write()
+
+
+def pool_stats(db_config):
+    """Метрики пула: число выдач, ожиданий, время ожидания и т.д."""
+    connection_pool = get_pool(db_config)
+    with connection_pool._lock:
+        stats = dict(connection_pool.stats)
+    stats["min_size"] = connection_pool.min_size
+    stats["max_size"] = connection_pool.max_size
+    stats["wait_time_avg"] = stats["wait_time_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    return stats
+
+
+def replica_stats(db_config):
+    """Состояние реплик и распределение чтений между репликами и основным сервером."""
+    replicas = get_replicas(db_config)
+    with _replicas_lock:
+        return {
+            "replicas": [
+                dict(replica.stats, name=replica.name, available=replica.available, lag=replica.lag,
+                     checked_at=replica.checked_at, error=replica.error)
+                for replica in replicas
+            ],
+            "max_lag": REPLICA_MAX_LAG,
+            "read_your_writes_seconds": READ_YOUR_WRITES_SECONDS,
+            **_routing_stats,
+        }
+
+
+def close_all():
+    """Закрыть все пулы (например, при завершении процесса)."""
+    with _pools_lock:
+        for connection_pool in _pools.values():
+            connection_pool.closeall()
+        _pools.clear()
@@ -0,0 +1,105 @@
+import hashlib
+import io
+import json
+import os
+import threading
+
+from PIL import Image
+from utils import cache
+
+IMAGES_DIR = os.path.join("assets", "images")
+THUMBNAILS_DIR = os.path.join("assets", "thumbnails")
+MANIFEST_PATH = os.path.join(THUMBNAILS_DIR, "manifest.json")
+
+# Ширина миниатюр в пикселях для страниц каталога и избранного
+THUMBNAIL_SIZES = {"small": 100, "medium": 300}
+THUMBNAIL_QUALITY = 85
+# Объем памяти под готовые миниатюры
+IMAGE_CACHE_BYTES = int(os.getenv("IMAGE_CACHE_BYTES", str(32 * 1024 * 1024)))
+
+_memory = cache.QueryCache(ttl=float("inf"), max_bytes=IMAGE_CACHE_BYTES)
+_manifest = None
+_manifest_lock = threading.Lock()
+
+
+def _load_manifest():
+    """Соответствие имени обложки и хэша ее содержимого."""
+    global _manifest
+    if _manifest is None:
+        if os.path.exists(MANIFEST_PATH):
+            with open(MANIFEST_PATH, encoding="utf-8") as file:
+                _manifest = json.load(file)
+        else:
+            _manifest = {}
+    return _manifest
+
+
+def thumbnail_path(content_hash, size):
+    return os.path.join(THUMBNAILS_DIR, f"{content_hash}_{THUMBNAIL_SIZES[size]}.jpg")
+
+
+def build_thumbnails(book_cover):
+    """Построить миниатюры всех размеров для обложки из assets/images.
+
+    Файлы называются по хэшу содержимого оригинала, поэтому замена обложки
+    дает новые имена, а повторный вызов для той же картинки ничего не делает.
+    Возвращает хэш или None, если оригинала нет.
+    """
+    source = os.path.join(IMAGES_DIR, book_cover)
+    if not os.path.exists(source):
+        return None
+    with open(source, "rb") as file:
+        data = file.read()
+    content_hash = hashlib.sha256(data).hexdigest()[:16]
+
+    os.makedirs(THUMBNAILS_DIR, exist_ok=True)
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert("RGB")
+        for size, width in THUMBNAIL_SIZES.items():
+            path = thumbnail_path(content_hash, size)
+            if os.path.exists(path):
+                continue
+            thumbnail = image.copy()
+            thumbnail.thumbnail((width, width * 4))
+            thumbnail.save(path, "JPEG", quality=THUMBNAIL_QUALITY, optimize=True)
+
+    with _manifest_lock:
+        manifest = _load_manifest()
+        manifest[book_cover] = content_hash
+        with open(MANIFEST_PATH, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=2)
+    _memory.invalidate(book_cover)
+    return content_hash
+
+
+def get_thumbnail(book_cover, size="medium"):
+    """Байты миниатюры обложки: из памяти, с диска или построенные на лету.
+
+    Возвращает None, если обложки нет.
+    """
+    if not book_cover:
+        return None
+    key = (book_cover, size)
+    data, hit = _memory.get(key)
+    if hit:
+        return data
+
+    with _manifest_lock:
+        content_hash = _load_manifest().get(book_cover)
+    if content_hash is None or not os.path.exists(thumbnail_path(content_hash, size)):
+        content_hash = build_thumbnails(book_cover)
+    generation = _memory.generation
+    if content_hash is None:
+        data = None
+    else:
+        with open(thumbnail_path(content_hash, size), "rb") as file:
+            data = file.read()
+    _memory.put(key, data, {book_cover}, generation)
+    return data
+
+
+if __name__ == "__main__":
+    # Предварительная генерация миниатюр для всех обложек
+    for name in sorted(os.listdir(IMAGES_DIR)):
+        if name.lower().endswith((".jpg", ".jpeg", ".png", ".webp")):
+            print(name, build_thumbnails(name))
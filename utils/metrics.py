@@ -0,0 +1,317 @@
+import os
+import re
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from psycopg2.extensions import TRANSACTION_STATUS_INTRANS, cursor as base_cursor
+
+# Границы корзин гистограмм задержки в секундах
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# Запросы дольше порога попадают в журнал медленных запросов вместе с планом EXPLAIN
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+# Операторы, у которых есть план; EXPLAIN для REFRESH, DDL, COPY, SET и т.п. завершается ошибкой
+EXPLAINABLE = re.compile(rb"^[\s(]*(SELECT|WITH|INSERT|UPDATE|DELETE|EXECUTE)\b", re.IGNORECASE)
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "50"))
+# Порт HTTP-эндпоинта /metrics в формате Prometheus (если не задан, эндпоинт не запускается)
+METRICS_PORT = os.getenv("METRICS_PORT")
+# Эндпоинт без аутентификации, поэтому по умолчанию доступен только с этой машины;
+# для сбора с другого хоста задайте METRICS_HOST=0.0.0.0 и закройте порт файрволом
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+
+_lock = threading.Lock()
+_queries = {}
+_renders = {}
+_slow_queries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_server = None
+# Планы запросов, собираемые в текущем потоке внутри capture_plans()
+_capture = threading.local()
+
+
+class Histogram:
+    """Гистограмма задержек с накопленными счетчиками строк и байтов."""
+
+    def __init__(self):
+        self.buckets = [0] * len(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+        self.rows = 0
+        self.bytes = 0
+
+    def observe(self, seconds):
+        self.count += 1
+        self.sum += seconds
+        self.max = max(self.max, seconds)
+        for i, bound in enumerate(BUCKETS):
+            if seconds <= bound:
+                self.buckets[i] += 1
+                break
+
+    def quantile(self, q):
+        """Оценка квантиля по верхней границе корзины."""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.buckets):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+
+def _histogram(registry, name):
+    histogram = registry.get(name)
+    if histogram is None:
+        histogram = registry[name] = Histogram()
+    return histogram
+
+
+def _value_size(value):
+    if isinstance(value, (str, bytes, bytearray, memoryview)):
+        return len(value)
+    return 8 if value is not None else 0
+
+
+class InstrumentedCursor(base_cursor):
+    """Курсор, который замеряет время запросов и объем полученных данных.
+
+    Имя запроса - имя функции, вызвавшей execute (например, load_books);
+    stacklevel, как в logging, позволяет подклассам пропустить свои кадры.
+    """
+
+    query_name = None
+
+    def execute(self, query, vars=None, stacklevel=1):
+        self.query_name = sys._getframe(stacklevel).f_code.co_name
+        started = time.perf_counter()
+        succeeded = False
+        try:
+            result = super().execute(query, vars)
+            succeeded = True
+            return result
+        finally:
+            elapsed = time.perf_counter() - started
+            with _lock:
+                _histogram(_queries, self.query_name).observe(elapsed)
+            if succeeded and elapsed * 1000 >= SLOW_QUERY_MS:
+                self._log_slow(query, vars, elapsed)
+            if succeeded and getattr(_capture, "plans", None) is not None:
+                self._capture_plan(query, vars)
+
+    def _explain(self, prefix, query, vars):
+        """Строки EXPLAIN запроса или None, если у оператора нет плана.
+
+        EXPLAIN выполняется на соединении вызывающего. В открытой транзакции он идет под
+        точкой сохранения: его ошибка не должна прерывать транзакцию вызывающего.
+        """
+        with base_cursor(self.connection) as explain:
+            statement = explain.mogrify(query, vars)
+            if not EXPLAINABLE.match(statement):
+                return None
+            in_transaction = self.connection.get_transaction_status() == TRANSACTION_STATUS_INTRANS
+            if in_transaction:
+                explain.execute("SAVEPOINT metrics_explain")
+            try:
+                explain.execute(prefix + statement)
+                return explain.fetchall()
+            except Exception:
+                if in_transaction:
+                    explain.execute("ROLLBACK TO SAVEPOINT metrics_explain")
+                raise
+            finally:
+                if in_transaction:
+                    explain.execute("RELEASE SAVEPOINT metrics_explain")
+
+    def _log_slow(self, query, vars, elapsed):
+        """Записать медленный запрос и его план (EXPLAIN без ANALYZE не выполняет запрос)."""
+        try:
+            rows = self._explain(b"EXPLAIN ", query, vars)
+            plan = "\n".join(row[0] for row in rows) if rows is not None else "План для этого оператора не строится."
+        except Exception as e:
+            plan = f"План не получен: {e}"
+        with _lock:
+            _slow_queries.appendleft({
+                "name": self.query_name,
+                "time": time.time(),
+                "seconds": elapsed,
+                "query": " ".join(str(query).split()),
+                "plan": plan,
+            })
+
+    def _capture_plan(self, query, vars):
+        """Сохранить план запроса в формате JSON для capture_plans()."""
+        try:
+            rows = self._explain(b"EXPLAIN (FORMAT JSON) ", query, vars)
+            if rows is None:
+                return
+            plan = rows[0][0][0]["Plan"]
+        except Exception as e:
+            plan = {"error": str(e)}
+        _capture.plans.append((self.query_name, plan))
+
+    def _record_rows(self, rows):
+        size = sum(_value_size(value) for row in rows for value in row)
+        with _lock:
+            histogram = _histogram(_queries, self.query_name)
+            histogram.rows += len(rows)
+            histogram.bytes += size
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            self._record_rows([row])
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(size) if size is not None else super().fetchmany()
+        self._record_rows(rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._record_rows(rows)
+        return rows
+
+
+@contextmanager
+def timed(name):
+    """Замер времени отрисовки страницы или перезапуска скрипта."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        with _lock:
+            _histogram(_renders, name).observe(time.perf_counter() - started)
+
+
+@contextmanager
+def capture_plans():
+    """Собрать планы всех запросов, выполненных в этом потоке внутри блока with.
+
+    Возвращает список пар (имя запроса, узел плана из EXPLAIN (FORMAT JSON)).
+    Каждый запрос дополнительно выполняет EXPLAIN, поэтому блок нужен только проверкам.
+    """
+    plans = []
+    previous = getattr(_capture, "plans", None)
+    _capture.plans = plans
+    try:
+        yield plans
+    finally:
+        _capture.plans = previous
+
+
+def _summary(registry):
+    with _lock:
+        return [
+            {
+                "name": name,
+                "count": histogram.count,
+                "avg_ms": histogram.sum / histogram.count * 1000 if histogram.count else 0.0,
+                "p50_ms": histogram.quantile(0.5) * 1000,
+                "p95_ms": histogram.quantile(0.95) * 1000,
+                "p99_ms": histogram.quantile(0.99) * 1000,
+                "max_ms": histogram.max * 1000,
+                "rows": histogram.rows,
+                "bytes": histogram.bytes,
+            }
+            for name, histogram in sorted(registry.items())
+        ]
+
+
+def query_summary():
+    """Сводка по именованным запросам."""
+    return _summary(_queries)
+
+
+def render_summary():
+    """Сводка по отрисовке страниц и перезапускам."""
+    return _summary(_renders)
+
+
+def slow_queries():
+    """Последние медленные запросы с планами, от новых к старым."""
+    with _lock:
+        return list(_slow_queries)
+
+
+def reset():
+    with _lock:
+        _queries.clear()
+        _renders.clear()
+        _slow_queries.clear()
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _histogram_lines(metric, label, registry):
+    lines = [f"# TYPE {metric} histogram"]
+    for name, histogram in sorted(registry.items()):
+        labels = f'{label}="{_escape(name)}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS, histogram.buckets):
+            cumulative += count
+            lines.append(f'{metric}_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'{metric}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+        lines.append(f"{metric}_sum{{{labels}}} {histogram.sum}")
+        lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+def prometheus_text(extra_gauges=None):
+    """Метрики в текстовом формате Prometheus.
+
+    extra_gauges - словарь {имя: значение} с дополнительными показателями
+    (например, состояние пула соединений или кэша). Показатели с суффиксом
+    _total только растут и объявляются как counter, остальные - как gauge.
+    """
+    with _lock:
+        lines = _histogram_lines("library_query_duration_seconds", "query", _queries)
+        lines.append("# TYPE library_query_rows_total counter")
+        lines += [f'library_query_rows_total{{query="{_escape(name)}"}} {h.rows}' for name, h in sorted(_queries.items())]
+        lines.append("# TYPE library_query_bytes_total counter")
+        lines += [f'library_query_bytes_total{{query="{_escape(name)}"}} {h.bytes}' for name, h in sorted(_queries.items())]
+        lines += _histogram_lines("library_render_duration_seconds", "page", _renders)
+        lines.append("# TYPE library_slow_queries gauge")
+        lines.append(f"library_slow_queries {len(_slow_queries)}")
+    for name, value in sorted((extra_gauges or {}).items()):
+        lines.append(f"# TYPE library_{name} {'counter' if name.endswith('_total') else 'gauge'}")
+        lines.append(f"library_{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def start_http_server(port=METRICS_PORT, extra_gauges=None, host=METRICS_HOST):
+    """Запустить эндпоинт /metrics в фоновом потоке (один раз на процесс).
+
+    extra_gauges - функция без аргументов, возвращающая дополнительные показатели.
+    """
+    global _server
+    if _server is not None or not port:
+        return
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = prometheus_text(extra_gauges() if extra_gauges else None).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    with _lock:
+        if _server is not None:
+            return
+        _server = ThreadingHTTPServer((host, int(port)), Handler)
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
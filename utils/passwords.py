@@ -0,0 +1,121 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import bcrypt
+
+# Стоимость bcrypt (log2 числа раундов) для новых хэшей
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt отпускает GIL, поэтому потоки пула занимают все ядра
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(os.cpu_count() or 2)))
+# Сколько операций может ждать в очереди; при переполнении вход временно отклоняется
+PASSWORD_QUEUE_MAX = int(os.getenv("PASSWORD_QUEUE_MAX", "64"))
+PASSWORD_TIMEOUT = float(os.getenv("PASSWORD_TIMEOUT", "10"))
+
+# Ограничение частоты попыток входа: не больше N попыток за окно в секундах
+LOGIN_WINDOW = float(os.getenv("LOGIN_WINDOW", "60"))
+LOGIN_LIMIT_PER_EMAIL = int(os.getenv("LOGIN_LIMIT_PER_EMAIL", "5"))
+LOGIN_LIMIT_PER_IP = int(os.getenv("LOGIN_LIMIT_PER_IP", "20"))
+
+
+class PasswordQueueFull(Exception):
+    """Очередь хэширования переполнена."""
+
+
+class RateLimitExceeded(Exception):
+    """Слишком много попыток входа."""
+
+
+_executor = ThreadPoolExecutor(max_workers=PASSWORD_WORKERS, thread_name_prefix="bcrypt")
+_slots = threading.BoundedSemaphore(PASSWORD_QUEUE_MAX)
+_lock = threading.Lock()
+_stats = {"submitted": 0, "rejected": 0, "timeouts": 0, "queue_depth": 0, "queue_depth_max": 0, "queue_time_total": 0.0, "work_time_total": 0.0}
+_attempts = {}
+
+
+def _submit(func):
+    """Выполнить func в пуле, учитывая глубину очереди и время ожидания."""
+    if not _slots.acquire(blocking=False):
+        with _lock:
+            _stats["rejected"] += 1
+        raise PasswordQueueFull("Сервер перегружен, попробуйте войти позже.")
+
+    submitted = time.perf_counter()
+    with _lock:
+        _stats["submitted"] += 1
+        _stats["queue_depth"] += 1
+        _stats["queue_depth_max"] = max(_stats["queue_depth_max"], _stats["queue_depth"])
+
+    def task():
+        started = time.perf_counter()
+        try:
+            return func()
+        finally:
+            finished = time.perf_counter()
+            with _lock:
+                _stats["queue_depth"] -= 1
+                _stats["queue_time_total"] += started - submitted
+                _stats["work_time_total"] += finished - started
+            _slots.release()
+
+    try:
+        return _executor.submit(task).result(timeout=PASSWORD_TIMEOUT)
+    except FutureTimeoutError:
+        # Для страниц входа и регистрации это та же перегрузка, что и переполненная очередь
+        with _lock:
+            _stats["timeouts"] += 1
+        raise PasswordQueueFull("Сервер перегружен, попробуйте войти позже.")
+
+
+def hash_password(password, rounds=BCRYPT_ROUNDS):
+    """Хэш пароля, вычисленный в пуле потоков."""
+    return _submit(lambda: bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8'))
+
+
+def check_password(password, hashed):
+    """Проверка пароля в пуле потоков."""
+    return _submit(lambda: bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8')))
+
+
+def needs_rehash(hashed, rounds=BCRYPT_ROUNDS):
+    """Хэш создан с другой стоимостью, чем настроена сейчас."""
+    try:
+        return int(hashed.split("$")[2]) != rounds
+    except (IndexError, ValueError):
+        return True
+
+
+def check_rate_limit(email, client=None):
+    """Учесть попытку входа; RateLimitExceeded, если лимит по email или клиенту (IP или сессия) исчерпан."""
+    now = time.monotonic()
+    keys = [(f"email:{email.lower()}", LOGIN_LIMIT_PER_EMAIL)]
+    if client:
+        keys.append((f"client:{client}", LOGIN_LIMIT_PER_IP))
+    with _lock:
+        for key, limit in keys:
+            attempts = _attempts.setdefault(key, deque())
+            while attempts and now - attempts[0] > LOGIN_WINDOW:
+                attempts.popleft()
+            if len(attempts) >= limit:
+                raise RateLimitExceeded(f"Слишком много попыток входа. Повторите через {int(LOGIN_WINDOW)} с.")
+        for key, _ in keys:
+            _attempts[key].append(now)
+        # Устаревшие окна удаляются, чтобы словарь не рос без ограничений
+        if len(_attempts) > 10000:
+            for key in [key for key, attempts in _attempts.items() if not attempts or now - attempts[-1] > LOGIN_WINDOW]:
+                del _attempts[key]
+
+
+def password_stats():
+    """Метрики пула хэширования: глубина очереди, ожидание и время работы."""
+    with _lock:
+        stats = dict(_stats)
+    done = stats["submitted"] - stats["queue_depth"]
+    stats["queue_time_avg"] = stats["queue_time_total"] / done if done else 0.0
+    stats["work_time_avg"] = stats["work_time_total"] / done if done else 0.0
+    stats["workers"] = PASSWORD_WORKERS
+    stats["queue_max"] = PASSWORD_QUEUE_MAX
+    stats["rounds"] = BCRYPT_ROUNDS
+    return stats
@@ -0,0 +1,106 @@
+import os
+
+import streamlit as st
+from utils import db, textstore
+
+# Размер страницы читалки в символах
+READER_PAGE_SIZE = int(os.getenv("READER_PAGE_SIZE", "4000"))
+
+
+def load_text_pages(DB_CONFIG, book_id, page, count=2):
+    """Загрузка count страниц текста книги начиная с page (нумерация с 0).
+
+    Читаются только нужные фрагменты, а не вся книга: блоки сжатого файла
+    (utils/textstore.py) или substring из TOAST. Возвращает (список страниц,
+    число страниц) или (None, 0), если текста нет.
+    """
+    chunk, text_length = textstore.load_slice(DB_CONFIG, book_id, page * READER_PAGE_SIZE, count * READER_PAGE_SIZE)
+    if chunk is None:
+        return None, 0
+    total_pages = max(1, -(-text_length // READER_PAGE_SIZE))
+    pages = [chunk[i:i + READER_PAGE_SIZE] for i in range(0, len(chunk), READER_PAGE_SIZE)]
+    return pages, total_pages
+
+
+def load_reading_position(DB_CONFIG, user_id, book_id):
+    """Сохраненная страница, на которой пользователь остановился."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("SELECT page FROM reading_positions WHERE user_id = %s AND book_id = %s", (user_id, book_id))
+        row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def save_reading_position(DB_CONFIG, user_id, book_id, page):
+    """Запомнить страницу, на которой пользователь остановился."""
+    with db.transaction(DB_CONFIG) as cursor:
+        cursor.execute("""
+            INSERT INTO reading_positions (user_id, book_id, page, updated_at) VALUES (%s, %s, %s, NOW())
+            ON CONFLICT (user_id, book_id) DO UPDATE SET page = EXCLUDED.page, updated_at = EXCLUDED.updated_at
+        """, (user_id, book_id, page))
+
+
+def get_page(DB_CONFIG, book_id, page):
+    """Страница текста из кэша сессии; при промахе загружается вместе со следующей."""
+    cache = st.session_state.setdefault(f"reader_pages_{book_id}", {})
+    if page not in cache:
+        pages, total_pages = load_text_pages(DB_CONFIG, book_id, page)
+        if pages is None:
+            return None, 0
+        cache["total"] = total_pages
+        for offset, text in enumerate(pages):
+            cache[page + offset] = text
+    return cache.get(page, ""), cache["total"]
+
+
+def reader(DB_CONFIG, book_id):
+    """Постраничная читалка текста книги с запоминанием позиции.
+
+    Вызывается внутри фрагмента панели книги: листание перезапускает только его.
+    """
+    user_id = st.session_state.get("user_id")
+    position_key = f"reader_position_{book_id}"
+    if position_key not in st.session_state:
+        st.session_state[position_key] = load_reading_position(DB_CONFIG, user_id, book_id) if user_id else 0
+    page = st.session_state[position_key]
+
+    text, total_pages = get_page(DB_CONFIG, book_id, page)
+    if text is None:
+        st.error("Текст произведения не найден.")
+        return
+    if page >= total_pages:
+        page = total_pages - 1
+        st.session_state[position_key] = page
+        text, total_pages = get_page(DB_CONFIG, book_id, page)
+
+    # Оглавление загружается один раз за сессию; выбор главы открывает ее страницу
+    toc = st.session_state.get(f"reader_chapters_{book_id}")
+    if toc is None:
+        toc = st.session_state[f"reader_chapters_{book_id}"] = textstore.load_chapters(DB_CONFIG, book_id)
+    if toc:
+        titles = {offset // READER_PAGE_SIZE: title for title, offset in reversed(toc)}
+        current = max((chapter_page for chapter_page in titles if chapter_page <= page), default=None)
+        options = [None] + sorted(titles)
+        chapter_page = st.selectbox(
+            "Оглавление", options, index=options.index(current), key=f"reader_toc_{book_id}_{page}",
+            format_func=lambda chapter_page: "—" if chapter_page is None else titles[chapter_page],
+        )
+        if chapter_page is not None and chapter_page != current:
+            st.session_state[position_key] = chapter_page
+            if user_id:
+                save_reading_position(DB_CONFIG, user_id, book_id, chapter_page)
+            st.rerun(scope="fragment")
+
+    st.write(text)
+    st.caption(f"Страница {page + 1} из {total_pages}")
+
+    col_prev, col_next = st.columns(2)
+    new_page = page
+    if col_prev.button("← Предыдущая страница", key=f"reader_prev_{book_id}", disabled=page == 0):
+        new_page = page - 1
+    if col_next.button("Следующая страница →", key=f"reader_next_{book_id}", disabled=page + 1 >= total_pages):
+        new_page = page + 1
+    if new_page != page:
+        st.session_state[position_key] = new_page
+        if user_id:
+            save_reading_position(DB_CONFIG, user_id, book_id, new_page)
+        st.rerun(scope="fragment")
@@ -0,0 +1,303 @@
+import io
+import os
+import threading
+import time
+
+import numpy as np
+from scipy import sparse
+
+from utils import cache, db
+
+# Сколько соседей хранится для каждой книги и сколько показывается на странице
+RECOMMEND_TOP_K = int(os.getenv("RECOMMEND_TOP_K", "10"))
+RECOMMEND_SHOW = int(os.getenv("RECOMMEND_SHOW", "5"))
+# Вес совпадения жанров (коэффициент Жаккара) относительно косинусного сходства по лайкам
+RECOMMEND_GENRE_WEIGHT = float(os.getenv("RECOMMEND_GENRE_WEIGHT", "0.2"))
+# Пользователи с большим числом лайков не учитываются: они связывают почти все книги между собой
+RECOMMEND_MAX_USER_LIKES = int(os.getenv("RECOMMEND_MAX_USER_LIKES", "1000"))
+# Сколько книг обрабатывается за одно умножение матриц
+RECOMMEND_BLOCK = int(os.getenv("RECOMMEND_BLOCK", "1000"))
+# Как часто фоновый поток пересчитывает соседей книг с новыми лайками
+RECOMMEND_UPDATE_INTERVAL = float(os.getenv("RECOMMEND_UPDATE_INTERVAL", "30"))
+
+LIKES_QUERY = """
+    SELECT l.user_id, l.book_id
+    FROM liked_books l
+    JOIN (SELECT user_id FROM liked_books GROUP BY user_id HAVING COUNT(*) <= %s) u ON u.user_id = l.user_id
+"""
+# Лайки только тех пользователей, которые лайкнули пересчитываемые книги
+LIKERS_QUERY = """
+    SELECT l.user_id, l.book_id
+    FROM liked_books l
+    JOIN (
+        SELECT user_id FROM liked_books
+        WHERE user_id IN (SELECT user_id FROM liked_books WHERE book_id = ANY(%s))
+        GROUP BY user_id HAVING COUNT(*) <= %s
+    ) u ON u.user_id = l.user_id
+"""
+UPSERT_QUERY = """
+    INSERT INTO book_recommendations (book_id, recommended_book_id, score)
+    SELECT * FROM unnest(%s::int[], %s::int[], %s::real[])
+    ON CONFLICT (book_id, recommended_book_id) DO UPDATE SET score = EXCLUDED.score
+"""
+TRIM_QUERY = """
+    DELETE FROM book_recommendations r
+    USING (
+        SELECT book_id, recommended_book_id,
+               row_number() OVER (PARTITION BY book_id ORDER BY score DESC) AS rank
+        FROM book_recommendations
+        WHERE book_id = ANY(%s)
+    ) ranked
+    WHERE r.book_id = ranked.book_id AND r.recommended_book_id = ranked.recommended_book_id AND ranked.rank > %s
+"""
+
+_lock = threading.Lock()
+_dirty = set()
+_worker = None
+_stats = {
+    "build_running": False,
+    "builds": 0,
+    "build_seconds": 0.0,
+    "last_build": None,
+    "updates": 0,
+    "updated_books": 0,
+    "update_errors": 0,
+    "last_update": None,
+}
+
+
+def _copy_array(cursor, query, params, columns):
+    """Целочисленный результат запроса через COPY в массив NumPy (без кортежей Python на строку)."""
+    buffer = io.StringIO()
+    cursor.copy_expert(f"COPY ({cursor.mogrify(query, params).decode()}) TO STDOUT", buffer)
+    return np.fromstring(buffer.getvalue(), dtype=np.int64, sep=" ").reshape(-1, columns)
+
+
+def _load_catalog(cursor):
+    """ID книг по возрастанию, их популярность (число лайков) и пары книга-жанр."""
+    books = _copy_array(cursor, "SELECT book_id, COALESCE(number_of_likes, 0) FROM books ORDER BY book_id", None, 2)
+    book_genres = _copy_array(cursor, "SELECT book_id, genre_id FROM book_genres", None, 2)
+    return books[:, 0], books[:, 1], book_genres
+
+
+def _neighbors(books, popularity, likes, book_genres, targets, top_k):
+    """Топ-K соседей для книг targets (индексы в books).
+
+    Сходство - косинус по лайкам плюс RECOMMEND_GENRE_WEIGHT * коэффициент Жаккара
+    по жанрам. Кандидаты - книги с общими читателями и самые популярные книги
+    тех же жанров (чтобы у книг без лайков тоже были рекомендации).
+    Возвращает массивы (книга, рекомендация, оценка) с ID книг.
+    """
+    n = len(books)
+    likes = likes[np.isin(likes[:, 1], books)]
+    book_genres = book_genres[np.isin(book_genres[:, 0], books)]
+
+    users, user_index = np.unique(likes[:, 0], return_inverse=True)
+    liked = sparse.csr_matrix(
+        (np.ones(len(likes), dtype=np.float32), (user_index, np.searchsorted(books, likes[:, 1]))),
+        shape=(len(users), n),
+    )
+    by_book = liked.T.tocsr()
+    norm = np.sqrt(np.maximum(popularity, 1)).astype(np.float32)
+
+    genres, genre_index = np.unique(book_genres[:, 1], return_inverse=True)
+    genre_matrix = sparse.csr_matrix(
+        (np.ones(len(book_genres), dtype=np.float32), (np.searchsorted(books, book_genres[:, 0]), genre_index)),
+        shape=(n, len(genres)),
+    )
+    genre_count = np.asarray(genre_matrix.sum(axis=1)).ravel()
+
+    # Самые популярные книги каждого жанра
+    leaders = np.full((len(genres), top_k), -1, dtype=np.int64)
+    by_genre = genre_matrix.tocsc()
+    for genre in range(len(genres)):
+        members = by_genre.indices[by_genre.indptr[genre]:by_genre.indptr[genre + 1]]
+        best = members[np.argsort(-popularity[members], kind="stable")[:top_k]]
+        leaders[genre, :len(best)] = best
+
+    results = []
+    for start in range(0, len(targets), RECOMMEND_BLOCK):
+        block = targets[start:start + RECOMMEND_BLOCK]
+
+        # Совместные лайки: строки блока книг x все книги
+        co = (by_book[block] @ liked).tocoo()
+        rows, cols = block[co.row], co.col
+        like_score = co.data / (norm[rows] * norm[cols])
+
+        block_genres = genre_matrix[block].tocoo()
+        genre_rows = np.repeat(block[block_genres.row], top_k)
+        genre_cols = leaders[block_genres.col].ravel()
+        valid = genre_cols >= 0
+        rows = np.concatenate([rows, genre_rows[valid]])
+        cols = np.concatenate([cols, genre_cols[valid]])
+        like_score = np.concatenate([like_score, np.zeros(valid.sum(), dtype=like_score.dtype)])
+
+        valid = rows != cols
+        rows, cols, like_score = rows[valid], cols[valid], like_score[valid]
+        shared = np.asarray(genre_matrix[rows].multiply(genre_matrix[cols]).sum(axis=1)).ravel()
+        union = genre_count[rows] + genre_count[cols] - shared
+        jaccard = np.divide(shared, union, out=np.zeros(len(shared)), where=union > 0)
+        score = like_score + RECOMMEND_GENRE_WEIGHT * jaccard
+
+        # Пара может прийти из обоих источников: остается большая оценка
+        order = np.lexsort((-score, cols, rows))
+        rows, cols, score = rows[order], cols[order], score[order]
+        first = np.ones(len(rows), dtype=bool)
+        first[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+        rows, cols, score = rows[first], cols[first], score[first]
+
+        # Первые top_k по убыванию оценки в каждой строке
+        order = np.lexsort((-score, rows))
+        rows, cols, score = rows[order], cols[order], score[order]
+        rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+        keep = rank < top_k
+        results.append((books[rows[keep]], books[cols[keep]], score[keep]))
+
+    if not results:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64), np.array([])
+    return tuple(np.concatenate(column) for column in zip(*results))
+
+
+def build(DB_CONFIG, top_k=RECOMMEND_TOP_K):
+    """Полный пересчет таблицы book_recommendations; False, если пересчет уже идет."""
+    with _lock:
+        if _stats["build_running"]:
+            return False
+        _stats["build_running"] = True
+    started = time.perf_counter()
+    try:
+        # Таблица пересчитывается по данным основного сервера, а не отстающей реплики
+        with db.cursor(DB_CONFIG, primary=True) as cursor:
+            books, popularity, book_genres = _load_catalog(cursor)
+            likes = _copy_array(cursor, LIKES_QUERY, (RECOMMEND_MAX_USER_LIKES,), 2)
+        book, neighbor, score = _neighbors(books, popularity, likes, book_genres, np.arange(len(books)), top_k)
+
+        buffer = io.StringIO()
+        np.savetxt(buffer, np.column_stack([book, neighbor, score]), fmt=["%d", "%d", "%.6f"], delimiter="\t")
+        buffer.seek(0)
+        # DELETE, а не TRUNCATE: читатели видят старые рекомендации до commit
+        with db.transaction(DB_CONFIG) as cursor:
+            cursor.execute("DELETE FROM book_recommendations")
+            cursor.copy_expert("COPY book_recommendations (book_id, recommended_book_id, score) FROM STDIN", buffer)
+    finally:
+        with _lock:
+            _stats["build_running"] = False
+    cache.invalidate("recommendations")
+    with _lock:
+        _stats["builds"] += 1
+        _stats["build_seconds"] = time.perf_counter() - started
+        _stats["last_build"] = time.time()
+    return True
+
+
+def start_build(DB_CONFIG):
+    """Запустить полный пересчет в фоновом потоке."""
+    threading.Thread(target=build, args=(DB_CONFIG,), daemon=True, name="recommendations-build").start()
+
+
+def update(DB_CONFIG, book_ids, top_k=RECOMMEND_TOP_K):
+    """Пересчитать соседей книг с изменившимися лайками и обновить их у самих соседей."""
+    # Лайки, из-за которых идет пересчет, на реплику могли еще не попасть
+    with db.cursor(DB_CONFIG, primary=True) as cursor:
+        books, popularity, book_genres = _load_catalog(cursor)
+        likes = _copy_array(cursor, LIKERS_QUERY, (list(book_ids), RECOMMEND_MAX_USER_LIKES), 2)
+    ids = np.array(book_ids, dtype=np.int64)
+    targets = np.searchsorted(books, ids[np.isin(ids, books)])
+    book, neighbor, score = _neighbors(books, popularity, likes, book_genres, targets, top_k)
+
+    with db.transaction(DB_CONFIG) as cursor:
+        cursor.execute("DELETE FROM book_recommendations WHERE book_id = ANY(%s)", (list(book_ids),))
+        cursor.execute(UPSERT_QUERY, (book.tolist(), neighbor.tolist(), score.tolist()))
+        # Сходство симметрично: книга может войти в топ своих соседей
+        cursor.execute(UPSERT_QUERY, (neighbor.tolist(), book.tolist(), score.tolist()))
+        cursor.execute(TRIM_QUERY, (np.unique(neighbor).tolist(), top_k))
+    cache.invalidate("recommendations")
+    with _lock:
+        _stats["updates"] += 1
+        _stats["updated_books"] += len(book_ids)
+        _stats["last_update"] = time.time()
+
+
+def _update_loop(DB_CONFIG):
+    while True:
+        time.sleep(RECOMMEND_UPDATE_INTERVAL)
+        with _lock:
+            book_ids = sorted(_dirty)
+            _dirty.clear()
+        if not book_ids:
+            continue
+        try:
+            update(DB_CONFIG, book_ids)
+        except Exception:
+            with _lock:
+                _dirty.update(book_ids)
+                _stats["update_errors"] += 1
+
+
+def mark_changed(DB_CONFIG, book_id):
+    """Отметить книгу, у которой изменились лайки; соседи пересчитываются фоновым потоком."""
+    global _worker
+    with _lock:
+        _dirty.add(book_id)
+        if _worker is None:
+            _worker = threading.Thread(target=_update_loop, args=(DB_CONFIG,), daemon=True, name="recommendations")
+            _worker.start()
+
+
+def for_books(DB_CONFIG, book_ids, limit=RECOMMEND_SHOW):
+    """Рекомендации для книг из готовой таблицы: {book_id: [(book_id, title, book_cover), ...]}."""
+    recommendations = {book_id: [] for book_id in book_ids}
+    if not book_ids:
+        return recommendations
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("""
+            SELECT r.book_id, b.book_id, b.title, b.book_cover
+            FROM book_recommendations r
+            JOIN books b ON b.book_id = r.recommended_book_id
+            WHERE r.book_id = ANY(%s)
+            ORDER BY r.book_id, r.score DESC
+        """, (list(book_ids),))
+        for book_id, *recommended in cursor.fetchall():
+            if len(recommendations[book_id]) < limit:
+                recommendations[book_id].append(tuple(recommended))
+    return recommendations
+
+
+def for_user(DB_CONFIG, user_id, limit=RECOMMEND_SHOW):
+    """Рекомендации по всем лайкам пользователя, без уже понравившихся книг."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("""
+            SELECT b.book_id, b.title, b.book_cover
+            FROM book_recommendations r
+            JOIN books b ON b.book_id = r.recommended_book_id
+            WHERE r.book_id IN (SELECT book_id FROM liked_books WHERE user_id = %(user_id)s)
+              AND r.recommended_book_id NOT IN (SELECT book_id FROM liked_books WHERE user_id = %(user_id)s)
+            GROUP BY b.book_id
+            ORDER BY SUM(r.score) DESC
+            LIMIT %(limit)s
+        """, {"user_id": user_id, "limit": limit})
+        return cursor.fetchall()
+
+
+def recommendation_stats():
+    """Состояние пересчета рекомендаций."""
+    with _lock:
+        stats = dict(_stats)
+        stats["pending"] = len(_dirty)
+    return stats
+
+
+if __name__ == "__main__":
+    # Полный пересчет (например, по расписанию): python -m utils.recommendations
+    # Параметры подключения из .env (загружает utils.db), как в migrate.py: импорт app
+    # запустил бы сервер метрик и фоновые потоки приложения
+    DB_CONFIG = {
+        "host": os.getenv("DB_HOST"),
+        "database": os.getenv("DB_DATABASE"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD")
+    }
+
+    started = time.perf_counter()
+    build(DB_CONFIG)
+    print(f"Рекомендации пересчитаны за {time.perf_counter() - started:.1f} с")
@@ -0,0 +1,135 @@
+import os
+import re
+import time
+
+import streamlit as st
+from utils import catalog, db, textstore
+
+# Поиск запускается, только если в запросе не меньше SEARCH_MIN_LENGTH символов.
+# st.text_input перезапускает страницу только по Enter или потере фокуса, а не на каждое
+# нажатие клавиши, поэтому откладывать запросы не нужно: повторы отсекает кэш в сессии
+SEARCH_MIN_LENGTH = int(os.getenv("SEARCH_MIN_LENGTH", "2"))
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", "20"))
+# Сколько секунд результаты поиска живут в сессии
+SEARCH_CACHE_TTL = float(os.getenv("SEARCH_CACHE_TTL", "60"))
+
+# Условие поиска: полнотекстовое совпадение по префиксам слов или нечеткое (pg_trgm) по названию.
+# Оба варианта обслуживаются GIN-индексами из initialize_data.sql
+BOOK_SEARCH_CONDITION = "(b.search_vector @@ to_tsquery('russian', %(query)s) OR %(term)s <%% b.title)"
+BOOK_SEARCH_RANK = "ts_rank(b.search_vector, to_tsquery('russian', %(query)s)) + word_similarity(%(term)s, b.title)"
+AUTHOR_SEARCH_CONDITION = "(a.search_vector @@ to_tsquery('russian', %(query)s) OR %(term)s <%% a.fullname)"
+AUTHOR_SEARCH_RANK = "ts_rank(a.search_vector, to_tsquery('russian', %(query)s)) + word_similarity(%(term)s, a.fullname)"
+
+# Поиск по текстам книг: запрос в синтаксисе websearch ("точная фраза", -исключить, or),
+# совпадения ищутся по GIN-индексу отрывков book_passages
+TEXT_SEARCH_PAGE_SIZE = int(os.getenv("TEXT_SEARCH_PAGE_SIZE", "10"))
+TEXT_SNIPPET_OPTIONS = "MaxFragments=2, MaxWords=30, MinWords=10, StartSel=**, StopSel=**, FragmentDelimiter=\" … \""
+TEXT_SNIPPET_MARK = re.compile(r"\*\*(.+?)\*\*")
+
+
+def prefix_query(term):
+    """Строка tsquery для поиска по мере ввода: каждое слово ищется как префикс."""
+    words = re.findall(r"[^\W_]+", term.lower())
+    return " & ".join(f"{word}:*" for word in words)
+
+
+def search_params(term):
+    """Параметры для условий поиска BOOK_SEARCH_CONDITION / AUTHOR_SEARCH_CONDITION."""
+    return {"query": prefix_query(term), "term": term.strip()}
+
+
+def search_books(DB_CONFIG, term, limit=SEARCH_LIMIT):
+    """Поиск книг, отсортированных по релевантности."""
+    params = search_params(term)
+    if not params["query"]:
+        return []
+    params["limit"] = limit
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute(f"""
+            SELECT {catalog.CATALOG_COLUMNS}
+            FROM catalog c
+            JOIN books b ON b.book_id = c.book_id
+            WHERE {BOOK_SEARCH_CONDITION}
+            ORDER BY {BOOK_SEARCH_RANK} DESC, b.book_id
+            LIMIT %(limit)s
+        """, params)
+        return cursor.fetchall()
+
+
+def search_authors(DB_CONFIG, term, limit=SEARCH_LIMIT):
+    """Поиск авторов, отсортированных по релевантности."""
+    params = search_params(term)
+    if not params["query"]:
+        return []
+    params["limit"] = limit
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute(f"""
+            SELECT a.author_id, a.fullname, a.biography
+            FROM authors a
+            WHERE {AUTHOR_SEARCH_CONDITION}
+            ORDER BY {AUTHOR_SEARCH_RANK} DESC, a.author_id
+            LIMIT %(limit)s
+        """, params)
+        return cursor.fetchall()
+
+
+def search_texts(DB_CONFIG, term, page=0, page_size=TEXT_SEARCH_PAGE_SIZE):
+    """Отрывки книг, совпадающие с запросом, по убыванию релевантности.
+
+    Возвращает (список (book_id, название, автор, смещение совпадения в тексте, сниппет),
+    есть ли следующая страница). Сниппеты строятся только для отрывков текущей страницы:
+    их текст читается из хранилища текстов, а подсветку делает ts_headline.
+    """
+    if not term.strip():
+        return [], False
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("""
+            SELECT p.book_id, c.title, c.author_name, p.char_offset, p.char_length
+            FROM book_passages p, websearch_to_tsquery('russian', %(term)s) q, catalog c
+            WHERE p.search_vector @@ q AND c.book_id = p.book_id
+            ORDER BY ts_rank_cd(p.search_vector, q) DESC, p.book_id, p.passage_no
+            LIMIT %(limit)s OFFSET %(offset)s
+        """, {"term": term, "limit": page_size + 1, "offset": page * page_size})
+        rows = cursor.fetchall()
+    has_next = len(rows) > page_size
+    rows = rows[:page_size]
+    if not rows:
+        return [], has_next
+
+    passages = [textstore.load_slice(DB_CONFIG, book_id, offset, length)[0] or "" for book_id, _, _, offset, length in rows]
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute(f"""
+            SELECT ts_headline('russian', p.passage, websearch_to_tsquery('russian', %s), '{TEXT_SNIPPET_OPTIONS}')
+            FROM unnest(%s::text[]) WITH ORDINALITY AS p (passage, n)
+            ORDER BY p.n
+        """, (term, passages))
+        snippets = [row[0] for row in cursor.fetchall()]
+
+    hits = []
+    for (book_id, title, author_name, offset, _), passage, snippet in zip(rows, passages, snippets):
+        # Переход в читалку ведет на страницу первого подсвеченного слова, а не на начало отрывка
+        match = TEXT_SNIPPET_MARK.search(snippet)
+        position = passage.find(match.group(1)) if match else -1
+        hits.append((book_id, title, author_name, offset + max(position, 0), snippet))
+    return hits, has_next
+
+
+def session_cached(key, term, search):
+    """Выполнить поиск search(term) без лишних запросов к базе.
+
+    Результат для того же текста берется из сессии, поэтому перезапуски
+    страницы не обращаются к базе. Слишком короткий запрос не выполняется
+    (возвращается None).
+    """
+    term = term.strip()
+    if len(term) < SEARCH_MIN_LENGTH:
+        return None
+
+    state_key = f"search_{key}"
+    cached = st.session_state.get(state_key)
+    if cached and cached["term"] == term and time.monotonic() - cached["time"] < SEARCH_CACHE_TTL:
+        return cached["results"]
+
+    results = search(term)
+    st.session_state[state_key] = {"term": term, "results": results, "time": time.monotonic()}
+    return results
@@ -0,0 +1,362 @@
+import argparse
+import hashlib
+import mmap
+import os
+import re
+import tempfile
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from psycopg2.extras import execute_values
+
+from utils import db
+
+# Каталог сжатых текстов. Текст делится на блоки по TEXT_BLOCK_CHARS символов, блоки
+# сжимаются zlib по отдельности и пишутся подряд в файл <каталог>/<aa>/<sha256 настроек и текста>.z;
+# смещения блоков и оглавление лежат в Postgres. Если каталог не задан, тексты хранятся
+# в таблице book_texts
+TEXT_STORE_DIR = os.getenv("TEXT_STORE_DIR", "")
+TEXT_BLOCK_CHARS = int(os.getenv("TEXT_BLOCK_CHARS", "16384"))
+TEXT_COMPRESSION_LEVEL = int(os.getenv("TEXT_COMPRESSION_LEVEL", "6"))
+# Сколько файлов держать открытыми через mmap
+TEXT_MMAP_CACHE = int(os.getenv("TEXT_MMAP_CACHE", "64"))
+MIGRATE_BATCH = 100
+# Для полнотекстового поиска текст делится на отрывки примерно такой длины (по границам абзацев)
+PASSAGE_CHARS = int(os.getenv("PASSAGE_CHARS", "2000"))
+
+# Заголовки глав и частей для оглавления: отдельная строка "Глава 1", "ЧАСТЬ ВТОРАЯ", "Chapter IV"
+CHAPTER_HEADING = re.compile(r"^[ \t]*((?:глава|часть|chapter|part)[ \t]+\S[^\n]{0,150})$", re.IGNORECASE | re.MULTILINE)
+
+# Один запрос на отрывок: файл из индекса или, если книга еще не перенесена, substring из book_texts
+LOAD_SLICE = db.prepared("load_text_slice", """
+    SELECT f.content_hash, f.text_length, f.block_chars, f.block_offsets,
+           substring(t.book_text FROM %(start)s + 1 FOR %(length)s), t.text_length
+    FROM (SELECT %(book_id)s::int AS book_id) k
+    LEFT JOIN book_text_files f ON f.book_id = k.book_id
+    LEFT JOIN book_texts t ON t.book_id = k.book_id
+""")
+
+_maps = OrderedDict()
+_maps_lock = threading.Lock()
+_stats = {"reads": 0, "blocks_read": 0, "bytes_read": 0, "database_reads": 0, "files_written": 0, "files_deduplicated": 0}
+
+
+def enabled():
+    return bool(TEXT_STORE_DIR)
+
+
+def _path(content_hash):
+    return os.path.join(TEXT_STORE_DIR, content_hash[:2], f"{content_hash}.z")
+
+
+def chapters(text):
+    """Оглавление: [(заголовок, смещение в символах)]."""
+    return [(match.group(1).strip(), match.start(1)) for match in CHAPTER_HEADING.finditer(text)]
+
+
+def passages(text, size=PASSAGE_CHARS):
+    """Отрывки для поиска: [(смещение в символах, текст)], разрез по абзацу или пробелу."""
+    result = []
+    start = 0
+    while start < len(text):
+        end = min(len(text), start + size)
+        if end < len(text):
+            cut = text.rfind("\n", start + size // 2, end)
+            if cut == -1:
+                cut = text.rfind(" ", start + size // 2, end)
+            if cut != -1:
+                end = cut + 1
+        result.append((start, text[start:end]))
+        start = end
+    return result
+
+
+def index_texts(cursor, texts):
+    """Пересобрать оглавление и поисковый индекс отрывков книг texts = [(book_id, текст)].
+
+    Все книги пачки обрабатываются четырьмя операторами; сам текст отрывков в базе не хранится.
+    """
+    book_ids = [book_id for book_id, _ in texts]
+    cursor.execute("DELETE FROM book_chapters WHERE book_id = ANY(%s)", (book_ids,))
+    cursor.execute("DELETE FROM book_passages WHERE book_id = ANY(%s)", (book_ids,))
+    toc = [(book_id, n, title, offset) for book_id, text in texts for n, (title, offset) in enumerate(chapters(text), 1)]
+    if toc:
+        cursor.execute("""
+            INSERT INTO book_chapters (book_id, chapter_no, title, char_offset)
+            SELECT * FROM unnest(%s::int[], %s::int[], %s::text[], %s::int[])
+        """, tuple(map(list, zip(*toc))))
+    # Пустой текст получает один пустой отрывок: по нему index_missing видит, что книга обработана
+    items = [(book_id, n, offset, passage) for book_id, text in texts for n, (offset, passage) in enumerate(passages(text) or [(0, "")], 1)]
+    cursor.execute("""
+        INSERT INTO book_passages (book_id, passage_no, char_offset, char_length, search_vector)
+        SELECT book_id, n, char_offset, char_length(passage), to_tsvector('russian', passage)
+        FROM unnest(%s::int[], %s::int[], %s::int[], %s::text[]) AS p (book_id, n, char_offset, passage)
+    """, tuple(map(list, zip(*items))))
+
+
+def write_file(text, block_chars=TEXT_BLOCK_CHARS):
+    """Записать текст в хранилище; возвращает (хэш, смещения блоков в файле).
+
+    Размер блока и уровень сжатия входят в хэш: одинаковый текст, записанный с другими
+    настройками, попадает в другой файл, и смещения всегда соответствуют байтам на диске.
+    """
+    header = f"{block_chars}:{TEXT_COMPRESSION_LEVEL}:".encode("utf-8")
+    content_hash = hashlib.sha256(header + text.encode("utf-8")).hexdigest()
+    offsets = [0]
+    blocks = []
+    for start in range(0, len(text), block_chars):
+        block = zlib.compress(text[start:start + block_chars].encode("utf-8"), TEXT_COMPRESSION_LEVEL)
+        blocks.append(block)
+        offsets.append(offsets[-1] + len(block))
+
+    path = _path(content_hash)
+    if os.path.exists(path):
+        with _maps_lock:
+            _stats["files_deduplicated"] += 1
+        return content_hash, offsets
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # Запись во временный файл и переименование: читатель не увидит недописанный файл
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as file:
+            for block in blocks:
+                file.write(block)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        os.unlink(tmp_path)
+        raise
+    with _maps_lock:
+        _stats["files_written"] += 1
+    return content_hash, offsets
+
+
+def save_many(cursor, texts):
+    """Сохранить тексты книг texts = [(book_id, текст)] в транзакции cursor (в файлы или
+    в book_texts) с оглавлением и поисковым индексом отрывков; число операторов не зависит
+    от числа книг.
+
+    Файлы пишутся до commit; если транзакция откатится, они останутся без ссылок
+    и будут удалены командой --gc.
+    """
+    if not texts:
+        return
+    book_ids = [book_id for book_id, _ in texts]
+    index_texts(cursor, texts)
+
+    if not enabled():
+        cursor.execute("""
+            INSERT INTO book_texts (book_id, book_text)
+            SELECT * FROM unnest(%s::int[], %s::text[])
+            ON CONFLICT (book_id) DO UPDATE SET book_text = EXCLUDED.book_text
+        """, (book_ids, [text for _, text in texts]))
+        # Иначе чтение продолжит отдавать прежний текст из файла
+        cursor.execute("DELETE FROM book_text_files WHERE book_id = ANY(%s)", (book_ids,))
+        return
+
+    rows = [(book_id, *write_file(text), len(text)) for book_id, text in texts]
+    # Массивы смещений разной длины не разворачиваются unnest, поэтому VALUES из нескольких строк
+    execute_values(cursor, """
+        INSERT INTO book_text_files (book_id, content_hash, block_offsets, text_length, block_chars)
+        VALUES %s
+        ON CONFLICT (book_id) DO UPDATE SET
+            content_hash = EXCLUDED.content_hash, text_length = EXCLUDED.text_length,
+            block_chars = EXCLUDED.block_chars, block_offsets = EXCLUDED.block_offsets
+    """, rows, template=f"(%s, %s, %s::bigint[], %s, {TEXT_BLOCK_CHARS})", page_size=len(rows))
+    cursor.execute("DELETE FROM book_texts WHERE book_id = ANY(%s)", (book_ids,))
+
+
+def save(cursor, book_id, text):
+    """Сохранить текст одной книги (см. save_many)."""
+    save_many(cursor, [(book_id, text)])
+
+
+def _open(content_hash):
+    """Файл текста через mmap; недавно открытые файлы остаются открытыми."""
+    with _maps_lock:
+        mapped = _maps.get(content_hash)
+        if mapped is not None:
+            _maps.move_to_end(content_hash)
+            return mapped
+    with open(_path(content_hash), "rb") as file:
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    with _maps_lock:
+        if content_hash in _maps:
+            mapped.close()
+            return _maps[content_hash]
+        _maps[content_hash] = mapped
+        # Вытесненный файл не закрывается явно: его может читать другой поток,
+        # mmap освободится сборщиком мусора
+        while len(_maps) > TEXT_MMAP_CACHE:
+            _maps.popitem(last=False)
+        return mapped
+
+
+def read_file(content_hash, block_chars, offsets, start, length):
+    """Символы [start, start + length) текста из файла: распаковываются только нужные блоки."""
+    first = start // block_chars
+    last = min(len(offsets) - 1, -(-(start + length) // block_chars))
+    if first >= last:
+        return ""
+    mapped = _open(content_hash)
+    data = mapped[offsets[first]:offsets[last]]
+    blocks = [
+        zlib.decompress(data[offsets[i] - offsets[first]:offsets[i + 1] - offsets[first]]).decode("utf-8")
+        for i in range(first, last)
+    ]
+    with _maps_lock:
+        _stats["reads"] += 1
+        _stats["blocks_read"] += last - first
+        _stats["bytes_read"] += len(data)
+    skip = start - first * block_chars
+    return "".join(blocks)[skip:skip + length]
+
+
+def load_slice(DB_CONFIG, book_id, start, length):
+    """Отрывок текста книги и полная длина текста в символах; (None, 0), если текста нет."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute(LOAD_SLICE, {"book_id": book_id, "start": start, "length": length})
+        content_hash, text_length, block_chars, offsets, chunk, db_length = cursor.fetchone()
+    if content_hash is not None:
+        return read_file(content_hash, block_chars, offsets, start, length), text_length
+    if chunk is None:
+        return None, 0
+    with _maps_lock:
+        _stats["database_reads"] += 1
+    return chunk, db_length
+
+
+def load_text(DB_CONFIG, book_id):
+    """Полный текст книги или None."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("""
+            SELECT f.content_hash, f.text_length, f.block_chars, f.block_offsets, t.book_text
+            FROM (SELECT %s::int AS book_id) k
+            LEFT JOIN book_text_files f ON f.book_id = k.book_id
+            LEFT JOIN book_texts t ON t.book_id = k.book_id
+        """, (book_id,))
+        content_hash, text_length, block_chars, offsets, text = cursor.fetchone()
+    if content_hash is not None:
+        return read_file(content_hash, block_chars, offsets, 0, text_length)
+    return text
+
+
+def load_chapters(DB_CONFIG, book_id):
+    """Оглавление книги: [(заголовок, смещение в символах)]."""
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("SELECT title, char_offset FROM book_chapters WHERE book_id = %s ORDER BY chapter_no", (book_id,))
+        return cursor.fetchall()
+
+
+def migrate(DB_CONFIG, batch=MIGRATE_BATCH):
+    """Перенести тексты из book_texts в файлы пачками; каждая пачка - отдельная транзакция."""
+    if not enabled():
+        raise RuntimeError("TEXT_STORE_DIR не задан")
+    moved = 0
+    while True:
+        started = time.perf_counter()
+        with db.transaction(DB_CONFIG) as cursor:
+            # SKIP LOCKED: несколько запусков переносят разные книги
+            cursor.execute("SELECT book_id, book_text FROM book_texts ORDER BY book_id LIMIT %s FOR UPDATE SKIP LOCKED", (batch,))
+            rows = cursor.fetchall()
+            save_many(cursor, rows)
+        if not rows:
+            return moved
+        moved += len(rows)
+        print(f"Перенесено текстов: {moved} (пачка за {time.perf_counter() - started:.1f} с)")
+
+
+def index_missing(DB_CONFIG, batch=MIGRATE_BATCH):
+    """Построить оглавление и поисковый индекс отрывков для книг без него: сохраненных
+    до его появления или загруженных import_catalog.py напрямую в book_texts."""
+    indexed = 0
+    while True:
+        started = time.perf_counter()
+        with db.cursor(DB_CONFIG, primary=True) as cursor:
+            cursor.execute("""
+                SELECT book_id FROM (SELECT book_id FROM book_texts UNION SELECT book_id FROM book_text_files) t
+                WHERE NOT EXISTS (SELECT 1 FROM book_passages p WHERE p.book_id = t.book_id)
+                ORDER BY book_id
+                LIMIT %s
+            """, (batch,))
+            book_ids = [row[0] for row in cursor.fetchall()]
+        if not book_ids:
+            return indexed
+        with db.transaction(DB_CONFIG) as cursor:
+            cursor.execute("""
+                SELECT k.book_id, f.content_hash, f.text_length, f.block_chars, f.block_offsets, t.book_text
+                FROM unnest(%s::int[]) AS k (book_id)
+                LEFT JOIN book_text_files f ON f.book_id = k.book_id
+                LEFT JOIN book_texts t ON t.book_id = k.book_id
+            """, (book_ids,))
+            texts = [
+                (book_id, read_file(content_hash, block_chars, offsets, 0, text_length) if content_hash is not None else text or "")
+                for book_id, content_hash, text_length, block_chars, offsets, text in cursor.fetchall()
+            ]
+            index_texts(cursor, texts)
+        indexed += len(book_ids)
+        print(f"Проиндексировано текстов: {indexed} (пачка за {time.perf_counter() - started:.1f} с)")
+
+
+def collect_garbage(DB_CONFIG):
+    """Удалить файлы, на которые не ссылается ни одна книга; возвращает число удаленных."""
+    with db.cursor(DB_CONFIG, primary=True) as cursor:
+        cursor.execute("SELECT DISTINCT content_hash FROM book_text_files")
+        referenced = {row[0] for row in cursor.fetchall()}
+    removed = 0
+    for directory, _, filenames in os.walk(TEXT_STORE_DIR):
+        for filename in filenames:
+            content_hash, extension = os.path.splitext(filename)
+            path = os.path.join(directory, filename)
+            # Временные файлы моложе часа могут дописываться прямо сейчас
+            if extension == ".tmp" and time.time() - os.path.getmtime(path) < 3600:
+                continue
+            if extension == ".z" and content_hash in referenced:
+                continue
+            os.unlink(path)
+            removed += 1
+    return removed
+
+
+def text_store_stats(DB_CONFIG):
+    """Объем хранилища и счетчики чтения отрывков."""
+    with _maps_lock:
+        stats = dict(_stats, open_files=len(_maps))
+    with db.cursor(DB_CONFIG) as cursor:
+        cursor.execute("""
+            SELECT (SELECT COUNT(*) FROM book_text_files),
+                   (SELECT COALESCE(SUM(text_length), 0) FROM book_text_files),
+                   (SELECT COALESCE(SUM(block_offsets[array_upper(block_offsets, 1)]), 0) FROM book_text_files),
+                   (SELECT COUNT(*) FROM book_texts)
+        """)
+        stats["files_books"], stats["files_chars"], stats["files_bytes"], stats["database_books"] = cursor.fetchone()
+    stats["enabled"] = enabled()
+    stats["directory"] = TEXT_STORE_DIR
+    return stats
+
+
+if __name__ == "__main__":
+    # Перенос текстов из book_texts: python -m utils.textstore --migrate
+    # Параметры подключения из .env (загружает utils.db), как в migrate.py: импорт app
+    # запустил бы сервер метрик и фоновые потоки приложения
+    DB_CONFIG = {
+        "host": os.getenv("DB_HOST"),
+        "database": os.getenv("DB_DATABASE"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD")
+    }
+
+    parser = argparse.ArgumentParser(description="Хранилище текстов книг в сжатых файлах")
+    parser.add_argument("--migrate", action="store_true", help="перенести тексты из book_texts в файлы")
+    parser.add_argument("--gc", action="store_true", help="удалить файлы без ссылок")
+    parser.add_argument("--index", action="store_true", help="построить поисковый индекс отрывков для старых текстов")
+    args = parser.parse_args()
+    if args.migrate:
+        print(f"Готово, перенесено текстов: {migrate(DB_CONFIG)}")
+    if args.index:
+        print(f"Готово, проиндексировано текстов: {index_missing(DB_CONFIG)}")
+    if args.gc:
+        print(f"Удалено файлов: {collect_garbage(DB_CONFIG)}")
@@ -0,0 +1,337 @@
+import atexit
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+
+from utils import cache, db, recommendations
+
+# Лайки и комментарии копятся в очереди и записываются пачками: одна транзакция
+# (и один fsync) на пачку вместо одной на событие. WRITE_BEHIND=0 отключает очередь
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "1") != "0"
+# Пачка записывается, когда в ней WRITE_BATCH_SIZE событий или прошло WRITE_FLUSH_INTERVAL
+# секунд с первого события; пользователь ждет результат не дольше этого интервала
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "500"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "0.05"))
+# При переполненной очереди событие ждет места WRITE_QUEUE_TIMEOUT секунд, затем отклоняется
+WRITE_QUEUE_MAX = int(os.getenv("WRITE_QUEUE_MAX", "5000"))
+WRITE_QUEUE_TIMEOUT = float(os.getenv("WRITE_QUEUE_TIMEOUT", "2"))
+WRITE_RESULT_TIMEOUT = float(os.getenv("WRITE_RESULT_TIMEOUT", "30"))
+
+# Многострочные операторы: массивы параметров разворачиваются unnest, RETURNING
+# возвращает реально измененные строки, по ним каждое событие получает свой результат.
+# Дата комментария - время сервера базы (как у остальных записей), clock_timestamp()
+# растет от строки к строке, поэтому по ней восстанавливается порядок вставки
+INSERT_LIKES = db.prepared("flush_likes", """
+    INSERT INTO liked_books (user_id, book_id)
+    SELECT * FROM unnest(%s::int[], %s::int[])
+    ON CONFLICT DO NOTHING
+    RETURNING user_id, book_id
+""")
+DELETE_LIKES = db.prepared("flush_unlikes", """
+    DELETE FROM liked_books lb
+    USING unnest(%s::int[], %s::int[]) AS d (user_id, book_id)
+    WHERE lb.user_id = d.user_id AND lb.book_id = d.book_id
+    RETURNING lb.user_id, lb.book_id
+""")
+INSERT_COMMENTS = db.prepared("flush_comments", """
+    WITH inserted AS (
+        INSERT INTO comments (book_id, user_id, comment_text, date)
+        SELECT book_id, user_id, comment_text, clock_timestamp()
+        FROM unnest(%s::int[], %s::int[], %s::text[]) WITH ORDINALITY AS c (book_id, user_id, comment_text, n)
+        ORDER BY n
+        ON CONFLICT DO NOTHING
+        RETURNING book_id, user_id, date
+    )
+    SELECT book_id, user_id, date FROM inserted ORDER BY date
+""")
+
+
+class WriteFailed(Exception):
+    """Событие не записано или результат записи неизвестен."""
+
+
+class WriteQueueFull(WriteFailed):
+    """Очередь записи переполнена."""
+
+
+class Event:
+    """Лайк, снятие лайка или комментарий; результат (записано или нет) приходит в future."""
+
+    def __init__(self, db_config, kind, user_id, book_id, text=None):
+        self.db_config = db_config
+        self.kind = kind
+        self.user_id = user_id
+        self.book_id = book_id
+        self.text = text
+        # Дату комментария назначает база при записи
+        self.date = None
+        self.future = Future()
+
+    def key(self):
+        if self.kind == "comment":
+            return (self.book_id, self.user_id)
+        return (self.user_id, self.book_id)
+
+
+_queue = queue.Queue(maxsize=WRITE_QUEUE_MAX)
+_lock = threading.Lock()
+_thread = None
+_stopping = False
+_stats = {
+    "submitted": 0,
+    "rejected": 0,
+    "events": 0,
+    "written": 0,
+    "batches": 0,
+    "commits": 0,
+    "fallbacks": 0,
+    "errors": 0,
+    "queue_depth_max": 0,
+    "batch_size_max": 0,
+    "flush_time_total": 0.0,
+}
+
+
+def _apply(cursor, kind, events):
+    """Записать события одного вида одним оператором; результат - признак изменения для каждого события."""
+    if kind == "like":
+        cursor.execute(INSERT_LIKES, ([e.user_id for e in events], [e.book_id for e in events]))
+    elif kind == "unlike":
+        cursor.execute(DELETE_LIKES, ([e.user_id for e in events], [e.book_id for e in events]))
+    else:
+        cursor.execute(INSERT_COMMENTS, ([e.book_id for e in events], [e.user_id for e in events], [e.text for e in events]))
+        # Строки вернулись в порядке вставки: события с тем же (книга, пользователь)
+        # получают даты по порядку
+        dates = {}
+        for book_id, user_id, date in cursor.fetchall():
+            dates.setdefault((book_id, user_id), []).append(date)
+        results = []
+        for event in events:
+            # Дата от откаченной попытки записи пачки не считается
+            returned = dates.get(event.key())
+            event.date = returned.pop(0) if returned else None
+            results.append(event.date is not None)
+        return results
+
+    changed = {tuple(row) for row in cursor.fetchall()}
+    results = []
+    for event in events:
+        # Повтор того же события в пачке не считается второй записью
+        results.append(event.key() in changed)
+        changed.discard(event.key())
+    return results
+
+
+def _runs(events):
+    """Подряд идущие события одного вида: порядок лайка и снятия лайка сохраняется."""
+    runs = []
+    for event in events:
+        if runs and runs[-1][0] == event.kind:
+            runs[-1][1].append(event)
+        else:
+            runs.append((event.kind, [event]))
+    return runs
+
+
+def _write(db_config, events):
+    """Записать пачку в одной транзакции; результат - признак изменения для каждого события."""
+    results = []
+    with db.transaction(db_config) as cursor:
+        for kind, run in _runs(events):
+            results += _apply(cursor, kind, run)
+    with _lock:
+        _stats["commits"] += 1
+    return results
+
+
+def _invalidate(events, results):
+    """Сбросить кэш и отметить книги для пересчета рекомендаций после записи."""
+    tags = set()
+    for event, changed in zip(events, results):
+        if not changed:
+            continue
+        tags.add("books")
+        if event.kind == "comment":
+            tags.add(f"comments:{event.book_id}")
+        else:
+            tags.add(f"likes:{event.user_id}")
+            recommendations.mark_changed(event.db_config, event.book_id)
+    if tags:
+        cache.invalidate(*tags)
+
+
+def _write_batch(db_config, events):
+    """Результаты записи пачки; ошибка события возвращается вместо его результата."""
+    try:
+        return _write(db_config, events)
+    except Exception:
+        # Ошибка одного события (например, книгу удалили) не должна отменять остальные:
+        # пачка записывается заново по одному событию
+        with _lock:
+            _stats["fallbacks"] += 1
+    results = []
+    for event in events:
+        try:
+            results.append(_write(db_config, [event])[0])
+        except Exception as e:
+            with _lock:
+                _stats["errors"] += 1
+            results.append(e)
+    return results
+
+
+def _flush(events):
+    """Записать пачку и передать результаты ожидающим."""
+    started = time.perf_counter()
+    # В процессе обычно одна база, но события разных баз не смешиваются в одной транзакции
+    databases = {}
+    for event in events:
+        databases.setdefault(tuple(sorted(event.db_config.items())), []).append(event)
+    events, results = [], []
+    for database_events in databases.values():
+        events += database_events
+        results += _write_batch(database_events[0].db_config, database_events)
+
+    _invalidate(events, [result is True for result in results])
+    for event, result in zip(events, results):
+        if isinstance(result, Exception):
+            event.future.set_exception(result)
+        else:
+            event.future.set_result(result)
+    with _lock:
+        _stats["batches"] += 1
+        _stats["events"] += len(events)
+        _stats["written"] += sum(1 for result in results if result is True)
+        _stats["batch_size_max"] = max(_stats["batch_size_max"], len(events))
+        _stats["flush_time_total"] += time.perf_counter() - started
+
+
+def _flush_safe(events):
+    """Записать пачку; при сбое вне записи (кэш, рекомендации) ошибку получают все еще ждущие события."""
+    try:
+        _flush(events)
+    except Exception as e:
+        with _lock:
+            _stats["errors"] += 1
+        for event in events:
+            if not event.future.done():
+                event.future.set_exception(e)
+
+
+def _collect(first):
+    """Добрать пачку до WRITE_BATCH_SIZE событий или до истечения WRITE_FLUSH_INTERVAL.
+
+    Возвращает (события, встречен ли сигнал остановки).
+    """
+    events = [first]
+    deadline = time.monotonic() + WRITE_FLUSH_INTERVAL
+    while len(events) < WRITE_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        try:
+            event = _queue.get(timeout=remaining) if remaining > 0 else _queue.get_nowait()
+        except queue.Empty:
+            break
+        if event is None:
+            return events, True
+        events.append(event)
+    return events, False
+
+
+def _flush_loop():
+    while True:
+        first = _queue.get()
+        if first is None:
+            return
+        events, stop = _collect(first)
+        # Поток продолжает работу после ошибки, иначе очередь перестала бы разбираться
+        _flush_safe(events)
+        if stop:
+            return
+
+
+def _start():
+    global _thread
+    with _lock:
+        # Поток перезапускается, если он завершился
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_flush_loop, daemon=True, name="write-behind")
+            _thread.start()
+
+
+def submit(DB_CONFIG, kind, user_id, book_id, text=None):
+    """Поставить событие в очередь и дождаться его записи.
+
+    Возвращает True, если строка изменилась (лайк поставлен, комментарий добавлен),
+    и False для повтора. WriteQueueFull, если очередь не освободилась за WRITE_QUEUE_TIMEOUT;
+    WriteFailed, если запись не удалась или результат не пришел за WRITE_RESULT_TIMEOUT.
+    """
+    event = Event(DB_CONFIG, kind, user_id, book_id, text)
+    if not WRITE_BEHIND:
+        _flush_safe([event])
+        return _result(event)
+    if _stopping:
+        raise WriteQueueFull("Сервер останавливается, повторите действие позже.")
+
+    _start()
+    try:
+        _queue.put(event, timeout=WRITE_QUEUE_TIMEOUT)
+    except queue.Full:
+        with _lock:
+            _stats["rejected"] += 1
+        raise WriteQueueFull("Сервер перегружен, повторите действие позже.")
+    with _lock:
+        _stats["submitted"] += 1
+        _stats["queue_depth_max"] = max(_stats["queue_depth_max"], _queue.qsize())
+    return _result(event)
+
+
+def _result(event):
+    """Результат записи события; ошибка базы и таймаут становятся WriteFailed."""
+    try:
+        return event.future.result(timeout=WRITE_RESULT_TIMEOUT)
+    except FutureTimeoutError:
+        raise WriteFailed("Сервер не подтвердил запись вовремя, обновите страницу и проверьте результат.")
+    except Exception as e:
+        raise WriteFailed("Не удалось сохранить действие, попробуйте еще раз.") from e
+
+
+def close(timeout=WRITE_RESULT_TIMEOUT):
+    """Записать все события из очереди и остановить поток (вызывается при выходе)."""
+    global _stopping
+    _stopping = True
+    with _lock:
+        thread = _thread
+    if thread is None:
+        return
+    _queue.put(None, timeout=timeout)
+    thread.join(timeout)
+    # События, поставленные одновременно с сигналом остановки, записываются здесь
+    events = []
+    while True:
+        try:
+            event = _queue.get_nowait()
+        except queue.Empty:
+            break
+        if event is not None:
+            events.append(event)
+    if events:
+        _flush_safe(events)
+
+
+atexit.register(close)
+
+
+def write_stats():
+    """Метрики очереди записи: глубина, размер пачек, число транзакций."""
+    with _lock:
+        stats = dict(_stats)
+    stats["queue_depth"] = _queue.qsize()
+    stats["queue_max"] = WRITE_QUEUE_MAX
+    stats["enabled"] = WRITE_BEHIND
+    stats["batch_size_avg"] = stats["events"] / stats["batches"] if stats["batches"] else 0.0
+    stats["flush_time_avg"] = stats["flush_time_total"] / stats["batches"] if stats["batches"] else 0.0
+    # Во сколько раз меньше транзакций, чем событий
+    stats["events_per_commit"] = stats["events"] / stats["commits"] if stats["commits"] else 0.0
+    return stats